@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+
+# Session info of the last login, so later runs can skip the Kerberos or SSL
+# handshake while the hub session is still valid
+SESSION_CACHE = os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "brew-channel-validation",
+    "session.json",
+)
+# Idle hub connections kept open, shared by every session of a context
+POOL_SIZE = 32
+
+
+class brew_context:
+    """
+    Shared koji profile and session. Both are resolved on first use and
+    cached, so importing a module that needs brew costs nothing until a
+    call is actually made.
+
+    With login, sessions are authenticated. One login is kept per process
+    (and across runs in session_cache) and every session gets its own hub
+    subsession of it, so worker threads don't log in again. Sessions whose
+    login expired log in again and retry the call.
+
+    All sessions share one connection pool to the hub, so new sessions for
+    worker threads reuse open connections instead of handshaking again.
+    """
+
+    def __init__(self, profile_name="brew", login=False, session_cache=SESSION_CACHE):
+        self.profile_name = str(profile_name)
+        self.login = bool(login)
+        self.session_cache = session_cache
+        self._lock = threading.Lock()
+        self._auth_lock = threading.Lock()
+        self._profile = None
+        self._session = None
+        self._login_session = None
+        self._http_adapter = None
+
+    @property
+    def profile(self):
+        """
+        The koji profile module for profile_name
+        """
+        if self._profile is None:
+            with self._lock:
+                if self._profile is None:
+                    import koji
+
+                    # Note, get_profile_module() raises
+                    # koji.ConfigurationError if we could not find the profile
+                    # in /etc/koji.conf.d/*.conf and ~/.koji/config.d/*.conf
+                    self._profile = koji.get_profile_module(self.profile_name)
+        return self._profile
+
+    @property
+    def topurl(self):
+        return self.profile.config.topurl
+
+    def new_session(self, timeout=None, max_retries=None):
+        """
+        Returns a new ClientSession for the profile. koji sessions are not
+        thread safe, so worker threads need their own.
+
+        timeout (seconds per call) and max_retries override the profile's
+        settings. koji retries failed calls itself every retry_interval
+        seconds, pass max_retries=0 when retrying with resilience.retry_policy
+        instead.
+        """
+        opts = dict(vars(self.profile.config))
+        if timeout is not None:
+            opts["timeout"] = timeout
+        if max_retries is not None:
+            opts["max_retries"] = max_retries
+        if not self.login:
+            return self._share_pool(
+                self.profile.ClientSession(self.profile.config.server, opts)
+            )
+
+        login, sinfo = self.subsession()
+        session = self.profile.ClientSession(self.profile.config.server, opts, sinfo)
+        return authenticated_session(self._share_pool(session), self, login)
+
+    def _share_pool(self, session):
+        """
+        Mounts the context's HTTP adapter on the requests session of a koji
+        session and returns it. koji replaces its requests session after a
+        connection error, that session then keeps a pool of its own.
+        """
+        rsession = getattr(session, "rsession", None)
+        if rsession is None:
+            return session
+        if self._http_adapter is None:
+            with self._lock:
+                if self._http_adapter is None:
+                    from requests.adapters import HTTPAdapter
+
+                    self._http_adapter = HTTPAdapter(
+                        pool_connections=1, pool_maxsize=POOL_SIZE
+                    )
+        rsession.mount("https://", self._http_adapter)
+        rsession.mount("http://", self._http_adapter)
+        return session
+
+    @property
+    def session(self):
+        """
+        The shared ClientSession, created on first use
+        """
+        if self._session is None:
+            session = self.new_session()
+            with self._lock:
+                if self._session is None:
+                    self._session = session
+        return self._session
+
+    def subsession(self, expired=None):
+        """
+        returns the process wide login and the session info of a new hub
+        subsession of it, logging in first if there is no valid login.
+
+        expired is the login a session found to have expired. It is only
+        replaced if it is still the current login, so sessions of the same
+        login expiring together log in once.
+        """
+        import koji
+
+        with self._auth_lock:
+            if self._login_session is None:
+                self._login_session = self._log_in()
+            elif expired is not None and expired is self._login_session:
+                self._login_session = self._log_in(restore=False)
+            try:
+                sinfo = self._login_session.callMethod("subsession")
+            except koji.AuthExpired:
+                self._login_session = self._log_in(restore=False)
+                sinfo = self._login_session.callMethod("subsession")
+            return self._login_session, sinfo
+
+    def _log_in(self, restore=True):
+        """
+        returns a logged in ClientSession, restored from session_cache if
+        restore and the cached login is still valid. New logins are saved to
+        session_cache.
+        """
+        import koji
+
+        config = self.profile.config
+        session = self.profile.ClientSession(config.server, dict(vars(config)))
+        if restore and self.session_cache and os.path.exists(self.session_cache):
+            with open(self.session_cache) as fp:
+                cached = json.load(fp)
+            session.setSession(cached["sinfo"])
+            # The hub rejects calls numbered below the last one it saw
+            session.callnum = cached["callnum"]
+            try:
+                if session.getLoggedInUser():
+                    return session
+            except koji.AuthError:
+                pass
+            session.setSession(None)
+
+        if getattr(config, "authtype", None) == "ssl":
+            session.ssl_login(config.cert, None, config.serverca)
+        else:
+            session.gssapi_login(
+                principal=getattr(config, "principal", None),
+                keytab=getattr(config, "keytab", None),
+            )
+        self._save_login(session)
+        return session
+
+    def _save_login(self, session):
+        """
+        Writes the session info and call number of a login session to
+        session_cache, readable by the user only
+        """
+        if not self.session_cache:
+            return
+        path = self.session_cache
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd = os.open(path + ".part", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as fp:
+            json.dump(
+                {
+                    "sinfo": session.sinfo,
+                    "callnum": session.callnum,
+                },
+                fp,
+            )
+        os.replace(path + ".part", path)
+
+
+class authenticated_session:
+    """
+    Wraps a logged in koji session so a call failing because the login
+    expired logs in again (see brew_context.subsession) and is retried
+    once. Multicalls are passed through as is.
+    """
+
+    def __init__(self, session, context, login):
+        self._session = session
+        self.context = context
+        self.login = login
+
+    def __getattr__(self, name):
+        attr = getattr(self._session, name)
+        if name == "multicall" or not callable(attr):
+            return attr
+
+        def authenticated(*args, **kwargs):
+            import koji
+
+            try:
+                return attr(*args, **kwargs)
+            except koji.AuthExpired:
+                self.login, sinfo = self.context.subsession(expired=self.login)
+                self._session.setSession(sinfo)
+                return attr(*args, **kwargs)
+
+        return authenticated
+
+
+_context = None
+
+
+def get_context():
+    """
+    returns the process wide brew_context
+    """
+    global _context
+    if _context is None:
+        _context = brew_context()
+    return _context
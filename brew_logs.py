@@ -1,28 +1,200 @@
+import argparse
 import os
-import requests
-import koji
-
-# Note, get_profile_module() raises koji.ConfigurationError if we
-# could not find a "brew" profile in /etc/koji.conf.d/*.conf and
-# ~/.koji/config.d/*.conf:
-mykoji = koji.get_profile_module("brew")
-
-opts = vars(mykoji.config)
-session = mykoji.ClientSession(mykoji.config.server, opts)
-
-build = session.getBuild("ceph-14.2.21-16.el8cp")
-build_id = build["id"]
-
-all_logs = session.getBuildLogs(build_id)
-hw_logs = [log for log in all_logs if log["name"] == "hw_info.log"]
-
-for log in hw_logs:
-    arch = log["dir"]
-    os.makedirs(arch, exist_ok=True)  # eg "x86_64" subdirectory
-    url = os.path.join(mykoji.config.topurl, log["path"])
-    print(url)
-    response = requests.get(url)
-    response.raise_for_status()
-    local_path = os.path.join(arch, "hw_info.log")
-    with open(local_path, "w") as f:
-        f.write(response.text)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from brew_context import get_context
+from downloads import download_file, http_session, write_file
+from logstore import log_store
+from multicall import call_batched
+
+# Number of logs downloaded at the same time
+WORKERS = 8
+
+
+def parse_build_arg(build):
+    """
+    Build ids are passed to the hub as ints, everything else as an NVR
+    """
+    if build.isdigit():
+        return int(build)
+    return build
+
+
+def resolve_builds(session, builds):
+    """
+    Looks up every build (NVR or build id) with a single multicall
+
+    returns a list of build info dicts, raises SystemExit if a build is
+    not found
+    """
+    results = call_batched(
+        session, "getBuild", [(parse_build_arg(build),) for build in builds]
+    )
+    for build, build_info in zip(builds, results):
+        if build_info is None:
+            raise SystemExit(f"Build not found: {build}")
+    return results
+
+
+def find_logs(session, build_infos, names, arches=None):
+    """
+    Lists the logs for every build with a single multicall and keeps the
+    ones matching names (and arches, if given)
+
+    returns a list of (build_info, log) tuples
+    """
+    all_logs = call_batched(
+        session, "getBuildLogs", [(build_info["id"],) for build_info in build_infos]
+    )
+    matches = []
+    for build_info, logs in zip(build_infos, all_logs):
+        for log in logs:
+            if log["name"] not in names:
+                continue
+            if arches and log["dir"] not in arches:
+                continue
+            matches.append((build_info, log))
+    return matches
+
+
+def local_log_path(output_dir, build_info, log):
+    """
+    Logs are stored as <output_dir>/<nvr>/<arch>/<log name>
+    """
+    return os.path.join(output_dir, build_info["nvr"], log["dir"], log["name"])
+
+
+def fetch_log(topurl, output_dir, build_info, log, store=None):
+    """
+    Downloads a single log, returns (local path, download status).
+
+    If store (a logstore.log_store) is given, logs it already holds are
+    written out from the store without touching the network ("cached"), or
+    after the server confirmed them with a 304 if the store revalidates
+    ("not_modified"). Other logs are downloaded like without a store
+    (streamed, resumed or skipped, see downloads.download_file) and then
+    added to it.
+    """
+    local_path = local_log_path(output_dir, build_info, log)
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    url = os.path.join(topurl, log["path"])
+    key = (build_info["id"], log["dir"], log["name"])
+
+    if store is not None and key in store:
+        data, status = store.fetch_status(*key, url, http=http_session())
+        if status != "downloaded" and os.path.exists(local_path):
+            if os.path.getsize(local_path) == len(data):
+                return local_path, "skipped"
+        write_file(local_path, data)
+        return local_path, status
+
+    validators = {}
+    status = download_file(url, local_path, http=http_session(), validators=validators)
+    if store is not None:
+        store.put_download(
+            *key,
+            local_path,
+            validators.get("ETag"),
+            validators.get("Last-Modified"),
+            status,
+        )
+    return local_path, status
+
+
+def download_logs(topurl, output_dir, matches, workers=WORKERS, store=None):
+    """
+    Downloads all matched logs concurrently
+
+    returns a dict of {download status: count}
+    """
+    counts = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(fetch_log, topurl, output_dir, build_info, log, store)
+            for build_info, log in matches
+        ]
+        for future in as_completed(futures):
+            local_path, status = future.result()
+            counts[status] = counts.get(status, 0) + 1
+            print(f"{status}: {local_path}")
+    return counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Download build logs (eg hw_info.log) for brew builds"
+    )
+    parser.add_argument("builds", nargs="+", help="build NVRs or build ids")
+    parser.add_argument(
+        "-n",
+        "--name",
+        action="append",
+        dest="names",
+        help="log file name to download, may be repeated (default: hw_info.log)",
+    )
+    parser.add_argument(
+        "-a",
+        "--arch",
+        action="append",
+        dest="arches",
+        help="only download logs for this arch, may be repeated",
+    )
+    parser.add_argument(
+        "-o", "--output-dir", default=".", help="directory to store logs in"
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help=f"number of concurrent downloads (default: {WORKERS})",
+    )
+    parser.add_argument(
+        "--store",
+        metavar="DIR",
+        help="keep logs in a local log store and reuse them across runs",
+    )
+    parser.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="check logs in --store with the server (ETag/Last-Modified) "
+        "before reusing them",
+    )
+    parser.add_argument(
+        "--login",
+        action="store_true",
+        help="log in to the hub, reusing the login of earlier runs while it is "
+        "valid",
+    )
+    args = parser.parse_args(argv)
+    if not args.names:
+        args.names = ["hw_info.log"]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    context = get_context()
+    if args.login:
+        context.login = True
+    session = context.session
+
+    build_infos = resolve_builds(session, args.builds)
+    matches = find_logs(session, build_infos, args.names, args.arches)
+    store = None
+    if args.store:
+        store = log_store(args.store, revalidate=args.revalidate)
+    counts = download_logs(
+        context.topurl,
+        args.output_dir,
+        matches,
+        workers=args.workers,
+        store=store,
+    )
+    print(f"{len(matches)} logs for {len(build_infos)} builds: {counts}")
+    if store is not None:
+        print(f"log store: {store.counters}")
+
+
+if __name__ == "__main__":
+    main()
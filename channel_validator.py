@@ -1,10 +1,13 @@
 import os
-import requests
-import koji
-import re
-import time
-from datetime import datetime
-from pprint import pprint
+from datetime import date, datetime
+from brew_context import get_context
+
+# (connect, read) timeout in seconds for log downloads
+LOG_TIMEOUT = (10, 60)
+# Host descriptions older than this many days are checked against build logs
+DESCRIPTION_MAX_AGE = 90
+# Ways channel.config_check can group hosts
+GROUPING_ENGINES = ["greedy", "buckets", "cluster"]
 
 
 class channel:
@@ -22,21 +25,26 @@ class channel:
         """
         Returns a str for a channel object
         """
-        channel_str = (
-            f"Channel: {self.name}\nChannel ID: {self.id}\nHosts in Channel: [\n"
-        )
-        for hosts in self.host_list:
-            channel_str += f"{hosts}\n"
-        channel_str += "]"
+        channel_lines = [
+            f"Channel: {self.name}",
+            f"Channel ID: {self.id}",
+            "Hosts in Channel: [",
+        ]
+        channel_lines.extend(str(hosts) for hosts in self.host_list)
+        channel_lines.append("]")
 
-        return channel_str
+        return "\n".join(channel_lines)
 
     def collect_hosts(self, session):
         """
         Finds all the hosts for the channel and adds them to host_list
         """
-        list_host_response = session.listHosts(channelID=self.id)
+        self.add_hosts(session.listHosts(channelID=self.id))
 
+    def add_hosts(self, list_host_response):
+        """
+        Adds host objects to host_list for the entries of a listHosts response
+        """
         for hosts in list_host_response:
             self.host_list.append(
                 host(
@@ -48,31 +56,129 @@ class channel:
                 )
             )
 
-    def config_check(self):
+    def hosts_needing_logs(self, max_age=DESCRIPTION_MAX_AGE, today=None):
+        """
+        returns the hosts whose description can't be trusted for hardware
+        information: hosts without CPU(s)/Ram in their description, hosts
+        whose description is older than max_age days and hosts whose
+        description disagrees with the largest configuration group of the
+        channel
+        """
+        needing_logs = []
+        described = []
+        for hosts in self.host_list:
+            age = hosts.description_age(today)
+            if hosts.hw_source != "description" or age is None or age > max_age:
+                needing_logs.append(hosts)
+            else:
+                described.append(hosts)
+
+        if len(described) > 0:
+            majority = max(group_hosts(described), key=len)
+            majority_set = set(majority)
+            needing_logs.extend(h for h in described if h not in majority_set)
+
+        return needing_logs
+
+    def collect_hw_info(self, session, max_age=DESCRIPTION_MAX_AGE, store=None):
+        """
+        Fills in hardware information for the hosts in host_list. Hardware
+        information from the listHosts description is used as is, build logs
+        are only looked up for hosts returned by hosts_needing_logs.
+
+        returns the list of hosts that needed a log lookup
+        """
+        needing_logs = self.hosts_needing_logs(max_age)
+        for hosts in needing_logs:
+            hosts.find_builds_for_host(session)
+            hosts.get_hw_info(session, store)
+            print(f"collected host: {hosts.id}")
+        return needing_logs
+
+    def defer_hw_info(self, session, max_age=DESCRIPTION_MAX_AGE, store=None):
+        """
+        Makes the hardware information of the hosts in host_list lazy.
+        Nothing is looked up until the hw_dict of one of the hosts is read,
+        then resolve_hw_info looks it up for every host of the channel still
+        waiting. Host names, ids, enabled state and arches are read without
+        looking anything up.
+        """
+
+        def resolver(hosts):
+            self.resolve_hw_info(session, max_age, store)
+
+        for hosts in self.host_list:
+            hosts.hw_resolver = resolver
+
+    def resolve_hw_info(self, session, max_age=DESCRIPTION_MAX_AGE, store=None):
+        """
+        Fills in hardware information for the hosts defer_hw_info left
+        waiting, like collect_hw_info but the latest build of every host
+        needing logs is found with one multicall for all of them (see
+        hwhistory.recent_builds) instead of a listTasks/listBuilds chain per
+        host.
+
+        returns the list of hosts that needed a log lookup
+        """
+        from hwhistory import recent_builds
+
+        waiting = [hosts for hosts in self.host_list if hosts.hw_resolver is not None]
+        for hosts in waiting:
+            hosts.hw_resolver = None
+        waiting_ids = {hosts.id for hosts in waiting}
+        needing_logs = [
+            hosts
+            for hosts in self.hosts_needing_logs(max_age)
+            if hosts.id in waiting_ids
+        ]
+
+        builds = recent_builds(session, needing_logs, depth=1)
+        for hosts in needing_logs:
+            for brew_task, build_info in builds[hosts.id]:
+                hosts.task_list.append(
+                    task(
+                        task_id=brew_task["id"],
+                        parent_id=brew_task["parent"],
+                        build_info=build_info,
+                        arch=brew_task.get("arch"),
+                        label=brew_task.get("label"),
+                    )
+                )
+            hosts.get_hw_info(session, store)
+        return needing_logs
+
+    def config_check(self, model=None, engine=None):
         """
         returns a list of host configuration groupings for the channel. Hosts
         are grouped together based on similar configurations.
+
+        engine picks how hosts are grouped (see GROUPING_ENGINES):
+        "greedy" groups hosts with the first host compare_hosts finds them
+        similar to, "buckets" groups hosts with equal model keys and
+        "cluster" groups connected chains of similar hosts. The default is
+        "greedy" without a model (a similarity.similarity_model) and
+        "buckets" with one.
         """
-        hosts = self.host_list
-        config_groupings = []
-        grouped_set = set()
+        if engine is None:
+            engine = "greedy" if model is None else "buckets"
+        if engine not in GROUPING_ENGINES:
+            raise ValueError(f"Unknown grouping engine {engine}")
 
-        for i in range(len(hosts)):
-            if hosts[i] in grouped_set:
-                continue
-            new_grouping = [hosts[i]]
-            grouped_set.add(hosts[i])
-            for j in range(i + 1, len(hosts)):
-                # if any(hosts[j] in sl for sl in config_groupings):
-                if hosts[j] in grouped_set:
-                    continue
-                if compare_hosts(hosts[i], hosts[j]):
-                    new_grouping.append(hosts[j])
-                    grouped_set.add(hosts[j])
-            config_groupings.append(new_grouping)
+        if engine == "greedy":
+            config_groupings = group_hosts(self.host_list, model)
+        else:
+            if model is None:
+                from similarity import similarity_model
+
+                model = similarity_model()
+            if engine == "buckets":
+                config_groupings = model.group(self.host_list)
+            else:
+                config_groupings = model.cluster(self.host_list)
 
         print(config_groupings)
         self.config_groups = config_groupings
+        return config_groupings
 
 
 class host:
@@ -86,45 +192,77 @@ class host:
         self.enabled = bool(enabled)
         self.task_list = []
         self.desc_str = description
+        self.arches = arches.split(" ")
+        # Called with the host on first access of hw_dict, see
+        # channel.defer_hw_info
+        self.hw_resolver = None
         hw_keys = ["arches", "CPU(s)", "Ram", "Disk", "Kernel", "Operating System"]
-        self.hw_dict = {key: None for key in hw_keys}
-        self.hw_dict["arches"] = arches.split(" ")
+        self._hw_dict = {key: None for key in hw_keys}
+        self._hw_dict["arches"] = self.arches
+        self.desc_dict = {}
+        # Where CPU(s)/Ram in hw_dict came from: "description", "log" or None
+        self.hw_source = None
         # Sometimes the description field is None
         if description != None:
-            description_list = description.split("\n")
-            for lines in description_list:
-                line_split = lines.split(": ")
-                if line_split[0] in hw_keys:
-                    self.hw_dict[line_split[0]] = line_split[1]
+            self.desc_dict = parse_description(description)
+            for key in hw_keys:
+                if self.desc_dict.get(key) is not None:
+                    self._hw_dict[key] = self.desc_dict[key]
+            if self._hw_dict["CPU(s)"] is not None and self._hw_dict["Ram"] is not None:
+                self.hw_source = "description"
         else:
             print(f"NoneType desc found for {self.id}")
 
+    @property
+    def hw_dict(self):
+        """
+        Hardware information of the host. If a hw_resolver is set it is
+        called to look the information up first.
+        """
+        if self.hw_resolver is not None:
+            self.hw_resolver(self)
+        return self._hw_dict
+
     def __str__(self):
         """
         Returns a string for the host object
         """
-        host_str = f"Host Name: {self.name}\nHost ID: {self.id}\nEnabled: {self.enabled}\nTask List: [\n"
-        for tasks in self.task_list:
-            host_str += f"tasks: {tasks}"
-        host_str += "]\n"
-        host_str += "hw_info: {\n"
-        for key in self.hw_dict.keys():
-            host_str += f"{key}: {self.hw_dict[key]}\n"
-        host_str += "}"
-        return host_str
+        host_parts = [
+            f"Host Name: {self.name}\nHost ID: {self.id}\nEnabled: {self.enabled}\nTask List: [\n"
+        ]
+        host_parts.extend(f"tasks: {tasks}" for tasks in self.task_list)
+        host_parts.append("]\nhw_info: {\n")
+        host_parts.extend(f"{key}: {value}\n" for key, value in self.hw_dict.items())
+        host_parts.append("}")
+        return "".join(host_parts)
+
+    def description_age(self, today=None):
+        """
+        Returns the number of days since the description was last updated,
+        or None if the description has no Updated date
+        """
+        updated = self.desc_dict.get("Updated")
+        if updated is None:
+            return None
+        if today is None:
+            today = date.today()
+        return (today - updated).days
 
     def find_builds_for_host(self, session):
         """
         Tries to find a non scratch build for the host
         """
+        import koji
+
         now = datetime.now()
         cur_time = now.strftime("%H:%M:%S")
         print(f"starting find_builds_for_host at {cur_time}")
+        # Only id, parent, arch and label are read, so the request and result of the
+        # tasks are not decoded on the hub
         opts = {
             "host_id": self.id,
             "method": "buildArch",
             "state": [koji.TASK_STATES["CLOSED"]],
-            "decode": "True",
         }
         queryOpts = {"limit": 1, "order": "-completion_time"}
 
@@ -138,9 +276,9 @@ class host:
         parent_id = tasks[0]["parent"]
         build = session.listBuilds(taskID=parent_id)
         # Scratch build is found if build info is empty. Retry query opts
-        # for past 10 builds for the host
+        # for past 10 builds for the host, skipping the task already checked
         if len(build) == 0:
-            queryOpts = {"limit": 10, "order": "-completion_time"}
+            queryOpts = {"limit": 9, "offset": 1, "order": "-completion_time"}
 
             tasks = session.listTasks(opts, queryOpts)
             for brew_task in tasks:
@@ -153,6 +291,8 @@ class host:
                             task_id=brew_task["id"],
                             parent_id=brew_task["parent"],
                             build_info=build[0],
+                            arch=brew_task.get("arch"),
+                            label=brew_task.get("label"),
                         )
                     )
                     break
@@ -162,34 +302,27 @@ class host:
                     task_id=tasks[0]["id"],
                     parent_id=tasks[0]["parent"],
                     build_info=build[0],
+                    arch=tasks[0].get("arch"),
+                    label=tasks[0].get("label"),
                 )
             )
         now = datetime.now()
         cur_time = now.strftime("%H:%M:%S")
         print(f"end find_builds_for_host at {cur_time}")
 
-    def get_hw_info(self, session):
+    def get_hw_info(self, session, store=None, retry=None):
         """
         Gets hardware information for a host. Downloads hw_info.log for the
         hosts architecture and pulls hardware information from the log.
+        If store (a logstore.log_store) is given, the log is read from it
+        and only downloaded if it is not stored yet. If retry (a
+        resilience.retry_policy) is given, failed downloads are retried.
         """
         now = datetime.now()
         cur_time = now.strftime("%H:%M:%S")
         print(f"starting get_hw_info at {cur_time}")
-        if len(self.task_list) == 0:
-            now = datetime.now()
-            cur_time = now.strftime("%H:%M:%S")
-            print(f"end find_builds_for_host(false) at {cur_time}")
-            return False
-
-        build_id = self.task_list[0].build_info["build_id"]
-        all_logs = session.getBuildLogs(build_id)
-        hw_log = None
-        for log in all_logs:
-            if log["name"] == "hw_info.log" and log["dir"] in self.hw_dict["arches"]:
-                hw_log = log
-                break
 
+        hw_log = self.find_hw_log(session)
         # Check if hw_logs has been assigned
         if hw_log == None:
             now = datetime.now()
@@ -197,44 +330,107 @@ class host:
             print(f"end find_builds_for_host(false) at {cur_time}")
             return False
 
-        # Make URL for hw_log and use requests.get(url) to download log
-        mykoji = koji.get_profile_module("brew")
-        url = os.path.join(mykoji.config.topurl, hw_log["path"])
-        response = requests.get(url)
-        hw_log_str = response.text
-
-        hw_log_lines = hw_log_str.split("\n")
-        hw_log_lines = [re.sub(r"\s+", ",", line) for line in hw_log_lines]
-
-        for line in hw_log_lines:
-            line_split = line.split(",")
-
-            if line_split[0] == "CPU(s):":
-                self.hw_dict["CPU(s)"] = int(line_split[1])
-                continue
-            if line_split[0] == "Mem:":
-                self.hw_dict["Ram"] = int(line_split[1])
-                continue
-            disk_match = re.match(r"^/", line_split[0])
-            if disk_match:
-                self.hw_dict["Disk"] = line_split[1]
-                continue
+        if self.read_task_log(session, hw_log, store, retry) is None:
+            return False
 
         now = datetime.now()
         cur_time = now.strftime("%H:%M:%S")
         print(f"end find_builds_for_host(true) at {cur_time}")
         return True
 
+    def find_hw_log(self, session, derive=True):
+        """
+        returns the getBuildLogs style entry for the hw_info.log written by
+        the host's task, or None if there is none.
+
+        Build logs are stored per task label (eg noarch for a noarch build
+        made on an x86_64 host, i686 where the task arch is i386), so when
+        the task's label is known and derive is set the entry is made up
+        from the build without asking brew. Otherwise getBuildLogs is
+        searched for a hw_info.log of the task's label, or else of one of
+        the hosts architectures.
+        """
+        if len(self.task_list) == 0:
+            return None
+
+        brew_task = self.task_list[0]
+        if derive and brew_task.label is not None:
+            return {
+                "dir": brew_task.label,
+                "name": "hw_info.log",
+                "path": task_log_path(brew_task.build_info, brew_task.label),
+            }
+
+        build_id = brew_task.build_info["build_id"]
+        return self.pick_hw_log(session.getBuildLogs(build_id))
+
+    def pick_hw_log(self, logs):
+        """
+        returns the hw_info.log of the host's task among logs (getBuildLogs
+        entries of its build), see pick_hw_log
+        """
+        return pick_hw_log(logs, self.task_list[0].label, self.hw_dict["arches"])
+
+    def read_task_log(self, session, hw_log, store=None, retry=None):
+        """
+        Like read_hw_log, but if hw_log was made up from the task's label
+        (see find_hw_log) and the server has no such log, the build's logs
+        are listed and the hw_info.log found there is read instead
+
+        returns the entry read, or None if the build has no hw_info.log
+        """
+        try:
+            self.read_hw_log(hw_log, store, retry)
+            return hw_log
+        except Exception as e:
+            if self.task_list[0].label is None or not log_missing(e):
+                raise
+        hw_log = self.find_hw_log(session, derive=False)
+        if hw_log is not None:
+            self.read_hw_log(hw_log, store, retry)
+        return hw_log
+
+    def read_hw_log(self, hw_log, store=None, retry=None):
+        """
+        Downloads hw_log (a getBuildLogs entry, see find_hw_log) and pulls
+        hardware information from it, see get_hw_info
+        """
+        build_id = self.task_list[0].build_info["build_id"]
+        # Make URL for hw_log and use requests.get(url) to download log
+        url = os.path.join(get_context().topurl, hw_log["path"])
+
+        def download():
+            if store is not None:
+                return store.fetch(build_id, hw_log["dir"], hw_log["name"], url)
+            import requests
+
+            response = requests.get(url, timeout=LOG_TIMEOUT)
+            response.raise_for_status()
+            return response.content
+
+        if retry is None:
+            hw_log_bytes = download()
+        else:
+            hw_log_bytes = retry.call(download)
+
+        self.hw_dict.update(parse_hw_info(hw_log_bytes.decode(errors="replace")))
+        self.hw_source = "log"
+
 
 class task:
     """
     Brew task
     """
 
-    def __init__(self, task_id, parent_id, build_info):
+    def __init__(self, task_id, parent_id, build_info, arch=None, label=None):
         self.task_id = int(task_id)
         self.parent_id = int(parent_id)
         self.build_info = build_info
+        # Arch of the buildroot the buildArch task ran in
+        self.arch = arch
+        # Arch the task built for (noarch, i686, ...), it names the task's
+        # log dir
+        self.label = label
 
     def __str__(self):
         """
@@ -244,10 +440,193 @@ class task:
         return task_str
 
 
-def compare_hosts(hostA, hostB):
+def log_missing(error):
+    """
+    returns True if error is a build log download the server answered with
+    404 Not Found
+    """
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 404
+
+
+def pick_hw_log(logs, label, arches):
+    """
+    returns the hw_info.log among logs (getBuildLogs entries of a build)
+    written by the task with label, or else the first one for any of
+    arches, or None
+    """
+    hw_logs = [log for log in logs if log["name"] == "hw_info.log"]
+    for log in hw_logs:
+        if log["dir"] == label:
+            return log
+    for log in hw_logs:
+        if log["dir"] in arches:
+            return log
+    return None
+
+
+def task_log_path(build_info, label, name="hw_info.log"):
+    """
+    returns the path of a build log relative to topurl, the same path
+    getBuildLogs reports for the log, eg
+    vol/rhel-8/packages/<name>/<version>/<release>/data/logs/<label>/hw_info.log
+    """
+    import koji
+
+    logs_dir = koji.PathInfo(topdir="").build_logs(build_info).lstrip("/")
+    return f"{logs_dir}/{label}/{name}"
+
+
+# Factors converting "Total Memory" units in host descriptions to KiB, the
+# unit hw_info.log reports Ram in. The description gb is 1000 MiB: hosts
+# described with "23.497 gb" report about 24050560 KiB in hw_info.log.
+MEMORY_UNITS = {"kb": 1, "mb": 1024, "gb": 1000 * 1024, "tb": 1000 * 1000 * 1024}
+
+
+def parse_memory(value):
+    """
+    Converts a description memory value such as "23.497 gb" to KiB
+    """
+    amount, unit = value.split()
+    return int(float(amount) * MEMORY_UNITS[unit.lower()])
+
+
+def parse_updated(value):
+    """
+    Converts a description date such as "2021-06-24" to a datetime.date
+    """
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_infrastructure(value):
+    """
+    Infrastructure Type is "NA" for hosts where it is not known
+    """
+    if value == "NA":
+        return None
+    return value
+
+
+# Description field name: (hw_dict style key, parser for the value)
+DESCRIPTION_FIELDS = {
+    "Updated": ("Updated", parse_updated),
+    "Infrastructure Type": ("Infrastructure Type", parse_infrastructure),
+    "Operating System": ("Operating System", str),
+    "Kernel": ("Kernel", str),
+    "vCPU Count": ("CPU(s)", int),
+    "CPU Count": ("CPU(s)", int),
+    "Total Memory": ("Ram", parse_memory),
+}
+
+
+def parse_description(description):
+    """
+    Parses a brew host description, eg:
+
+        Updated: 2021-06-24
+        Infrastructure Type: NA
+        Operating System: RedHat 8.2
+        Kernel: 4.18.0-193.28.1.el8_2.ppc64le
+        vCPU Count: 8
+        Total Memory: 23.497 gb
+
+    returns a dict of typed values. CPU counts are stored under "CPU(s)" and
+    memory under "Ram" in KiB, like the values read from hw_info.log. Fields
+    not in DESCRIPTION_FIELDS are kept as strings, values that fail to parse
+    are None.
+    """
+    desc_dict = {}
+    for line in description.split("\n"):
+        field, sep, value = line.partition(": ")
+        if not sep:
+            continue
+        field = field.strip()
+        value = value.strip()
+        if field not in DESCRIPTION_FIELDS:
+            desc_dict[field] = value
+            continue
+        key, parser = DESCRIPTION_FIELDS[field]
+        try:
+            desc_dict[key] = parser(value)
+        except (ValueError, KeyError):
+            print(f"Could not parse description field {field}: {value}")
+            desc_dict[key] = None
+    return desc_dict
+
+
+def parse_hw_info(hw_log_str):
+    """
+    Pulls hardware information out of the text of a hw_info.log
+
+    returns a dict with the "CPU(s)", "Ram" and "Disk" values found in the log
     """
-    Compares two hosts, if they are similar it will return True, and False otherwise
+    hw_info = {}
+
+    for line in hw_log_str.split("\n"):
+        line_split = line.split()
+        if len(line_split) < 2:
+            continue
+
+        if line_split[0] == "CPU(s):":
+            hw_info["CPU(s)"] = int(line_split[1])
+            continue
+        if line_split[0] == "Mem:":
+            hw_info["Ram"] = int(line_split[1])
+            continue
+        if line_split[0].startswith("/"):
+            hw_info["Disk"] = line_split[1]
+            continue
+
+    return hw_info
+
+
+def reparse_hw_logs(store):
     """
+    Parses every hw_info.log held in store (a logstore.log_store) again,
+    without any calls to brew
+
+    returns a dict of {(build id, arch): parse_hw_info result}
+    """
+    parsed = {}
+    for build_id, arch, name in store.keys(name="hw_info.log"):
+        hw_log_bytes = store.get(build_id, arch, name)
+        parsed[(build_id, arch)] = parse_hw_info(hw_log_bytes.decode(errors="replace"))
+    return parsed
+
+
+def group_hosts(hosts, model=None):
+    """
+    returns a list of host groupings, hosts are grouped with the first host
+    compare_hosts finds them similar to
+    """
+    config_groupings = []
+    grouped_set = set()
+
+    for i in range(len(hosts)):
+        if hosts[i] in grouped_set:
+            continue
+        new_grouping = [hosts[i]]
+        grouped_set.add(hosts[i])
+        for j in range(i + 1, len(hosts)):
+            # if any(hosts[j] in sl for sl in config_groupings):
+            if hosts[j] in grouped_set:
+                continue
+            if compare_hosts(hosts[i], hosts[j], model):
+                new_grouping.append(hosts[j])
+                grouped_set.add(hosts[j])
+        config_groupings.append(new_grouping)
+
+    return config_groupings
+
+
+def compare_hosts(hostA, hostB, model=None):
+    """
+    Compares two hosts, if they are similar it will return True, and False otherwise.
+    If model (a similarity.similarity_model) is given its rules are used.
+    """
+    if model is not None:
+        return model.compare(hostA, hostB)
+
     similar = True
 
     if hostA.hw_dict["Ram"] != None and hostB.hw_dict["Ram"] != None:
@@ -280,33 +659,6 @@ def collect_channels(session):
 
 
 if __name__ == "__main__":
-    mykoji = koji.get_profile_module("brew")
-
-    opts = vars(mykoji.config)
-    session = mykoji.ClientSession(mykoji.config.server, opts)
-
-    channels = collect_channels(session)
-
-    rhel8_beefy = channels[30]
-    rhel8_beefy.collect_hosts(session)
-
-    for hosts in rhel8_beefy.host_list:
-        hosts.find_builds_for_host(session)
-        hosts.get_hw_info(session)
-        print(f"collected host: {hosts.id}")
-
-    rhel8_beefy.config_check()
-
-    print(f"rhel8_beefy contains {len(rhel8_beefy.host_list)} hosts")
-    print(
-        f"rhel8_beefy was divided in to {len(rhel8_beefy.config_groups)} configuration groups based on CPU count and Ram"
-    )
-    for index, sub_list in enumerate(rhel8_beefy.config_groups):
-        print(
-            f"\n================================ Group {index}/{len(rhel8_beefy.config_groups)} ================================"
-        )
-        for hosts in sub_list:
-            print(
-                f"ID: {hosts.id} arches: {hosts.hw_dict['arches']} CPU(s): {hosts.hw_dict['CPU(s)']} Ram: {hosts.hw_dict['Ram']} Disk: {hosts.hw_dict['Disk']} Kernel: {hosts.hw_dict['Kernel']} O/S: {hosts.hw_dict['Operating System']}"
-            )
-    print(rhel8_beefy)
+    from cli import main
+
+    raise SystemExit(main())
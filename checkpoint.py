@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+
+# hw_dict fields saved for a finished host, arches come from listHosts
+HW_KEYS = ["CPU(s)", "Ram", "Disk", "Kernel", "Operating System"]
+
+# Stages of the work for a host, in order
+STAGES = ["hosts_listed", "task_found", "logs_listed", "hw_parsed"]
+
+
+class checkpoint:
+    """
+    Append-only JSON lines journal recording the work a run has finished,
+    so an interrupted run can resume where it stopped:
+
+        {"type": "channels", "channels": [listChannels entries]}
+        {"type": "hosts", "channel_id": 21, "hosts": [listHosts entries]}
+        {"type": "tasks", "host_id": 94, "tasks": [task dicts]}
+        {"type": "logs", "host_id": 94, "hw_log": getBuildLogs entry or null}
+        {"type": "host", "host_id": 94, "hw": {...}, "hw_source": "log",
+         "tasks": [task dicts]}
+
+    where task dicts are {"task_id": ..., "parent_id": ..., "build_info":
+    {...}, "arch": ..., "label": ...}. The records of a host mark the stages
+    in STAGES it finished.
+
+    Every record is flushed as soon as it is written. A line cut short by a
+    crash is ignored when the file is read back.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.channels = None
+        self.channel_hosts = {}
+        self.listed = set()
+        self.tasks = {}
+        self.logs = {}
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+        line = "\n"
+        if os.path.exists(self.path):
+            with open(self.path) as fp:
+                for line in fp:
+                    try:
+                        self._load(json.loads(line))
+                    except ValueError:
+                        continue
+        self._file = open(self.path, "a")
+        if not line.endswith("\n"):
+            # Don't append to a line cut short by a crash
+            self._file.write("\n")
+
+    def _load(self, record):
+        if record["type"] == "channels":
+            self.channels = record["channels"]
+        elif record["type"] == "hosts":
+            self.channel_hosts[record["channel_id"]] = record["hosts"]
+            self.listed.update(brew_host["id"] for brew_host in record["hosts"])
+        elif record["type"] == "tasks":
+            self.tasks[record["host_id"]] = record["tasks"]
+        elif record["type"] == "logs":
+            self.logs[record["host_id"]] = record["hw_log"]
+        elif record["type"] == "host":
+            self.hosts[record["host_id"]] = record
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, default=str) + "\n")
+            self._file.flush()
+            self._load(record)
+
+    def save_channels(self, channels):
+        """
+        Records a listChannels response
+        """
+        self._write({"type": "channels", "channels": channels})
+
+    def save_hosts(self, channel_id, hosts):
+        """
+        Records the listHosts response for a channel
+        """
+        self._write({"type": "hosts", "channel_id": channel_id, "hosts": hosts})
+
+    def save_tasks(self, hosts):
+        """
+        Records the tasks find_builds_for_host found for a host object
+        """
+        self._write({"type": "tasks", "host_id": hosts.id, "tasks": task_dicts(hosts)})
+
+    def save_log(self, hosts, hw_log):
+        """
+        Records the hw_info.log find_hw_log found for a host object
+        """
+        self._write({"type": "logs", "host_id": hosts.id, "hw_log": hw_log})
+
+    def save_host(self, hosts):
+        """
+        Records the hardware information and tasks found for a host object
+        """
+        self._write(
+            {
+                "type": "host",
+                "host_id": hosts.id,
+                "hw": {key: hosts.hw_dict[key] for key in HW_KEYS},
+                "hw_source": hosts.hw_source,
+                "tasks": task_dicts(hosts),
+            }
+        )
+
+    def stage(self, host_id):
+        """
+        returns the last of STAGES finished for a host, or None
+        """
+        if host_id in self.hosts:
+            return "hw_parsed"
+        if host_id in self.logs:
+            return "logs_listed"
+        if host_id in self.tasks:
+            return "task_found"
+        if host_id in self.listed:
+            return "hosts_listed"
+        return None
+
+    def restore_host(self, hosts):
+        """
+        Fills in a host object with what was recorded for it: tasks, and
+        hardware information once it was parsed
+
+        returns the last of STAGES finished for the host, or None
+        """
+        from channel_validator import task
+
+        stage = self.stage(hosts.id)
+        record = self.hosts.get(hosts.id)
+        if record is not None:
+            hosts.hw_dict.update(record["hw"])
+            hosts.hw_source = record["hw_source"]
+            task_list = record["tasks"]
+        else:
+            task_list = self.tasks.get(hosts.id, [])
+        hosts.task_list = [task(**tasks) for tasks in task_list]
+        return stage
+
+    def close(self):
+        self._file.close()
+
+
+def task_dicts(hosts):
+    """
+    returns the task_list of a host object as dicts
+    """
+    return [
+        {
+            "task_id": tasks.task_id,
+            "parent_id": tasks.parent_id,
+            "build_info": tasks.build_info,
+            "arch": tasks.arch,
+            "label": tasks.label,
+        }
+        for tasks in hosts.task_list
+    ]
@@ -0,0 +1,522 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import channel_validator as cv
+from brew_context import get_context
+from collect import (
+    WORKERS,
+    collect_hosts,
+    iter_probe_hosts,
+    list_channels,
+    select_channels,
+    session_factory,
+)
+from export import EXPORT_FORMATS, arrow_schema, export_channels, host_row
+from checkpoint import checkpoint
+from multicall import BATCH_SIZE, payload_meter, rate_limiter
+from resilience import ATTEMPTS, HUB_TIMEOUT, circuit_breaker, retry_policy
+from snapshot import HW_FIELDS, diff_snapshots, snapshot
+
+OUTPUT_FORMATS = ["text", "json", "jsonl"] + EXPORT_FORMATS
+
+# Where hardware information comes from:
+# auto: host descriptions, with build logs for hosts_needing_logs
+# description: host descriptions only, no build log lookups
+# logs: build logs for every host
+HW_SOURCES = ["auto", "description", "logs"]
+
+
+def fill_from_snapshot(hosts, record):
+    """
+    Copies the hardware information of a snapshot record into a host object
+    """
+    for field, name in HW_FIELDS.items():
+        if field != "arches":
+            hosts.hw_dict[field] = record.get(name)
+    hosts.hw_source = "snapshot"
+
+
+def hosts_to_probe(
+    channels, source="auto", max_age=cv.DESCRIPTION_MAX_AGE, previous=None, stale=()
+):
+    """
+    Picks the hosts whose build logs have to be looked up. Hosts that are in
+    several channels are only looked up once. With previous (a
+    snapshot.snapshot) hosts it has hardware information for are filled in
+    from it instead, unless their id is in stale (eg hosts poller.poll found
+    new tasks for).
+
+    returns a dict of {host id: [host objects]}
+    """
+    probe = {}
+    for brew_channel in channels:
+        if source == "description":
+            continue
+        if source == "logs":
+            needing_logs = brew_channel.host_list
+        else:
+            needing_logs = brew_channel.hosts_needing_logs(max_age)
+        for hosts in needing_logs:
+            probe.setdefault(hosts.id, []).append(hosts)
+
+    if previous is not None:
+        for host_id in list(probe):
+            record = previous.hosts.get(host_id)
+            if (
+                host_id in stale
+                or record is None
+                or record.get("cpus") is None
+                or record.get("ram") is None
+            ):
+                continue
+            for hosts in probe.pop(host_id):
+                fill_from_snapshot(hosts, record)
+    return probe
+
+
+def stream_results(channels, probe, results, failed=None):
+    """
+    Follows results (see iter_probe_hosts) for channels and yields
+    ("host", channel, host object) once the hardware information of a host
+    is final and ("channel", channel, None) once it is for every host of a
+    channel. Hosts not in probe are final right away, the rest follow in the
+    order their lookups finish. Lookup errors are added to failed ({host id:
+    exception}) if given.
+
+    Start the lookups of results before calling this, so they run while the
+    channels are walked. Every channel is kept until its hosts are final
+    and the caller holds them all for the final output anyway, so memory
+    stays O(channels) and only the output is streamed.
+    """
+    waiting = {}
+    owners = {}
+    for brew_channel in channels:
+        waiting[brew_channel.id] = set()
+        for hosts in brew_channel.host_list:
+            if hosts.id in probe:
+                waiting[brew_channel.id].add(hosts.id)
+                owners.setdefault(hosts.id, []).append((brew_channel, hosts))
+            else:
+                yield "host", brew_channel, hosts
+        if not waiting[brew_channel.id]:
+            yield "channel", brew_channel, None
+
+    for host_list, error in results:
+        host_id = host_list[0].id
+        if error is not None and failed is not None:
+            failed[host_id] = error
+        for brew_channel, hosts in owners.pop(host_id, []):
+            yield "host", brew_channel, hosts
+            waiting[brew_channel.id].discard(host_id)
+            if not waiting[brew_channel.id]:
+                yield "channel", brew_channel, None
+
+
+class report_writer:
+    """
+    Writes results to stream as JSON lines as they come in (-f jsonl), one
+    record per host and one per channel once it is grouped:
+
+        {"type": "host", "channel_id": 21, "host_id": 94, ...}
+        {"type": "channel", "id": 21, "name": "rhel8", "config_groups": [[94]]}
+
+    Every record is flushed, so it can be followed while the run goes on.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def _write(self, record):
+        self.stream.write(json.dumps(record, default=str) + "\n")
+        self.stream.flush()
+
+    def write_host(self, brew_channel, hosts):
+        self._write(dict(type="host", **host_row(brew_channel.id, hosts)))
+
+    def write_channel(self, brew_channel):
+        record = channel_dict(brew_channel)
+        del record["hosts"]
+        self._write(dict(type="channel", **record))
+
+
+def channel_dict(brew_channel):
+    """
+    returns a JSON serializable dict for a channel object
+    """
+    return {
+        "id": brew_channel.id,
+        "name": brew_channel.name,
+        "hosts": [host_row(brew_channel.id, hosts) for hosts in brew_channel.host_list],
+        "config_groups": [
+            [hosts.id for hosts in grouping] for grouping in brew_channel.config_groups
+        ],
+    }
+
+
+def write_text(channels, stream):
+    for brew_channel in channels:
+        groups = brew_channel.config_groups
+        print(
+            f"{brew_channel.name} contains {len(brew_channel.host_list)} hosts",
+            file=stream,
+        )
+        print(
+            f"{brew_channel.name} was divided in to {len(groups)} configuration groups",
+            file=stream,
+        )
+        for index, sub_list in enumerate(groups):
+            print(
+                f"\n================================ Group {index}/{len(groups)} ================================",
+                file=stream,
+            )
+            for hosts in sub_list:
+                print(
+                    f"ID: {hosts.id} arches: {hosts.hw_dict['arches']} CPU(s): {hosts.hw_dict['CPU(s)']} Ram: {hosts.hw_dict['Ram']} Disk: {hosts.hw_dict['Disk']} Kernel: {hosts.hw_dict['Kernel']} O/S: {hosts.hw_dict['Operating System']}",
+                    file=stream,
+                )
+        print(file=stream)
+
+
+def write_output(channels, output_format, output=None):
+    """
+    Writes the validated channels as text or json to output (default:
+    stdout), or exports them to the output directory for the export formats
+    """
+    if output_format in EXPORT_FORMATS:
+        counts = export_channels(channels, output or "export", output_format)
+        print(f"exported {counts}", file=sys.stderr)
+        return
+
+    stream = sys.stdout if output is None else open(output, "w")
+    try:
+        if output_format == "json":
+            json.dump([channel_dict(c) for c in channels], stream, indent=2)
+            stream.write("\n")
+        else:
+            write_text(channels, stream)
+    finally:
+        if output is not None:
+            stream.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="brew-channel-validate",
+        description="Group the hosts of brew channels into configuration groups",
+    )
+    selection = parser.add_argument_group("channel selection (default: all channels)")
+    selection.add_argument(
+        "-c",
+        "--channel",
+        action="append",
+        dest="names",
+        help="channel name, may be repeated",
+    )
+    selection.add_argument(
+        "-r",
+        "--channel-regex",
+        action="append",
+        dest="patterns",
+        help="regular expression matched against channel names, may be repeated",
+    )
+    selection.add_argument(
+        "-i",
+        "--channel-id",
+        action="append",
+        dest="ids",
+        type=int,
+        help="channel id, may be repeated",
+    )
+
+    source = parser.add_argument_group("data source")
+    source.add_argument(
+        "--hw-source",
+        choices=HW_SOURCES,
+        help="where hardware information comes from (default: auto, host "
+        "descriptions with build logs for stale or odd hosts)",
+    )
+    source.add_argument(
+        "--max-age",
+        type=int,
+        help="days after which a host description is checked against build "
+        f"logs (default: {cv.DESCRIPTION_MAX_AGE})",
+    )
+
+    source.add_argument(
+        "--mirror",
+        metavar="DB",
+        help="read channels, hosts and hardware from a local mirror instead of "
+        "the hub (see mirror.py), hosts without hardware in the mirror keep "
+        "their description",
+    )
+
+    performance = parser.add_argument_group("performance")
+    performance.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help=f"hosts looked up at the same time (default: {WORKERS})",
+    )
+    performance.add_argument(
+        "--batch",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"calls per multicall (default: {BATCH_SIZE})",
+    )
+    performance.add_argument(
+        "--metrics",
+        action="store_true",
+        help="report calls and response bytes per hub method",
+    )
+    performance.add_argument(
+        "--timeout",
+        type=float,
+        default=HUB_TIMEOUT,
+        help=f"seconds a hub call may take (default: {HUB_TIMEOUT})",
+    )
+    performance.add_argument(
+        "--retries",
+        type=int,
+        default=ATTEMPTS,
+        help="tries per hub call or log download, with exponential backoff "
+        f"(default: {ATTEMPTS})",
+    )
+    performance.add_argument(
+        "--rate",
+        type=float,
+        help="maximum hub calls per second across all workers",
+    )
+    performance.add_argument(
+        "--login",
+        action="store_true",
+        help="log in to the hub, reusing the login of earlier runs while it is "
+        "valid",
+    )
+
+    caching = parser.add_argument_group("caching")
+    caching.add_argument(
+        "--store",
+        metavar="DIR",
+        help="keep build logs in a local log store and reuse them across runs",
+    )
+    caching.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="check build logs in --store with the server (ETag/Last-Modified) "
+        "before reusing them",
+    )
+    caching.add_argument(
+        "--snapshot",
+        metavar="FILE",
+        help="save the results as a snapshot (see snapshot.py)",
+    )
+    caching.add_argument(
+        "--checkpoint",
+        metavar="FILE",
+        help="record finished work in FILE and skip it when the run is "
+        "started again with the same FILE",
+    )
+    caching.add_argument(
+        "--incremental",
+        action="store_true",
+        help="reuse hardware information from the --snapshot of the last run "
+        "and report what changed since",
+    )
+    caching.add_argument(
+        "--poll",
+        metavar="STATE",
+        help="with --incremental, look up hosts that finished buildArch tasks "
+        "since the last poll again instead of reusing the snapshot (see "
+        "poller.py, default: the --snapshot file name with .poll appended)",
+    )
+
+    grouping = parser.add_argument_group("grouping")
+    grouping.add_argument("--engine", choices=cv.GROUPING_ENGINES)
+    grouping.add_argument(
+        "--similarity", metavar="FILE", help="similarity rules (see similarity.yml)"
+    )
+
+    output = parser.add_argument_group("output")
+    output.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default="text")
+    output.add_argument(
+        "-o",
+        "--output",
+        help="file to write (default: stdout, jsonl is written as results "
+        "come in), or directory for "
+        f"{', '.join(EXPORT_FORMATS)} (default: export)",
+    )
+
+    args = parser.parse_args(argv)
+    if args.incremental and not args.snapshot:
+        parser.error("--incremental needs --snapshot")
+    if args.mirror and (args.checkpoint or args.poll):
+        parser.error("--mirror can't be used with --checkpoint or --poll")
+    # Without a poll, hosts in the snapshot would never be looked up again
+    if args.incremental and not args.poll and not args.mirror:
+        args.poll = args.snapshot + ".poll"
+    # Hardware comes from what mirror.py sync read, nothing is looked up
+    if args.mirror and (args.hw_source is not None or args.max_age is not None):
+        parser.error("--mirror can't be used with --hw-source or --max-age")
+    if args.hw_source is None:
+        args.hw_source = "auto"
+    if args.max_age is None:
+        args.max_age = cv.DESCRIPTION_MAX_AGE
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.format in ("parquet", "arrow"):
+        # Fail before the run instead of when writing its results
+        try:
+            arrow_schema("channels")
+        except ImportError as e:
+            raise SystemExit(str(e))
+
+    context = get_context()
+    if args.login:
+        context.login = True
+    # Hub calls share one circuit breaker, log downloads are only retried
+    hub_policy = retry_policy(args.retries, breaker=circuit_breaker())
+    download_policy = retry_policy(args.retries)
+    limiter = rate_limiter(args.rate) if args.rate else None
+    meter = payload_meter() if args.metrics else None
+
+    new_session = session_factory(context, args.timeout, hub_policy, limiter, meter)
+    # A mirror needs no hub session, which would log in with --login
+    session = None if args.mirror else new_session()
+
+    previous = None
+    if args.incremental and os.path.exists(args.snapshot):
+        previous = snapshot.load(args.snapshot)
+
+    similarity = None
+    if args.similarity:
+        from similarity import load_similarity
+
+        similarity = load_similarity(args.similarity)
+
+    ckpt = checkpoint(args.checkpoint) if args.checkpoint else None
+
+    writer = None
+    if args.format == "jsonl":
+        writer = report_writer(
+            sys.stdout if args.output is None else open(args.output, "w")
+        )
+
+    # The validator reports its progress on stdout, keep stdout for results
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.mirror:
+            from mirror import mirror
+
+            db = mirror(args.mirror)
+            all_channels = db.load_channels()
+            db.close()
+        else:
+            all_channels = list_channels(session, ckpt)
+        channels = select_channels(all_channels, args.names, args.patterns, args.ids)
+        if len(channels) == 0:
+            raise SystemExit("No channels selected")
+        if args.mirror:
+            unread = {
+                hosts.id
+                for brew_channel in channels
+                for hosts in brew_channel.host_list
+                if hosts.hw_source != "log"
+            }
+            if unread:
+                print(
+                    f"{len(unread)} hosts have no hardware in the mirror, their "
+                    "descriptions are used",
+                    file=sys.stderr,
+                )
+        else:
+            collect_hosts(session, channels, args.batch, hub_policy, ckpt, meter)
+
+        mark = None
+        stale = set()
+        reused = previous
+        if args.poll:
+            from poller import poll, watermark
+
+            mark = watermark(args.poll)
+            # The first poll only looks back INITIAL_LOOKBACK, changes from
+            # before then are not known so the snapshot is not reused
+            if mark.completion_ts is None:
+                reused = None
+            poll(session, mark)
+            stale = set(mark.stale_hosts)
+
+        probe = {}
+        if not args.mirror:
+            probe = hosts_to_probe(
+                channels, args.hw_source, args.max_age, reused, stale
+            )
+        store = None
+        if args.store:
+            from logstore import log_store
+
+            store = log_store(args.store, revalidate=args.revalidate)
+        # Lookups run in the background while hosts that need none are
+        # written, channels are grouped as soon as all their hosts are final
+        results = iter_probe_hosts(
+            new_session, probe, store, args.workers, download_policy, ckpt
+        )
+        failed = {}
+        for kind, brew_channel, hosts in stream_results(
+            channels, probe, results, failed
+        ):
+            if kind == "channel":
+                model = None
+                if similarity is not None:
+                    model = similarity.model_for(brew_channel.name)
+                brew_channel.config_check(model=model, engine=args.engine)
+            if writer is None:
+                continue
+            if kind == "host":
+                writer.write_host(brew_channel, hosts)
+            else:
+                writer.write_channel(brew_channel)
+        if mark is not None:
+            mark.collected(host_id for host_id in probe if host_id not in failed)
+            mark.save()
+
+    if ckpt is not None:
+        ckpt.close()
+    if meter is not None:
+        print("\n".join(meter.report()), file=sys.stderr)
+    if args.store and args.revalidate:
+        print(f"log store: {store.counters}", file=sys.stderr)
+
+    if writer is None:
+        write_output(channels, args.format, args.output)
+    elif args.output is not None:
+        writer.stream.close()
+
+    if args.snapshot:
+        current = snapshot.from_channels(channels)
+        if previous is not None:
+            changes = diff_snapshots(previous, current)
+            if not changes.is_empty():
+                print(changes, file=sys.stderr)
+        current.save(args.snapshot)
+
+    if failed:
+        retry_hint = ""
+        if args.checkpoint:
+            retry_hint = (
+                f", run again with --checkpoint {args.checkpoint} to retry them"
+            )
+        print(
+            f"hw info lookup failed for {len(failed)} hosts{retry_hint}",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import channel_validator as cv
+from multicall import BATCH_SIZE, call_batched, metered_session, throttled_session
+from progress import progress
+from resilience import HUB_TIMEOUT, circuit_breaker, resilient_session, retry_policy
+
+# Hosts whose hardware information is looked up at the same time
+WORKERS = 8
+
+
+def session_factory(
+    context, timeout=HUB_TIMEOUT, policy=None, limiter=None, meter=None
+):
+    """
+    returns a function making new hub sessions of context (a
+    brew_context.brew_context) for worker threads. Calls time out after
+    timeout seconds and are retried with policy (a resilience.retry_policy,
+    one with its own circuit breaker by default) instead of by koji. If
+    limiter (a multicall.rate_limiter) is given calls are throttled by it,
+    if meter (a multicall.payload_meter) is given they are recorded in it.
+    """
+    if policy is None:
+        policy = retry_policy(breaker=circuit_breaker())
+
+    def new_session():
+        session = context.new_session(timeout=timeout, max_retries=0)
+        if meter is not None:
+            session = metered_session(session, meter)
+        if limiter is not None:
+            session = throttled_session(session, limiter)
+        return resilient_session(session, policy)
+
+    return new_session
+
+
+def select_channels(channels, names=None, patterns=None, ids=None):
+    """
+    returns the channel objects matching any of names, patterns (regular
+    expressions searched in the channel name) or ids. Every channel is
+    selected if no criteria are given.
+    """
+    names = set(names or [])
+    ids = set(ids or [])
+    regexes = [re.compile(pattern) for pattern in patterns or []]
+    if not (names or ids or regexes):
+        return list(channels)
+
+    unknown = names - {brew_channel.name for brew_channel in channels}
+    if unknown:
+        raise SystemExit(f"Unknown channel(s): {', '.join(sorted(unknown))}")
+
+    return [
+        brew_channel
+        for brew_channel in channels
+        if brew_channel.name in names
+        or brew_channel.id in ids
+        or any(regex.search(brew_channel.name) for regex in regexes)
+    ]
+
+
+def list_channels(session, ckpt=None):
+    """
+    returns channel objects for every brew channel. The listChannels
+    response is taken from ckpt (a checkpoint.checkpoint) if it has one,
+    and recorded in it otherwise.
+    """
+    if ckpt is not None and ckpt.channels is not None:
+        brew_channels = ckpt.channels
+    else:
+        brew_channels = session.listChannels()
+        if ckpt is not None:
+            ckpt.save_channels(brew_channels)
+    return [
+        cv.channel(brew_channel["name"], brew_channel["id"])
+        for brew_channel in brew_channels
+    ]
+
+
+def collect_hosts(
+    session, channels, batch=BATCH_SIZE, policy=None, ckpt=None, meter=None
+):
+    """
+    Fills in host_list for every channel with one multicall. The multicall
+    is retried as a whole with policy (a resilience.retry_policy) if given.
+    Host lists already in ckpt (a checkpoint.checkpoint) are not listed
+    again, new ones are recorded in it. Response sizes are recorded in meter
+    (a multicall.payload_meter) if given.
+    """
+    pending = []
+    for brew_channel in channels:
+        if ckpt is not None and brew_channel.id in ckpt.channel_hosts:
+            brew_channel.add_hosts(ckpt.channel_hosts[brew_channel.id])
+        else:
+            pending.append(brew_channel)
+
+    calls = [{"channelID": brew_channel.id} for brew_channel in pending]
+    if policy is None:
+        responses = call_batched(session, "listHosts", calls, batch, meter=meter)
+    else:
+        responses = policy.call(
+            call_batched, session, "listHosts", calls, batch, meter=meter
+        )
+    for brew_channel, list_host_response in zip(pending, responses):
+        brew_channel.add_hosts(list_host_response)
+        if ckpt is not None:
+            ckpt.save_hosts(brew_channel.id, list_host_response)
+
+
+def copy_hw(first, host_list):
+    """
+    Copies the tasks and hardware information of host object first to the
+    other objects for the same host
+    """
+    for hosts in host_list:
+        if hosts is first:
+            continue
+        hosts.task_list = list(first.task_list)
+        hosts.hw_dict.update(first.hw_dict)
+        hosts.hw_source = first.hw_source
+
+
+def iter_probe_hosts(
+    session_factory, probe, store=None, workers=WORKERS, policy=None, ckpt=None
+):
+    """
+    Looks up hw_info.log for every host in probe (see hosts_to_probe) in
+    workers threads, each with its own session. The hardware information
+    found is copied to every host object of the same host.
+
+    A host that fails is reported and skipped, the others are still looked
+    up. Log downloads are retried with policy (a resilience.retry_policy) if
+    given. With ckpt (a checkpoint.checkpoint) every stage finished for a
+    host is recorded, and hosts are restored from it and resume after the
+    last stage they finished.
+
+    Lookups start right away, returns an iterator that yields (host
+    objects, exception or None) for every host in probe as soon as its
+    lookup finishes, in the order lookups finish
+    """
+    restored = []
+    pending = []
+    for host_list in probe.values():
+        stage = None
+        if ckpt is not None:
+            stage = ckpt.restore_host(host_list[0])
+        if stage == "hw_parsed":
+            copy_hw(host_list[0], host_list)
+            restored.append((host_list, None))
+        else:
+            pending.append((host_list, stage))
+
+    local = threading.local()
+    host_progress = progress("hw info", len(pending))
+
+    def probe_host(item):
+        host_list, stage = item
+        if not hasattr(local, "session"):
+            local.session = session_factory()
+        first = host_list[0]
+        error = None
+        try:
+            if stage not in ("task_found", "logs_listed"):
+                first.find_builds_for_host(local.session)
+                if ckpt is not None:
+                    ckpt.save_tasks(first)
+            if stage == "logs_listed":
+                hw_log = ckpt.logs[first.id]
+            else:
+                hw_log = first.find_hw_log(local.session)
+                if ckpt is not None:
+                    ckpt.save_log(first, hw_log)
+            if hw_log is not None:
+                first.read_task_log(local.session, hw_log, store, retry=policy)
+        except Exception as e:
+            print(f"hw info lookup failed for host {first.id}: {e}", file=sys.stderr)
+            error = e
+        else:
+            if ckpt is not None:
+                ckpt.save_host(first)
+        copy_hw(first, host_list)
+        host_progress.update()
+        return host_list, error
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = [executor.submit(probe_host, item) for item in pending]
+
+    def finished():
+        try:
+            yield from restored
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            executor.shutdown()
+
+    return finished()
+
+
+def probe_hosts(
+    session_factory, probe, store=None, workers=WORKERS, policy=None, ckpt=None
+):
+    """
+    Looks up every host in probe, see iter_probe_hosts
+
+    returns a dict of {host id: exception} for the hosts that failed
+    """
+    failed = {}
+    for host_list, error in iter_probe_hosts(
+        session_factory, probe, store, workers, policy, ckpt
+    ):
+        if error is not None:
+            failed[host_list[0].id] = error
+    return failed
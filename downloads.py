@@ -0,0 +1,137 @@
+import os
+import threading
+import requests
+
+# Size of each chunk written to disk while streaming a download
+CHUNK_SIZE = 64 * 1024
+# (connect, read) timeout in seconds for log downloads
+TIMEOUT = (10, 60)
+
+_thread_local = threading.local()
+
+
+def http_session():
+    """
+    Returns a requests.Session for the current thread so each download
+    worker reuses its own connection pool
+    """
+    if not hasattr(_thread_local, "http"):
+        _thread_local.http = requests.Session()
+    return _thread_local.http
+
+
+def remote_size(url, http=requests, validators=None):
+    """
+    Returns the Content-Length of url from a HEAD request, or None if the
+    server does not report it. validators is filled as in download_file.
+    """
+    response = http.head(url, allow_redirects=True, timeout=TIMEOUT)
+    response.raise_for_status()
+    if validators is not None:
+        validators.update(response_validators(response))
+    length = response.headers.get("Content-Length")
+    if length is None:
+        return None
+    return int(length)
+
+
+def response_validators(response):
+    """
+    returns the ETag and Last-Modified headers of a response that has them
+    """
+    return {
+        name: response.headers[name]
+        for name in ("ETag", "Last-Modified")
+        if response.headers.get(name)
+    }
+
+
+def range_total(response):
+    """
+    returns the full size N from the "Content-Range: bytes */N" header of a
+    416 response, or None if the server does not report it
+    """
+    content_range = response.headers.get("Content-Range", "")
+    if not content_range.startswith("bytes */"):
+        return None
+    try:
+        return int(content_range[len("bytes */") :])
+    except ValueError:
+        return None
+
+
+def write_file(dest, data):
+    """
+    Writes data to dest through a temporary file renamed into place
+    """
+    part_path = dest + ".part"
+    with open(part_path, "wb") as f:
+        f.write(data)
+    os.replace(part_path, dest)
+
+
+def download_file(url, dest, http=requests, chunk_size=CHUNK_SIZE, validators=None):
+    """
+    Streams url to dest in binary chunks.
+
+    Data is written to dest + ".part" and renamed into place once complete,
+    so dest only ever exists as a full file. An existing dest whose size
+    matches the server's Content-Length is skipped, and an existing .part
+    file is resumed with an HTTP Range request. A .part file the server
+    rejects the range of is only taken as complete if its size is the
+    server's size, else it is downloaded again. If validators (a dict) is
+    given, it is filled with the ETag and Last-Modified headers of the
+    response.
+
+    returns "skipped", "resumed" or "downloaded"
+    """
+    part_path = dest + ".part"
+
+    if os.path.exists(dest):
+        size = remote_size(url, http, validators)
+        if size is not None and size == os.path.getsize(dest):
+            return "skipped"
+
+    offset = 0
+    if os.path.exists(part_path):
+        offset = os.path.getsize(part_path)
+
+    headers = {}
+    if offset > 0:
+        headers["Range"] = f"bytes={offset}-"
+
+    response = http.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+    try:
+        if response.status_code == 416 and offset > 0:
+            size = range_total(response)
+            if size is None:
+                size = remote_size(url, http, validators)
+            # The .part file already holds the whole body
+            if size == offset:
+                os.replace(part_path, dest)
+                return "resumed"
+        else:
+            response.raise_for_status()
+            if validators is not None:
+                validators.update(response_validators(response))
+
+            # Server ignored the Range header and sent the full body
+            if response.status_code != 206:
+                offset = 0
+
+            mode = "ab" if offset > 0 else "wb"
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+    finally:
+        response.close()
+
+    if response.status_code == 416:
+        # The .part file is not a prefix of the current body, start over
+        os.remove(part_path)
+        return download_file(url, dest, http, chunk_size, validators)
+
+    os.replace(part_path, dest)
+    if offset > 0:
+        return "resumed"
+    return "downloaded"
@@ -1,45 +1,210 @@
+import argparse
+import csv
+import json
+import sys
 import koji
-from pprint import pprint
+from brew_context import get_context
+from multicall import BATCH_SIZE, WORKERS, call_batched, call_parallel
+from progress import progress
 
-mykoji = koji.get_profile_module("brew")
+REPORT_FIELDS = [
+    "host_id",
+    "host_name",
+    "enabled",
+    "channels",
+    "task_id",
+    "parent_id",
+    "scratch",
+    "build_nvr",
+]
 
-opts = vars(mykoji.config)
-session = mykoji.ClientSession(mykoji.config.server, opts)
 
-channels = session.listChannels()
+def collect_hosts(session, channels):
+    """
+    Lists the hosts of every channel in one multicall. Hosts that are in
+    several channels are only kept once.
 
-for channel in channels:
-    channel_name = channel["name"]
-    hosts = session.listHosts(channelID=channel_name)
+    returns a dict of {host id: {"host": listHosts entry, "channels": [names]}}
+    """
+    channel_hosts = call_batched(
+        session, "listHosts", [{"channelID": channel["id"]} for channel in channels]
+    )
+    hosts = {}
+    for channel, host_list in zip(channels, channel_hosts):
+        for brew_host in host_list:
+            entry = hosts.setdefault(
+                brew_host["id"], {"host": brew_host, "channels": []}
+            )
+            entry["channels"].append(channel["name"])
+    return hosts
 
-    print(f"\nchannel name: {channel_name}")
 
-    for host in hosts:
-        # check if host is enabled
-        if host["enabled"]:
-            host_name = host["name"]
-            host_id = host["id"]
-            print(f"\t{host_name}")
-            print(f"\thostID: {host_id}")
+def latest_task_call(host_id):
+    """
+    listTasks arguments for the most recent closed buildArch task of a host
+    """
+    opts = {
+        "host_id": host_id,
+        "method": "buildArch",
+        "state": [koji.TASK_STATES["CLOSED"]],
+    }
+    queryOpts = {"limit": 1, "order": "-completion_time"}
+    return (opts, queryOpts)
 
-            opts = {
+
+def probe_hosts(session_factory, host_ids, batch=BATCH_SIZE, workers=WORKERS):
+    """
+    Finds the latest buildArch task of every host and checks whether its
+    parent task produced a build (scratch builds don't have one)
+
+    returns a dict of {host id: (task or None, build or None)}
+    """
+    task_progress = progress("latest tasks", len(host_ids))
+    task_results = call_parallel(
+        session_factory,
+        "listTasks",
+        [latest_task_call(host_id) for host_id in host_ids],
+        batch=batch,
+        workers=workers,
+        progress=task_progress,
+    )
+
+    latest = {}
+    for host_id, tasks in zip(host_ids, task_results):
+        if isinstance(tasks, Exception):
+            print(f"listTasks failed for host {host_id}: {tasks}", file=sys.stderr)
+            tasks = []
+        latest[host_id] = tasks[0] if len(tasks) > 0 else None
+
+    # Several hosts can run tasks for the same parent, only check it once
+    parent_ids = sorted(
+        {brew_task["parent"] for brew_task in latest.values() if brew_task}
+    )
+    build_progress = progress("scratch checks", len(parent_ids))
+    build_results = call_parallel(
+        session_factory,
+        "listBuilds",
+        [{"taskID": parent_id} for parent_id in parent_ids],
+        batch=batch,
+        workers=workers,
+        progress=build_progress,
+    )
+    builds = {}
+    for parent_id, build in zip(parent_ids, build_results):
+        if isinstance(build, Exception):
+            print(f"listBuilds failed for task {parent_id}: {build}", file=sys.stderr)
+            build = []
+        builds[parent_id] = build[0] if len(build) > 0 else None
+
+    probed = {}
+    for host_id, brew_task in latest.items():
+        if brew_task is None:
+            probed[host_id] = (None, None)
+        else:
+            probed[host_id] = (brew_task, builds[brew_task["parent"]])
+    return probed
+
+
+def build_report(hosts, probed):
+    """
+    returns a list of report rows (dicts keyed by REPORT_FIELDS), one per host
+    """
+    rows = []
+    for host_id in sorted(hosts):
+        brew_host = hosts[host_id]["host"]
+        brew_task, build = probed.get(host_id, (None, None))
+        rows.append(
+            {
                 "host_id": host_id,
-                "method": "buildArch",
-                "state": [koji.TASK_STATES["CLOSED"]],
-                "decode": "True",
+                "host_name": brew_host["name"],
+                "enabled": brew_host["enabled"],
+                "channels": " ".join(hosts[host_id]["channels"]),
+                "task_id": brew_task["id"] if brew_task else None,
+                "parent_id": brew_task["parent"] if brew_task else None,
+                "scratch": build is None if brew_task else None,
+                "build_nvr": build["nvr"] if build else None,
             }
-            queryOpts = {"limit": 1, "order": "-completion_time"}
+        )
+    return rows
+
+
+def write_report(rows, stream, output_format="csv"):
+    """
+    Writes report rows to stream as csv or json
+    """
+    if output_format == "json":
+        json.dump(rows, stream, indent=2)
+        stream.write("\n")
+        return
+    writer = csv.DictWriter(stream, fieldnames=REPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Report the latest buildArch task of every brew build host"
+    )
+    parser.add_argument("-f", "--format", choices=["csv", "json"], default="csv")
+    parser.add_argument("-o", "--output", help="file to write (default: stdout)")
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"calls per multicall (default: {BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help=f"multicalls in flight at once (default: {WORKERS})",
+    )
+    parser.add_argument(
+        "--include-disabled",
+        action="store_true",
+        help="also probe hosts that are disabled",
+    )
+    parser.add_argument(
+        "--login",
+        action="store_true",
+        help="log in to the hub, reusing the login of earlier runs while it is "
+        "valid",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    context = get_context()
+    if args.login:
+        context.login = True
+    session = context.session
+
+    channels = session.listChannels()
+    hosts = collect_hosts(session, channels)
+    host_ids = sorted(
+        host_id
+        for host_id, entry in hosts.items()
+        if entry["host"]["enabled"] or args.include_disabled
+    )
+    print(
+        f"{len(hosts)} hosts in {len(channels)} channels, probing {len(host_ids)}",
+        file=sys.stderr,
+    )
 
-            tasks = session.listTasks(opts, queryOpts)
+    probed = probe_hosts(
+        context.new_session, host_ids, batch=args.batch, workers=args.workers
+    )
+    rows = build_report(hosts, probed)
 
-            # check if there are tasks returned for the host
-            if len(tasks) > 0:
-                parent_id = tasks[0]["parent"]
-                build_info = session.listBuilds(taskID=parent_id)
+    if args.output:
+        with open(args.output, "w", newline="") as fp:
+            write_report(rows, fp, args.format)
+    else:
+        write_report(rows, sys.stdout, args.format)
 
-                # check for scratch build
-                if len(build_info) == 0:
-                    print(f"\t\tscratch build ID: {parent_id}")
 
-            else:
-                print(f"\tNo tasks found on {host_name}:{host_id}")
+if __name__ == "__main__":
+    main()
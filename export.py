@@ -0,0 +1,211 @@
+import csv
+import os
+
+# Rows are handed to pyarrow in record batches of this many rows
+BATCH_ROWS = 10000
+
+EXPORT_FORMATS = ["parquet", "arrow", "csv"]
+
+# Table name: list of (column, arrow type)
+SCHEMAS = {
+    "channels": [
+        ("channel_id", "int64"),
+        ("name", "string"),
+        ("host_count", "int64"),
+        ("group_count", "int64"),
+    ],
+    "hosts": [
+        ("channel_id", "int64"),
+        ("host_id", "int64"),
+        ("name", "string"),
+        ("enabled", "bool_"),
+        ("arches", "string"),
+        ("cpus", "int64"),
+        ("ram", "int64"),
+        ("disk", "string"),
+        ("kernel", "string"),
+        ("operating_system", "string"),
+        ("hw_source", "string"),
+    ],
+    "tasks": [
+        ("host_id", "int64"),
+        ("task_id", "int64"),
+        ("parent_id", "int64"),
+        ("build_id", "int64"),
+        ("nvr", "string"),
+    ],
+    "config_groups": [
+        ("channel_id", "int64"),
+        ("group_index", "int64"),
+        ("host_id", "int64"),
+    ],
+}
+
+FILE_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+
+def arrow_schema(table):
+    """
+    returns the pyarrow schema of one of the SCHEMAS tables, raises
+    ImportError if pyarrow is not installed
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("pyarrow is required for parquet and arrow output")
+    return pa.schema(
+        [(column, getattr(pa, type_name)()) for column, type_name in SCHEMAS[table]]
+    )
+
+
+class table_writer:
+    """
+    Streams rows (dicts keyed by the table's columns) to a parquet, arrow
+    IPC or csv file. csv rows are written as they come, arrow formats buffer
+    at most BATCH_ROWS rows before writing a record batch.
+    """
+
+    def __init__(self, path, table, output_format="parquet"):
+        if output_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {output_format}")
+        self.path = str(path)
+        self.table = table
+        self.output_format = output_format
+        self.columns = [column for column, type_name in SCHEMAS[table]]
+        self.rows_written = 0
+        self._rows = []
+
+        if output_format == "csv":
+            self._file = open(self.path, "w", newline="")
+            self._csv = csv.DictWriter(self._file, fieldnames=self.columns)
+            self._csv.writeheader()
+            return
+
+        self._schema = arrow_schema(table)
+        if output_format == "parquet":
+            import pyarrow.parquet as pq
+
+            self._writer = pq.ParquetWriter(self.path, self._schema)
+        else:
+            import pyarrow as pa
+
+            self._writer = pa.ipc.new_file(self.path, self._schema)
+
+    def write(self, row):
+        self.rows_written += 1
+        if self.output_format == "csv":
+            self._csv.writerow(row)
+            return
+        self._rows.append(row)
+        if len(self._rows) >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self.output_format == "csv":
+            self._file.flush()
+            return
+        if len(self._rows) == 0:
+            return
+        import pyarrow as pa
+
+        arrays = [
+            pa.array([row.get(column) for row in self._rows], type=field.type)
+            for column, field in zip(self.columns, self._schema)
+        ]
+        self._writer.write_batch(
+            pa.RecordBatch.from_arrays(arrays, schema=self._schema)
+        )
+        self._rows = []
+
+    def close(self):
+        self.flush()
+        if self.output_format == "csv":
+            self._file.close()
+        else:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+
+def host_row(channel_id, hosts):
+    """
+    returns the hosts table row for a host object
+    """
+    hw_dict = hosts.hw_dict
+    return {
+        "channel_id": channel_id,
+        "host_id": hosts.id,
+        "name": hosts.name,
+        "enabled": hosts.enabled,
+        "arches": " ".join(hw_dict["arches"] or []),
+        "cpus": hw_dict["CPU(s)"],
+        "ram": hw_dict["Ram"],
+        "disk": hw_dict["Disk"],
+        "kernel": hw_dict["Kernel"],
+        "operating_system": hw_dict["Operating System"],
+        "hw_source": getattr(hosts, "hw_source", None),
+    }
+
+
+def task_row(host_id, tasks):
+    """
+    returns the tasks table row for a task object
+    """
+    build_info = tasks.build_info or {}
+    return {
+        "host_id": host_id,
+        "task_id": tasks.task_id,
+        "parent_id": tasks.parent_id,
+        "build_id": build_info.get("build_id"),
+        "nvr": build_info.get("nvr"),
+    }
+
+
+def export_channels(channels, output_dir, output_format="parquet"):
+    """
+    Writes the channels, hosts, tasks and config_groups tables for an
+    iterable of channel objects to output_dir/<table><extension>. Channels
+    are written out one at a time, so channels can be yielded as they are
+    validated.
+
+    returns a dict of {table: number of rows written}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    writers = {}
+    try:
+        for table in SCHEMAS:
+            path = os.path.join(output_dir, table + FILE_EXTENSIONS[output_format])
+            writers[table] = table_writer(path, table, output_format)
+
+        for brew_channel in channels:
+            writers["channels"].write(
+                {
+                    "channel_id": brew_channel.id,
+                    "name": brew_channel.name,
+                    "host_count": len(brew_channel.host_list),
+                    "group_count": len(brew_channel.config_groups),
+                }
+            )
+            for hosts in brew_channel.host_list:
+                writers["hosts"].write(host_row(brew_channel.id, hosts))
+                for tasks in hosts.task_list:
+                    writers["tasks"].write(task_row(hosts.id, tasks))
+            for group_index, grouping in enumerate(brew_channel.config_groups):
+                for hosts in grouping:
+                    writers["config_groups"].write(
+                        {
+                            "channel_id": brew_channel.id,
+                            "group_index": group_index,
+                            "host_id": hosts.id,
+                        }
+                    )
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return {table: writer.rows_written for table, writer in writers.items()}
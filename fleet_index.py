@@ -0,0 +1,101 @@
+from similarity import similarity_model
+
+# Rules turning a host into its configuration signature. Ram is bucketed in
+# 4G (KiB) steps and Disk in 50G (GiB) steps.
+SIGNATURE_RULES = {
+    "CPU(s)": {"rule": "exact"},
+    "Ram": {"rule": "tolerance", "tolerance": 4000000},
+    "Disk": {"rule": "tolerance", "tolerance": 50},
+    "arches": {"rule": "exact"},
+    "Operating System": {"rule": "exact"},
+}
+
+
+class fleet_index:
+    """
+    Inverted index from configuration signature to the hosts and channels
+    that have it, built once from a list of channel objects with their
+    host_list collected. Queries are answered with set operations on the
+    index instead of scanning every host.
+    """
+
+    def __init__(self, channels, rules=SIGNATURE_RULES):
+        self.model = similarity_model(rules)
+        self.hosts = {}
+        self.channels = {}
+        self.host_signature = {}
+        self.host_channels = {}
+        self.channel_hosts = {}
+        self.channel_signatures = {}
+        self.signature_hosts = {}
+        self.signature_channels = {}
+
+        for brew_channel in channels:
+            self.add_channel(brew_channel)
+
+    def signature(self, hosts):
+        """
+        returns the configuration signature of a host object
+        """
+        return self.model.key(hosts)
+
+    def add_channel(self, brew_channel):
+        """
+        Adds a channel and its hosts to the index. Hosts already indexed
+        from another channel keep their signature.
+        """
+        self.channels[brew_channel.id] = brew_channel
+        self.channel_hosts.setdefault(brew_channel.id, set())
+        self.channel_signatures.setdefault(brew_channel.id, set())
+
+        for hosts in brew_channel.host_list:
+            if hosts.id not in self.host_signature:
+                self.hosts[hosts.id] = hosts
+                self.host_signature[hosts.id] = self.signature(hosts)
+            signature = self.host_signature[hosts.id]
+
+            self.host_channels.setdefault(hosts.id, set()).add(brew_channel.id)
+            self.channel_hosts[brew_channel.id].add(hosts.id)
+            self.channel_signatures[brew_channel.id].add(signature)
+            self.signature_hosts.setdefault(signature, set()).add(hosts.id)
+            self.signature_channels.setdefault(signature, set()).add(brew_channel.id)
+
+    def channels_with_signature(self, signature):
+        """
+        returns the set of channel ids that have hosts with signature
+        """
+        return set(self.signature_channels.get(signature, ()))
+
+    def hosts_with_signature(self, signature):
+        """
+        returns the set of host ids with signature
+        """
+        return set(self.signature_hosts.get(signature, ()))
+
+    def movable_hosts(self, channel_id):
+        """
+        returns the set of host ids outside a channel whose signature is
+        already present in it, ie hosts that could be moved to the channel
+        """
+        candidates = set()
+        for signature in self.channel_signatures.get(channel_id, ()):
+            candidates |= self.signature_hosts[signature]
+        return candidates - self.channel_hosts.get(channel_id, set())
+
+    def subset_channels(self):
+        """
+        returns a list of (channel id, channel id) pairs where the signatures
+        of the first channel are a strict subset of the second's
+        """
+        pairs = []
+        for channel_id, signatures in sorted(self.channel_signatures.items()):
+            if len(signatures) == 0:
+                continue
+            # Only channels having every signature of channel_id can contain it
+            containing = set.intersection(
+                *(self.signature_channels[signature] for signature in signatures)
+            )
+            for other_id in sorted(containing - {channel_id}):
+                if len(self.channel_signatures[other_id]) > len(signatures):
+                    pairs.append((channel_id, other_id))
+        return pairs
@@ -0,0 +1,283 @@
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import koji
+from concurrent.futures import ThreadPoolExecutor
+from brew_context import get_context
+from channel_validator import collect_channels, parse_hw_info, pick_hw_log
+from downloads import http_session
+from logstore import DEFAULT_ROOT, log_store
+from multicall import BATCH_SIZE, call_batched
+
+# Number of non scratch builds per host to collect hw_info.log from
+DEPTH = 5
+# listTasks fetches this many tasks per wanted build to skip scratch builds
+SCRATCH_FACTOR = 3
+# Number of logs downloaded at the same time
+WORKERS = 8
+# Ram totals reported by free drift slightly between kernels, only changes
+# bigger than this fraction are reported
+RAM_TOLERANCE = 0.05
+
+HW_FIELDS = ["CPU(s)", "Ram", "Disk"]
+
+
+class hw_history:
+    """
+    Time series of hardware samples per host, one sample per build, kept in
+    an sqlite database next to the log store
+    """
+
+    def __init__(self, path=os.path.join(DEFAULT_ROOT, "hw_history.sqlite")):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            "host_id INTEGER, build_id INTEGER, completion_ts REAL, "
+            "cpus INTEGER, ram INTEGER, disk TEXT, "
+            "PRIMARY KEY (host_id, build_id))"
+        )
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def sampled_builds(self, host_id):
+        """
+        returns the set of build ids that already have a sample for host_id
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT build_id FROM samples WHERE host_id = ?", (int(host_id),)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def add(self, host_id, build_id, completion_ts, hw_info):
+        """
+        Records the parse_hw_info result of one build for a host
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    int(host_id),
+                    int(build_id),
+                    completion_ts,
+                    hw_info.get("CPU(s)"),
+                    hw_info.get("Ram"),
+                    hw_info.get("Disk"),
+                ),
+            )
+            self._db.commit()
+
+    def timeline(self, host_id):
+        """
+        returns the samples of a host, oldest first, as a list of dicts with
+        build_id, completion_ts and the HW_FIELDS
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT build_id, completion_ts, cpus, ram, disk FROM samples "
+                "WHERE host_id = ? ORDER BY completion_ts",
+                (int(host_id),),
+            ).fetchall()
+        return [
+            {
+                "build_id": build_id,
+                "completion_ts": completion_ts,
+                "CPU(s)": cpus,
+                "Ram": ram,
+                "Disk": disk,
+            }
+            for build_id, completion_ts, cpus, ram, disk in rows
+        ]
+
+    def changes(self, host_id):
+        """
+        Compares each sample of a host with the one before it
+
+        returns a list of dicts with the field that changed, its old and new
+        value and the build/time the new value was first seen
+        """
+        found = []
+        samples = self.timeline(host_id)
+        for previous, current in zip(samples, samples[1:]):
+            for field in HW_FIELDS:
+                old = previous[field]
+                new = current[field]
+                if old is None or new is None or old == new:
+                    continue
+                if field == "Ram" and abs(new - old) <= old * RAM_TOLERANCE:
+                    continue
+                found.append(
+                    {
+                        "host_id": int(host_id),
+                        "field": field,
+                        "old": old,
+                        "new": new,
+                        "build_id": current["build_id"],
+                        "completion_ts": current["completion_ts"],
+                    }
+                )
+        return found
+
+
+def recent_builds(session, hosts, depth=DEPTH, batch=BATCH_SIZE):
+    """
+    Finds the last depth non scratch builds each host ran a buildArch task
+    for. Tasks for all hosts are listed in one multicall and every parent
+    task is checked for a build only once.
+
+    returns a dict of {host id: [(task, build info)]}, newest first
+    """
+    opts_list = []
+    for brew_host in hosts:
+        opts = {
+            "host_id": brew_host.id,
+            "method": "buildArch",
+            "state": [koji.TASK_STATES["CLOSED"]],
+        }
+        queryOpts = {"limit": depth * SCRATCH_FACTOR, "order": "-completion_time"}
+        opts_list.append((opts, queryOpts))
+    host_tasks = call_batched(session, "listTasks", opts_list, batch=batch)
+
+    parent_ids = sorted(
+        {brew_task["parent"] for tasks in host_tasks for brew_task in tasks}
+    )
+    build_results = call_batched(
+        session,
+        "listBuilds",
+        [{"taskID": parent_id} for parent_id in parent_ids],
+        batch=batch,
+    )
+    builds = dict(zip(parent_ids, build_results))
+
+    found = {}
+    for brew_host, tasks in zip(hosts, host_tasks):
+        found[brew_host.id] = []
+        for brew_task in tasks:
+            build = builds[brew_task["parent"]]
+            # Scratch builds have no build info and no logs
+            if len(build) == 0:
+                continue
+            found[brew_host.id].append((brew_task, build[0]))
+            if len(found[brew_host.id]) == depth:
+                break
+    return found
+
+
+def collect_history(
+    session,
+    hosts,
+    history,
+    store,
+    topurl,
+    depth=DEPTH,
+    batch=BATCH_SIZE,
+    workers=WORKERS,
+):
+    """
+    Adds a sample to history for each of the last depth non scratch builds
+    of every host. Builds a host already has a sample for are skipped, logs
+    are read through store so only logs never seen before are downloaded.
+
+    returns the number of new samples
+    """
+    builds = recent_builds(session, hosts, depth=depth, batch=batch)
+    arches = {brew_host.id: brew_host.hw_dict["arches"] for brew_host in hosts}
+
+    wanted = []
+    for host_id, host_builds in builds.items():
+        sampled = history.sampled_builds(host_id)
+        for brew_task, build in host_builds:
+            if build["build_id"] not in sampled:
+                wanted.append((host_id, brew_task, build))
+
+    build_ids = sorted({build["build_id"] for host_id, brew_task, build in wanted})
+    all_logs = call_batched(
+        session, "getBuildLogs", [(build_id,) for build_id in build_ids], batch=batch
+    )
+    logs_by_build = dict(zip(build_ids, all_logs))
+
+    def sample(entry):
+        host_id, brew_task, build = entry
+        hw_log = pick_hw_log(
+            logs_by_build[build["build_id"]],
+            brew_task.get("label", brew_task.get("arch")),
+            arches[host_id],
+        )
+        if hw_log is None:
+            return 0
+        url = os.path.join(topurl, hw_log["path"])
+        hw_log_bytes = store.fetch(
+            build["build_id"], hw_log["dir"], hw_log["name"], url, http=http_session()
+        )
+        hw_info = parse_hw_info(hw_log_bytes.decode(errors="replace"))
+        history.add(host_id, build["build_id"], brew_task["completion_ts"], hw_info)
+        return 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(sample, wanted))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Collect hardware history for the hosts of brew channels"
+    )
+    parser.add_argument("channels", nargs="+", help="channel names")
+    parser.add_argument(
+        "-d",
+        "--depth",
+        type=int,
+        default=DEPTH,
+        help=f"non scratch builds per host to sample (default: {DEPTH})",
+    )
+    parser.add_argument(
+        "--store", default=DEFAULT_ROOT, help="log store and history directory"
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help=f"number of concurrent downloads (default: {WORKERS})",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    context = get_context()
+    session = context.session
+
+    store = log_store(args.store)
+    history = hw_history(os.path.join(args.store, "hw_history.sqlite"))
+
+    channels = [c for c in collect_channels(session) if c.name in args.channels]
+    for brew_channel in channels:
+        brew_channel.collect_hosts(session)
+        added = collect_history(
+            session,
+            brew_channel.host_list,
+            history,
+            store,
+            context.topurl,
+            depth=args.depth,
+            workers=args.workers,
+        )
+        print(f"{brew_channel.name}: {added} new samples", file=sys.stderr)
+        for brew_host in brew_channel.host_list:
+            for change in history.changes(brew_host.id):
+                print(
+                    f"{brew_channel.name} {brew_host.name}: {change['field']} "
+                    f"{change['old']} -> {change['new']} "
+                    f"(build {change['build_id']})"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import zlib
+import requests
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, fall back to zlib
+    zstandard = None
+
+DEFAULT_ROOT = os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "brew-channel-validation",
+    "logs",
+)
+# (connect, read) timeout in seconds for log downloads
+TIMEOUT = (10, 60)
+
+# Lines of hw_info.log that change between runs on the same hardware. They
+# are kept per log, everything else is stored once per distinct base.
+VOLATILE_LINE = re.compile(rb"^(Mem:|Swap:|BogoMIPS:|CPU( \w+)? MHz:|/)")
+
+
+def split_volatile(data):
+    """
+    Splits a log body into a base, with every volatile line blanked out, and
+    a list of [line number, line] for the volatile lines
+
+    returns (base bytes, volatile list)
+    """
+    lines = data.split(b"\n")
+    volatile = []
+    for index, line in enumerate(lines):
+        if VOLATILE_LINE.match(line):
+            # latin-1 maps every byte to one code point, so it survives json
+            volatile.append([index, line.decode("latin-1")])
+            lines[index] = b""
+    return b"\n".join(lines), volatile
+
+
+def join_volatile(base, volatile):
+    """
+    Inverse of split_volatile, returns the original log body
+    """
+    lines = base.split(b"\n")
+    for index, line in volatile:
+        lines[index] = line.encode("latin-1")
+    return b"\n".join(lines)
+
+
+class log_store:
+    """
+    Local content addressed store for build logs, keyed by
+    (build id, arch, log name).
+
+    Log bodies are split into a base and their volatile lines (see
+    VOLATILE_LINE). Bases are compressed with zstd (zlib if zstandard is not
+    installed) and stored once under their sha256, so hosts with identical
+    hardware share one object. An sqlite index maps each key to its base
+    and volatile lines, and to the ETag and Last-Modified headers the log
+    was downloaded with.
+
+    With revalidate, fetch checks stored logs with the server using a
+    conditional GET (If-None-Match/If-Modified-Since) instead of trusting
+    them, a 304 response is still a cache hit.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, revalidate=False):
+        self.root = str(root)
+        self.revalidate = bool(revalidate)
+        # fetch results: "cached", "not_modified" and "downloaded"
+        self.counters = {}
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(self.root, "index.sqlite"), check_same_thread=False
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS logs ("
+            "build_id INTEGER, arch TEXT, name TEXT, sha256 TEXT, base TEXT, "
+            "volatile TEXT, size INTEGER, PRIMARY KEY (build_id, arch, name))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS logs_sha256 ON logs (sha256)")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(logs)")}
+        # Stores created before revalidation lack the validator columns
+        for column in ("etag", "last_modified"):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE logs ADD COLUMN {column} TEXT")
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def _object_path(self, digest, extension):
+        return os.path.join(self.root, "objects", digest[:2], digest + extension)
+
+    def _write_object(self, digest, data):
+        extension = ".zst" if zstandard is not None else ".zlib"
+        path = self._object_path(digest, extension)
+        if os.path.exists(path):
+            return
+        if zstandard is not None:
+            compressed = zstandard.ZstdCompressor().compress(data)
+        else:
+            compressed = zlib.compress(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+
+    def _read_object(self, digest):
+        # Objects written before zstandard was installed are zlib compressed
+        path = self._object_path(digest, ".zst")
+        if zstandard is None or not os.path.exists(path):
+            path = self._object_path(digest, ".zlib")
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if path.endswith(".zst"):
+                    return zstandard.ZstdDecompressor().decompress(mm)
+                return zlib.decompress(mm)
+
+    def _lookup(self, build_id, arch, name):
+        with self._lock:
+            return self._db.execute(
+                "SELECT base, volatile, etag, last_modified FROM logs "
+                "WHERE build_id = ? AND arch = ? AND name = ?",
+                (int(build_id), arch, name),
+            ).fetchone()
+
+    def _body(self, row):
+        base, volatile = row[:2]
+        return join_volatile(self._read_object(base), json.loads(volatile))
+
+    def _count(self, status):
+        with self._lock:
+            self.counters[status] = self.counters.get(status, 0) + 1
+
+    def __contains__(self, key):
+        return self._lookup(*key) is not None
+
+    def get(self, build_id, arch, name):
+        """
+        returns the stored log body as bytes, or None if it is not stored
+        """
+        row = self._lookup(build_id, arch, name)
+        if row is None:
+            return None
+        return self._body(row)
+
+    def put(self, build_id, arch, name, data, etag=None, last_modified=None):
+        """
+        Stores a log body and the validators (ETag and Last-Modified headers)
+        it was served with, returns its sha256
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        base, volatile = split_volatile(data)
+        base_digest = hashlib.sha256(base).hexdigest()
+        self._write_object(base_digest, base)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO logs (build_id, arch, name, sha256, "
+                "base, volatile, size, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    int(build_id),
+                    arch,
+                    name,
+                    digest,
+                    base_digest,
+                    json.dumps(volatile),
+                    len(data),
+                    etag,
+                    last_modified,
+                ),
+            )
+            self._db.commit()
+        return digest
+
+    def put_download(
+        self,
+        build_id,
+        arch,
+        name,
+        path,
+        etag=None,
+        last_modified=None,
+        status="downloaded",
+    ):
+        """
+        Stores a log downloaded to path outside the store (see
+        brew_logs.fetch_log), counted under status, the
+        downloads.download_file result ("downloaded", "resumed" or
+        "skipped" if path already was complete)
+        """
+        with open(path, "rb") as f:
+            self.put(build_id, arch, name, f.read(), etag, last_modified)
+        self._count(status)
+
+    def fetch(self, build_id, arch, name, url, http=requests):
+        """
+        Returns the log body from the store, downloading and storing it from
+        url first if it is not stored yet (see fetch_status)
+        """
+        return self.fetch_status(build_id, arch, name, url, http)[0]
+
+    def fetch_status(self, build_id, arch, name, url, http=requests):
+        """
+        Like fetch, returns (log body, status) where status is "cached" for a
+        log served from the store without asking the server, "not_modified"
+        for a stored log the server revalidated and "downloaded"
+        """
+        row = self._lookup(build_id, arch, name)
+        if row is not None and not self.revalidate:
+            self._count("cached")
+            return self._body(row), "cached"
+
+        headers = {}
+        if row is not None:
+            etag, last_modified = row[2:]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        response = http.get(url, headers=headers, timeout=TIMEOUT)
+        if row is not None and response.status_code == 304:
+            self._count("not_modified")
+            return self._body(row), "not_modified"
+        response.raise_for_status()
+        self.put(
+            build_id,
+            arch,
+            name,
+            response.content,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        self._count("downloaded")
+        return response.content, "downloaded"
+
+    def keys(self, name=None):
+        """
+        returns a list of stored (build id, arch, name) keys, optionally only
+        for one log name
+        """
+        query = "SELECT build_id, arch, name FROM logs"
+        params = ()
+        if name is not None:
+            query += " WHERE name = ?"
+            params = (name,)
+        with self._lock:
+            return self._db.execute(
+                query + " ORDER BY build_id, arch", params
+            ).fetchall()
+
+    def stats(self):
+        """
+        returns a dict with the number of stored logs, distinct log bodies,
+        distinct bases and the total uncompressed size of all logs
+        """
+        with self._lock:
+            logs, bodies, bases, size = self._db.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT sha256), COUNT(DISTINCT base), "
+                "COALESCE(SUM(size), 0) FROM logs"
+            ).fetchone()
+        return {"logs": logs, "bodies": bodies, "bases": bases, "size": size}
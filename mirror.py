@@ -0,0 +1,417 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import channel_validator as cv
+from brew_context import get_context
+from logstore import DEFAULT_ROOT, log_store
+from multicall import BATCH_SIZE, call_batched
+from snapshot import HW_FIELDS
+
+# Number of logs downloaded at the same time
+WORKERS = 8
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS channels (id INTEGER PRIMARY KEY, name TEXT)",
+    "CREATE TABLE IF NOT EXISTS hosts ("
+    "id INTEGER PRIMARY KEY, name TEXT, enabled INTEGER, arches TEXT, "
+    "description TEXT)",
+    "CREATE TABLE IF NOT EXISTS membership ("
+    "channel_id INTEGER, host_id INTEGER, PRIMARY KEY (channel_id, host_id))",
+    "CREATE INDEX IF NOT EXISTS membership_host ON membership (host_id)",
+    # Latest non scratch buildArch task of every host
+    "CREATE TABLE IF NOT EXISTS tasks ("
+    "host_id INTEGER PRIMARY KEY, task_id INTEGER, parent_id INTEGER, "
+    "arch TEXT, completion_ts REAL, build_id INTEGER, build_info TEXT, "
+    "label TEXT)",
+    "CREATE INDEX IF NOT EXISTS tasks_build ON tasks (build_id)",
+    # Hardware read from the hw_info.log of the build in tasks
+    "CREATE TABLE IF NOT EXISTS hardware ("
+    "host_id INTEGER PRIMARY KEY, build_id INTEGER, cpus INTEGER, ram INTEGER, "
+    "disk TEXT, kernel TEXT, operating_system TEXT)",
+    "CREATE INDEX IF NOT EXISTS hardware_config ON hardware (cpus, ram)",
+    "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)",
+]
+
+# hardware columns and the hw_dict fields they hold
+HW_COLUMNS = {name: field for field, name in HW_FIELDS.items() if field != "arches"}
+
+
+class mirror:
+    """
+    Local sqlite mirror of brew channels, hosts, channel membership, the
+    latest non scratch buildArch task of every host and the hardware read
+    from its hw_info.log. sync brings it up to date with the hub, fetching
+    only what changed since the last sync, and load_channels rebuilds
+    channel objects from it without contacting brew.
+    """
+
+    def __init__(self, path=os.path.join(DEFAULT_ROOT, "mirror.sqlite")):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        for statement in SCHEMA:
+            self._db.execute(statement)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(tasks)")}
+        # Mirrors created before task labels were kept lack the column
+        if "label" not in columns:
+            self._db.execute("ALTER TABLE tasks ADD COLUMN label TEXT")
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def get_state(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM state WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set_state(self, key, value):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO state VALUES (?, ?)", (key, json.dumps(value))
+            )
+            self._db.commit()
+
+    def save_listings(self, brew_channels, listings):
+        """
+        Replaces channels, hosts and membership with a listChannels response
+        and the listHosts responses for its channels
+        """
+        brew_hosts = {}
+        membership = []
+        for brew_channel, list_host_response in zip(brew_channels, listings):
+            for brew_host in list_host_response:
+                brew_hosts[brew_host["id"]] = brew_host
+                membership.append((brew_channel["id"], brew_host["id"]))
+
+        with self._lock:
+            self._db.execute("DELETE FROM channels")
+            self._db.executemany(
+                "INSERT INTO channels VALUES (?, ?)",
+                [(c["id"], c["name"]) for c in brew_channels],
+            )
+            self._db.execute("DELETE FROM hosts")
+            self._db.executemany(
+                "INSERT INTO hosts VALUES (?, ?, ?, ?, ?)",
+                [
+                    (h["id"], h["name"], h["enabled"], h["arches"], h["description"])
+                    for h in brew_hosts.values()
+                ],
+            )
+            self._db.execute("DELETE FROM membership")
+            self._db.executemany("INSERT INTO membership VALUES (?, ?)", membership)
+            self._db.commit()
+
+    def host_ids(self, without_task=False):
+        """
+        returns the set of mirrored host ids, only those without a task if
+        without_task
+        """
+        query = "SELECT id FROM hosts"
+        if without_task:
+            query += " WHERE id NOT IN (SELECT host_id FROM tasks)"
+        with self._lock:
+            return {row[0] for row in self._db.execute(query)}
+
+    def save_task(self, host_id, brew_task, build_info):
+        """
+        Records a non scratch task of a host if it is newer than the one
+        recorded, returns True if it was
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT completion_ts FROM tasks WHERE host_id = ?", (host_id,)
+            ).fetchone()
+            if row is not None and row[0] >= brew_task["completion_ts"]:
+                return False
+            self._db.execute(
+                "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    host_id,
+                    brew_task["id"],
+                    brew_task["parent"],
+                    brew_task.get("arch"),
+                    brew_task["completion_ts"],
+                    build_info["build_id"],
+                    json.dumps(build_info, default=str),
+                    brew_task.get("label"),
+                ),
+            )
+            self._db.commit()
+        return True
+
+    def save_hardware(self, hosts):
+        """
+        Records the hardware read from the build log of a host object
+        """
+        build_id = hosts.task_list[0].build_info["build_id"]
+        values = [hosts.hw_dict[field] for field in HW_COLUMNS.values()]
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO hardware VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [hosts.id, build_id] + values,
+            )
+            self._db.commit()
+
+    def load_hosts(self, host_ids=None):
+        """
+        returns {host id: host object} for the mirrored hosts (those in
+        host_ids if given), with their task and hardware filled in
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT h.id, h.name, h.enabled, h.arches, h.description, "
+                "t.task_id, t.parent_id, t.arch, t.label, t.build_info, w.build_id, "
+                + ", ".join(f"w.{name}" for name in HW_COLUMNS)
+                + " FROM hosts h "
+                "LEFT JOIN tasks t ON t.host_id = h.id "
+                "LEFT JOIN hardware w ON w.host_id = h.id AND w.build_id = t.build_id"
+            ).fetchall()
+
+        host_objects = {}
+        for row in rows:
+            host_id, name, enabled, arches, description = row[:5]
+            if host_ids is not None and host_id not in host_ids:
+                continue
+            hosts = cv.host(name, host_id, enabled, arches, description)
+            task_id, parent_id, arch, label, build_info, hw_build_id = row[5:11]
+            if task_id is not None:
+                hosts.task_list.append(
+                    cv.task(task_id, parent_id, json.loads(build_info), arch, label)
+                )
+            if hw_build_id is not None:
+                for field, value in zip(HW_COLUMNS.values(), row[11:]):
+                    hosts.hw_dict[field] = value
+                hosts.hw_source = "log"
+            host_objects[host_id] = hosts
+        return host_objects
+
+    def load_channels(self):
+        """
+        returns channel objects for the mirrored channels with their hosts
+        """
+        host_objects = self.load_hosts()
+        with self._lock:
+            brew_channels = self._db.execute(
+                "SELECT id, name FROM channels ORDER BY id"
+            ).fetchall()
+            membership = self._db.execute(
+                "SELECT channel_id, host_id FROM membership ORDER BY channel_id, host_id"
+            ).fetchall()
+
+        channels = {
+            channel_id: cv.channel(name, channel_id)
+            for channel_id, name in brew_channels
+        }
+        for channel_id, host_id in membership:
+            channels[channel_id].host_list.append(host_objects[host_id])
+        return list(channels.values())
+
+    def stale_hardware(self):
+        """
+        returns the ids of hosts with a task but no hardware read from its
+        build
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT t.host_id FROM tasks t LEFT JOIN hardware w "
+                "ON w.host_id = t.host_id AND w.build_id = t.build_id "
+                "WHERE w.host_id IS NULL"
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def sync(self, session, store, batch=BATCH_SIZE, workers=WORKERS):
+        """
+        Brings the mirror up to date with the hub:
+
+        - channels, hosts and membership are listed again with one multicall
+        - the latest non scratch task of new hosts is found with
+          hwhistory.recent_builds, other hosts only look at the buildArch
+          tasks that closed since the last sync (one paged listTasks query
+          for the fleet, see poller.closed_tasks_since)
+        - hw_info.log is read through store (a logstore.log_store) for the
+          hosts whose latest build changed
+
+        The next sync starts after the newest completion_ts seen, a hub
+        timestamp, so the local clock never decides which tasks are looked
+        at. Until a task is seen every sync looks hosts up like the first.
+
+        returns a dict of counts of what was synced
+        """
+        from hwhistory import recent_builds
+        from poller import closed_tasks_since
+
+        brew_channels = session.listChannels()
+        listings = call_batched(
+            session,
+            "listHosts",
+            [{"channelID": c["id"]} for c in brew_channels],
+            batch=batch,
+        )
+        self.save_listings(brew_channels, listings)
+        counts = {"channels": len(brew_channels), "tasks": 0}
+
+        since = self.get_state("completion_ts")
+        new_hosts = self.load_hosts(self.host_ids(without_task=True))
+        latest = recent_builds(session, list(new_hosts.values()), depth=1, batch=batch)
+        found = [
+            (host_id, brew_task, build_info)
+            for host_id, builds in latest.items()
+            for brew_task, build_info in builds
+        ]
+
+        watermark = since
+        if since is not None:
+            mirrored = self.host_ids()
+            tasks = [
+                brew_task
+                for brew_task in closed_tasks_since(session, since)
+                if brew_task["host_id"] in mirrored
+            ]
+            watermark = max([since] + [t["completion_ts"] for t in tasks])
+            parent_ids = sorted({brew_task["parent"] for brew_task in tasks})
+            build_results = call_batched(
+                session,
+                "listBuilds",
+                [{"taskID": parent_id} for parent_id in parent_ids],
+                batch=batch,
+            )
+            builds = dict(zip(parent_ids, build_results))
+            for brew_task in tasks:
+                build = builds[brew_task["parent"]]
+                # Scratch builds have no build info and no logs
+                if len(build) != 0:
+                    found.append((brew_task["host_id"], brew_task, build[0]))
+        for host_id, brew_task, build_info in found:
+            counts["tasks"] += self.save_task(host_id, brew_task, build_info)
+            if watermark is None or brew_task["completion_ts"] > watermark:
+                watermark = brew_task["completion_ts"]
+
+        stale = self.load_hosts(self.stale_hardware())
+        counts["hardware"], counts["failed"] = self.read_hardware(
+            session, stale.values(), store, workers
+        )
+        if watermark is not None:
+            self.set_state("completion_ts", watermark)
+        counts["hosts"] = len(self.host_ids())
+        return counts
+
+    def read_hardware(self, session, host_list, store, workers=WORKERS):
+        """
+        Reads hw_info.log of the latest build of every host in host_list in
+        workers threads and records the hardware found
+
+        returns the number of hosts read and the number that failed
+        """
+        wanted = []
+        for hosts in host_list:
+            # Log paths are made up from the build and task label, no hub
+            # calls (hosts mirrored without a label list the build's logs)
+            hw_log = hosts.find_hw_log(session)
+            if hw_log is not None:
+                wanted.append((hosts, hw_log))
+
+        def read(item):
+            """
+            returns True if the log was read, None if it is not under the
+            task label and False if the lookup failed
+            """
+            hosts, hw_log = item
+            try:
+                hosts.read_hw_log(hw_log, store)
+            except Exception as e:
+                if hosts.task_list[0].label is not None and cv.log_missing(e):
+                    return None
+                print(
+                    f"hw info lookup failed for host {hosts.id}: {e}", file=sys.stderr
+                )
+                return False
+            self.save_hardware(hosts)
+            return True
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(read, wanted))
+            # Logs missing under the task label are looked up in the build's
+            # logs, with one multicall for all of them
+            missing = [
+                hosts
+                for (hosts, hw_log), result in zip(wanted, results)
+                if result is None
+            ]
+            all_logs = call_batched(
+                session,
+                "getBuildLogs",
+                [(hosts.task_list[0].build_info["build_id"],) for hosts in missing],
+                strict=False,
+            )
+            found = []
+            for hosts, logs in zip(missing, all_logs):
+                if isinstance(logs, Exception):
+                    logs = []
+                hw_log = hosts.pick_hw_log(logs)
+                if hw_log is None:
+                    print(f"no hw_info.log for host {hosts.id}", file=sys.stderr)
+                else:
+                    found.append((hosts, hw_log))
+            results = [result for result in results if result is not None]
+            results += [False] * (len(missing) - len(found))
+            results += [bool(result) for result in executor.map(read, found)]
+        return sum(results), len(results) - sum(results)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Keep a local mirror of brew channels, hosts and their hardware"
+    )
+    parser.add_argument(
+        "--db",
+        default=os.path.join(DEFAULT_ROOT, "mirror.sqlite"),
+        help="mirror database (default: %(default)s)",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    sync = subparsers.add_parser("sync", help="fetch what changed since the last sync")
+    sync.add_argument(
+        "--store",
+        metavar="DIR",
+        default=DEFAULT_ROOT,
+        help="log store for hw_info.log (default: %(default)s)",
+    )
+    sync.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help=f"logs downloaded at the same time (default: {WORKERS})",
+    )
+    subparsers.add_parser("list", help="list the mirrored channels and hosts")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    db = mirror(args.db)
+
+    if args.command == "sync":
+        session = get_context().session
+        counts = db.sync(session, log_store(args.store), workers=args.workers)
+        print(f"synced {counts}")
+    else:
+        for brew_channel in db.load_channels():
+            print(f"{brew_channel.id} {brew_channel.name}")
+            for hosts in brew_channel.host_list:
+                print(
+                    f"  {hosts.id} {hosts.name} CPU(s): {hosts.hw_dict['CPU(s)']} "
+                    f"Ram: {hosts.hw_dict['Ram']} ({hosts.hw_source})"
+                )
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
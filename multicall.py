@@ -0,0 +1,192 @@
+import threading
+import time
+import koji
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of calls sent to the hub in a single multiCall request
+BATCH_SIZE = 100
+# Number of multiCall requests in flight at the same time
+WORKERS = 4
+
+
+def call_batched(session, method, calls, batch=BATCH_SIZE, strict=True, meter=None):
+    """
+    Runs the same brew API method for every entry in calls using koji
+    multicall, sending at most batch calls per request to the hub.
+
+    Each entry in calls is either a tuple of positional arguments or a dict
+    of keyword arguments for the method.
+
+    returns a list of results in the same order as calls. When strict is
+    False, calls that faulted on the hub have their exception in place of
+    a result instead of raising. If meter (a payload_meter) is given, the
+    size of every result is recorded.
+    """
+    if len(calls) == 0:
+        return []
+
+    with session.multicall(strict=strict, batch=batch) as m:
+        virtual_calls = []
+        for call in calls:
+            if isinstance(call, dict):
+                virtual_calls.append(getattr(m, method)(**call))
+            else:
+                virtual_calls.append(getattr(m, method)(*call))
+
+    results = []
+    for virtual_call in virtual_calls:
+        try:
+            results.append(virtual_call.result)
+        except (koji.GenericError, koji.Fault) as e:
+            results.append(e)
+            continue
+        if meter is not None:
+            meter.record(method, results[-1])
+    return results
+
+
+def call_parallel(
+    session_factory, method, calls, batch=BATCH_SIZE, workers=WORKERS, progress=None
+):
+    """
+    Like call_batched, but splits calls into batches and sends up to workers
+    batches to the hub at the same time. koji sessions are not thread safe,
+    so every worker thread creates its own session with session_factory().
+
+    If progress is given, progress.update(n) is called as each batch of n
+    calls completes.
+
+    returns a list of results in the same order as calls
+    """
+    if len(calls) == 0:
+        return []
+
+    local = threading.local()
+
+    def run_batch(batch_calls):
+        if not hasattr(local, "session"):
+            local.session = session_factory()
+        results = call_batched(
+            local.session, method, batch_calls, batch=batch, strict=False
+        )
+        if progress is not None:
+            progress.update(len(batch_calls))
+        return results
+
+    batches = [calls[i : i + batch] for i in range(0, len(calls), batch)]
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_results in executor.map(run_batch, batches):
+            results.extend(batch_results)
+    return results
+
+
+class rate_limiter:
+    """
+    Spaces calls out so that at most rate calls per second are made across
+    all the threads sharing the limiter
+    """
+
+    def __init__(self, rate):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        """
+        Blocks until the next call is allowed
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class throttled_session:
+    """
+    Wraps a koji session so every API call (and every multicall) waits for
+    limiter first
+    """
+
+    def __init__(self, session, limiter):
+        self._session = session
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._session, name)
+        if not callable(attr):
+            return attr
+
+        def throttled(*args, **kwargs):
+            self.limiter.wait()
+            return attr(*args, **kwargs)
+
+        return throttled
+
+
+def payload_size(result):
+    """
+    returns the size in bytes of result encoded as an XML-RPC response, ie
+    about what the hub sent for it
+    """
+    return len(koji.xmlrpcplus.dumps((result,), methodresponse=1, allow_none=1))
+
+
+class payload_meter:
+    """
+    Counts calls and response bytes per brew API method
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.bytes = {}
+        self.largest = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, result):
+        size = payload_size(result)
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.bytes[method] = self.bytes.get(method, 0) + size
+            self.largest[method] = max(self.largest.get(method, 0), size)
+
+    def report(self):
+        """
+        returns a list of lines with calls, total, mean and largest response
+        size per method, most bytes first
+        """
+        lines = []
+        for method in sorted(self.bytes, key=self.bytes.get, reverse=True):
+            calls = self.calls[method]
+            lines.append(
+                f"{method}: {calls} calls, {self.bytes[method]} bytes, "
+                f"{self.bytes[method] // calls} mean, {self.largest[method]} largest"
+            )
+        return lines
+
+
+class metered_session:
+    """
+    Wraps a koji session so the response size of every API call is recorded
+    in meter. Multicalls are passed through, see call_batched.
+    """
+
+    def __init__(self, session, meter):
+        self._session = session
+        self.meter = meter
+
+    def __getattr__(self, name):
+        attr = getattr(self._session, name)
+        if name == "multicall" or not callable(attr):
+            return attr
+
+        def metered(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            self.meter.record(name, result)
+            return result
+
+        return metered
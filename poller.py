@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import sys
+import time
+from brew_context import get_context
+from downloads import write_file
+
+# Tasks fetched per listTasks page
+PAGE_SIZE = 1000
+# Seconds of history polled the first time, when there is no watermark yet
+INITIAL_LOOKBACK = 24 * 60 * 60
+# Seconds between polls in --watch mode
+INTERVAL = 300
+
+
+class watermark:
+    """
+    Poll state kept in a JSON file: the completion_ts of the newest closed
+    buildArch task seen, the ids of the tasks that completed at that time
+    (so they are not reported twice) and the hosts with new tasks that have
+    not been collected again yet, {host id: newest task id}.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.completion_ts = None
+        self.task_ids = set()
+        self.stale_hosts = {}
+        if os.path.exists(self.path):
+            with open(self.path) as fp:
+                state = json.load(fp)
+            self.completion_ts = state["completion_ts"]
+            self.task_ids = set(state["task_ids"])
+            self.stale_hosts = {
+                int(host_id): task_id
+                for host_id, task_id in state["stale_hosts"].items()
+            }
+
+    def advance(self, brew_task):
+        """
+        Moves the watermark to a newly seen task
+        """
+        if (
+            self.completion_ts is None
+            or brew_task["completion_ts"] > self.completion_ts
+        ):
+            self.completion_ts = brew_task["completion_ts"]
+            self.task_ids = set()
+        self.task_ids.add(brew_task["id"])
+
+    def collected(self, host_ids):
+        """
+        Clears host_ids from the stale hosts once they were collected again
+        """
+        for host_id in host_ids:
+            self.stale_hosts.pop(host_id, None)
+
+    def save(self):
+        state = {
+            "completion_ts": self.completion_ts,
+            "task_ids": sorted(self.task_ids),
+            "stale_hosts": self.stale_hosts,
+        }
+        write_file(self.path, json.dumps(state, indent=2).encode())
+
+
+def closed_tasks_since(session, since, page_size=PAGE_SIZE):
+    """
+    Yields every closed buildArch task of the fleet that completed after
+    since (a timestamp), oldest first, fetched a page at a time. New tasks
+    completing while paging sort after the ones already fetched, so offsets
+    stay valid.
+    """
+    import koji
+
+    opts = {
+        "method": "buildArch",
+        "state": [koji.TASK_STATES["CLOSED"]],
+        "completeAfter": since,
+    }
+    offset = 0
+    while True:
+        queryOpts = {
+            "order": "completion_time",
+            "limit": page_size,
+            "offset": offset,
+        }
+        tasks = session.listTasks(opts, queryOpts)
+        yield from tasks
+        if len(tasks) < page_size:
+            return
+        offset += page_size
+
+
+def poll(session, mark, page_size=PAGE_SIZE, now=None):
+    """
+    Finds the hosts that closed a buildArch task since the last poll with
+    one (paged) listTasks query for the whole fleet, adds them to the
+    watermark's stale hosts and advances the watermark. The watermark is
+    not saved.
+
+    returns a dict of {host id: newest task} for the hosts found
+    """
+    since = mark.completion_ts
+    if since is None:
+        since = (time.time() if now is None else now) - INITIAL_LOOKBACK
+        # Nothing closed before since is reported, even if no task is found
+        mark.completion_ts = since
+
+    latest = {}
+    for brew_task in closed_tasks_since(session, since, page_size):
+        if brew_task["id"] in mark.task_ids:
+            continue
+        latest[brew_task["host_id"]] = brew_task
+        mark.advance(brew_task)
+
+    for host_id, brew_task in latest.items():
+        mark.stale_hosts[host_id] = brew_task["id"]
+    return latest
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Find the brew hosts that finished buildArch tasks since "
+        "the last poll"
+    )
+    parser.add_argument("state", help="watermark file, created on first use")
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=PAGE_SIZE,
+        help=f"tasks per listTasks page (default: {PAGE_SIZE})",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep polling every --interval seconds",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=INTERVAL,
+        help=f"seconds between polls with --watch (default: {INTERVAL})",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    session = get_context().session
+    mark = watermark(args.state)
+
+    while True:
+        latest = poll(session, mark, args.page_size)
+        mark.save()
+        for host_id, brew_task in sorted(latest.items()):
+            print(f"{host_id} {brew_task['id']}")
+        print(
+            f"{len(latest)} hosts with new tasks, "
+            f"{len(mark.stale_hosts)} waiting to be collected",
+            file=sys.stderr,
+        )
+        if not args.watch:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
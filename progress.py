@@ -0,0 +1,39 @@
+import sys
+import threading
+import time
+
+
+class progress:
+    """
+    Prints a one line progress indicator with throughput to stderr
+    """
+
+    def __init__(self, label, total, stream=sys.stderr):
+        self.label = str(label)
+        self.total = int(total)
+        self.done = 0
+        self.stream = stream
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def rate(self):
+        """
+        Returns the number of items completed per second so far
+        """
+        elapsed = time.monotonic() - self.start
+        if elapsed <= 0:
+            return 0.0
+        return self.done / elapsed
+
+    def update(self, count=1):
+        """
+        Records count more completed items and redraws the indicator
+        """
+        with self._lock:
+            self.done += count
+            self.stream.write(
+                f"\r{self.label}: {self.done}/{self.total} ({self.rate():.1f}/s)"
+            )
+            if self.done >= self.total:
+                self.stream.write("\n")
+            self.stream.flush()
@@ -0,0 +1,173 @@
+import random
+import socket
+import threading
+import time
+import xmlrpc.client
+
+# Seconds a single hub call may take before it is abandoned
+HUB_TIMEOUT = 120
+# Tries per call, including the first one
+ATTEMPTS = 4
+# Backoff before retry n is a random delay of up to
+# min(BACKOFF_CAP, BACKOFF_BASE * 2 ** n) seconds ("full jitter")
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+# Consecutive retryable failures that open the circuit breaker, and seconds
+# it stays open before a trial call is let through
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 60.0
+
+
+class circuit_open(Exception):
+    """
+    Raised instead of calling the hub while the circuit breaker is open
+    """
+
+
+def is_retryable(error):
+    """
+    Classifies an exception from a hub call or log download. Network
+    errors, timeouts, 5xx/429 responses and an offline hub are worth
+    retrying, faults for bad calls (eg an unknown build) are not.
+    """
+    import koji
+    import requests
+
+    if isinstance(error, (koji.ServerOffline, koji.RetryError)):
+        return True
+    if isinstance(error, (koji.GenericError, koji.Fault)):
+        return False
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else 0
+        return status == 429 or status >= 500
+    if isinstance(error, xmlrpc.client.ProtocolError):
+        return error.errcode == 429 or error.errcode >= 500
+    return isinstance(
+        error,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            ConnectionError,
+            socket.timeout,
+            TimeoutError,
+        ),
+    )
+
+
+class circuit_breaker:
+    """
+    Stops calls to a degraded hub: after threshold consecutive retryable
+    failures the circuit opens and calls fail fast with circuit_open. After
+    reset seconds one trial call is let through, a success closes the
+    circuit again and a failure keeps it open for another reset seconds.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset=BREAKER_RESET):
+        self.threshold = int(threshold)
+        self.reset = float(reset)
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raises circuit_open if calls are not allowed right now
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset:
+                raise circuit_open(f"hub circuit open after {self.failures} failures")
+            # Let this call through as the trial, others keep failing fast
+            self.opened_at = time.monotonic()
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class retry_policy:
+    """
+    Retries calls that fail with a retryable error (see is_retryable) with
+    exponential backoff and jitter. If breaker (a circuit_breaker) is given,
+    calls go through it.
+    """
+
+    def __init__(
+        self,
+        attempts=ATTEMPTS,
+        base=BACKOFF_BASE,
+        cap=BACKOFF_CAP,
+        breaker=None,
+        retryable=is_retryable,
+        sleep=time.sleep,
+    ):
+        self.attempts = int(attempts)
+        self.base = float(base)
+        self.cap = float(cap)
+        self.breaker = breaker
+        self.retryable = retryable
+        self.sleep = sleep
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def delay(self, attempt):
+        """
+        returns the seconds to wait before retry number attempt (0 based)
+        """
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+    def call(self, fn, *args, **kwargs):
+        """
+        returns fn(*args, **kwargs), retrying it on retryable errors. The
+        last error is raised once attempts run out.
+        """
+        for attempt in range(self.attempts):
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not self.retryable(e):
+                    raise
+                if self.breaker is not None:
+                    self.breaker.failure()
+                if attempt + 1 >= self.attempts:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                self.sleep(self.delay(attempt))
+                continue
+            if self.breaker is not None:
+                self.breaker.success()
+            return result
+
+
+class resilient_session:
+    """
+    Wraps a koji session so every API call goes through policy (a
+    retry_policy). Multicalls are passed through as is, retry them as a
+    whole with policy.call.
+    """
+
+    def __init__(self, session, policy):
+        self._session = session
+        self.policy = policy
+
+    def __getattr__(self, name):
+        attr = getattr(self._session, name)
+        if name == "multicall" or not callable(attr):
+            return attr
+
+        def resilient(*args, **kwargs):
+            return self.policy.call(attr, *args, **kwargs)
+
+        return resilient
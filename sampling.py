@@ -0,0 +1,286 @@
+import argparse
+import math
+import random
+from brew_context import get_context
+from channel_validator import group_hosts
+from collect import (
+    WORKERS,
+    collect_hosts,
+    list_channels,
+    probe_hosts,
+    select_channels,
+    session_factory,
+)
+from resilience import circuit_breaker, retry_policy
+from similarity import similarity_model
+
+# Share of every stratum whose build logs are looked up, and the least
+# number of hosts looked up per stratum
+FRACTION = 0.1
+MIN_PER_STRATUM = 2
+# z score of the confidence bounds (95%)
+Z = 1.96
+
+
+def os_release(value):
+    """
+    returns the name and major version of an Operating System description
+    ("RedHat 8.2" -> "RedHat 8"), minor versions don't change the hardware
+    """
+    if value is None:
+        return None
+    name, _, version = value.rpartition(" ")
+    if not name:
+        return value
+    return f"{name} {version.split('.')[0]}"
+
+
+def signature(hosts, model=None):
+    """
+    returns the stratum key of a host: its arches, the operating system
+    release and the buckets of its description values under model (a
+    similarity.similarity_model, the default rules if None), so hosts whose
+    descriptions only differ within a tolerance share a stratum. The key is
+    None after the arches for hosts without a description.
+    """
+    if model is None:
+        model = similarity_model()
+    described = None
+    if hosts.desc_str is not None:
+        described = (os_release(hosts.desc_dict.get("Operating System")),) + tuple(
+            rule.bucket(hosts.desc_dict.get(rule.field)) for rule in model.rules
+        )
+    return tuple(sorted(hosts.arches)), described
+
+
+class stratum:
+    """
+    Hosts of a channel sharing a signature. sampled are the hosts whose
+    build logs were looked up, all of them once the stratum was escalated.
+    """
+
+    def __init__(self, key, hosts):
+        self.key = key
+        self.hosts = list(hosts)
+        self.sampled = []
+        self.escalated = False
+
+    def agrees(self, model=None):
+        """
+        returns True if the sampled hosts all fall in one configuration group
+        """
+        return len(group_hosts(self.sampled, model)) <= 1
+
+
+def stratify(host_list, model=None):
+    """
+    returns the strata of host_list (see signature), largest first
+    """
+    strata = {}
+    for hosts in host_list:
+        strata.setdefault(signature(hosts, model), []).append(hosts)
+    return sorted(
+        (stratum(key, hosts) for key, hosts in strata.items()),
+        key=lambda s: len(s.hosts),
+        reverse=True,
+    )
+
+
+def sample_size(size, fraction=FRACTION, minimum=MIN_PER_STRATUM):
+    """
+    returns the number of hosts sampled from a stratum of size hosts
+    """
+    return min(size, max(minimum, int(math.ceil(size * fraction))))
+
+
+def wilson_interval(count, total, z=Z):
+    """
+    returns the (low, high) Wilson score interval of the proportion
+    count/total
+    """
+    if total == 0:
+        return 0.0, 1.0
+    p = count / total
+    denominator = 1 + z * z / total
+    centre = (p + z * z / (2 * total)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total))
+    return max(0.0, centre - margin / denominator), min(
+        1.0, centre + margin / denominator
+    )
+
+
+def validate_sample(
+    brew_channel,
+    lookup,
+    fraction=FRACTION,
+    minimum=MIN_PER_STRATUM,
+    model=None,
+    rng=random,
+):
+    """
+    Looks up the build logs of a random sample of every stratum of the
+    channel with lookup (called with a list of host objects), and of every
+    remaining host of the strata whose sample disagrees
+
+    returns the list of strata
+    """
+    strata = stratify(brew_channel.host_list, model)
+    for s in strata:
+        s.sampled = rng.sample(s.hosts, sample_size(len(s.hosts), fraction, minimum))
+    lookup([hosts for s in strata for hosts in s.sampled])
+
+    escalate = [
+        s for s in strata if len(s.sampled) < len(s.hosts) and not s.agrees(model)
+    ]
+    for s in escalate:
+        sampled = set(s.sampled)
+        lookup([hosts for hosts in s.hosts if hosts not in sampled])
+        s.sampled = list(s.hosts)
+        s.escalated = True
+    return strata
+
+
+class group_estimate:
+    """
+    A configuration group estimated from samples: the sampled hosts in it,
+    the estimated number of hosts of the channel in it and the (low, high)
+    confidence bounds of that number
+    """
+
+    def __init__(self, hosts, estimate, low, high):
+        self.hosts = hosts
+        self.estimate = estimate
+        self.low = low
+        self.high = high
+
+    def __str__(self):
+        hosts = self.hosts[0]
+        return (
+            f"~{self.estimate:.0f} hosts [{self.low:.0f}, {self.high:.0f}] "
+            f"CPU(s): {hosts.hw_dict['CPU(s)']} Ram: {hosts.hw_dict['Ram']} "
+            f"e.g. {', '.join(str(h.id) for h in self.hosts[:5])}"
+        )
+
+
+def estimate_groups(strata, model=None, z=Z):
+    """
+    Groups the sampled hosts of strata and scales every group up to the
+    channel: a stratum of n hosts, k of them sampled and c of those in a
+    group, adds n * c / k hosts to it, with Wilson score bounds on c / k.
+    Fully looked up strata add exactly c hosts.
+
+    returns a list of group_estimate, largest first
+    """
+    sampled = [hosts for s in strata for hosts in s.sampled]
+    estimates = []
+    for grouping in group_hosts(sampled, model):
+        members = set(grouping)
+        estimate = low = high = 0.0
+        for s in strata:
+            count = sum(hosts in members for hosts in s.sampled)
+            total = len(s.sampled)
+            if total == len(s.hosts):
+                estimate += count
+                low += count
+                high += count
+                continue
+            p_low, p_high = wilson_interval(count, total, z)
+            unsampled = len(s.hosts) - total
+            estimate += len(s.hosts) * count / total
+            low += count + unsampled * p_low
+            high += count + unsampled * p_high
+        estimates.append(group_estimate(grouping, estimate, low, high))
+    return sorted(estimates, key=lambda e: e.estimate, reverse=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Estimate the configuration groups of brew channels from a "
+        "sample of their hosts"
+    )
+    parser.add_argument(
+        "-c", "--channel", action="append", dest="names", help="channel name"
+    )
+    parser.add_argument(
+        "-r",
+        "--channel-regex",
+        action="append",
+        dest="patterns",
+        help="regular expression matched against channel names",
+    )
+    parser.add_argument(
+        "--fraction",
+        type=float,
+        default=FRACTION,
+        help=f"share of every stratum looked up (default: {FRACTION})",
+    )
+    parser.add_argument(
+        "--min-per-stratum",
+        type=int,
+        default=MIN_PER_STRATUM,
+        help=f"least hosts looked up per stratum (default: {MIN_PER_STRATUM})",
+    )
+    parser.add_argument("--seed", type=int, help="random seed for the sample")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help=f"hosts looked up at the same time (default: {WORKERS})",
+    )
+    parser.add_argument("--store", metavar="DIR", help="log store, see logstore.py")
+    parser.add_argument(
+        "--similarity", metavar="FILE", help="similarity rules (see similarity.yml)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    context = get_context()
+    # Hub calls share one circuit breaker, log downloads are only retried
+    hub_policy = retry_policy(breaker=circuit_breaker())
+    download_policy = retry_policy()
+    new_session = session_factory(context, policy=hub_policy)
+    session = new_session()
+    rng = random.Random(args.seed)
+
+    store = None
+    if args.store:
+        from logstore import log_store
+
+        store = log_store(args.store)
+    similarity = None
+    if args.similarity:
+        from similarity import load_similarity
+
+        similarity = load_similarity(args.similarity)
+
+    def lookup(host_list):
+        probe = {hosts.id: [hosts] for hosts in host_list}
+        probe_hosts(new_session, probe, store, args.workers, download_policy)
+
+    channels = select_channels(list_channels(session), args.names, args.patterns)
+    if len(channels) == 0:
+        raise SystemExit("No channels selected")
+    collect_hosts(session, channels, policy=hub_policy)
+
+    for brew_channel in channels:
+        model = None
+        if similarity is not None:
+            model = similarity.model_for(brew_channel.name)
+        strata = validate_sample(
+            brew_channel, lookup, args.fraction, args.min_per_stratum, model, rng
+        )
+        looked_up = sum(len(s.sampled) for s in strata)
+        print(
+            f"{brew_channel.name}: looked up {looked_up} of "
+            f"{len(brew_channel.host_list)} hosts in {len(strata)} strata, "
+            f"{sum(s.escalated for s in strata)} escalated"
+        )
+        for estimate in estimate_groups(strata, model):
+            print(f"  {estimate}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+from setuptools import setup
+
+setup(
+    name="brew-channel-validation",
+    version="0.1.0",
+    description="Validate the host configurations of brew build channels",
+    license="MIT",
+    python_requires=">=3.6",
+    py_modules=[
+        "brew_context",
+        "brew_logs",
+        "channel_validator",
+        "checkpoint",
+        "cli",
+        "collect",
+        "downloads",
+        "enum_channels",
+        "export",
+        "fleet_index",
+        "hwhistory",
+        "logstore",
+        "mirror",
+        "multicall",
+        "poller",
+        "progress",
+        "resilience",
+        "sampling",
+        "similarity",
+        "snapshot",
+    ],
+    install_requires=["koji", "requests", "pyyaml"],
+    extras_require={"export": ["pyarrow"], "compression": ["zstandard"]},
+    entry_points={
+        "console_scripts": ["brew-channel-validate=cli:main"],
+    },
+)
@@ -0,0 +1,287 @@
+import itertools
+import math
+
+# Units of Disk sizes in hw_info.log (df -h), converted to GiB
+DISK_UNITS = {"K": 1.0 / (1024 * 1024), "M": 1.0 / 1024, "G": 1.0, "T": 1024.0}
+
+RULE_TYPES = ["exact", "tolerance", "relative", "ignore"]
+
+# The fields compare_hosts checks, as key rules. Not quite the same groups:
+# Ram is bucketed, so hosts within 4000000 KiB of each other can still fall
+# in neighbouring buckets, and an unknown Ram is a bucket of its own where
+# compare_hosts ignores it (see README)
+DEFAULT_RULES = {
+    "CPU(s)": {"rule": "exact"},
+    "Ram": {"rule": "tolerance", "tolerance": 4000000},
+}
+
+
+def parse_disk(value):
+    """
+    Converts a df -h size such as "198G" to GiB
+    """
+    value = str(value)
+    if value[-1:] in DISK_UNITS:
+        return float(value[:-1]) * DISK_UNITS[value[-1]]
+    return float(value)
+
+
+def field_value(hosts, field):
+    """
+    returns the value of a hw_dict field in a form rules can compare: Disk
+    sizes as GiB, arches as a sorted tuple
+    """
+    value = hosts.hw_dict.get(field)
+    if value is None:
+        return None
+    if field == "Disk":
+        return parse_disk(value)
+    if field == "arches":
+        return tuple(sorted(value))
+    return value
+
+
+class field_rule:
+    """
+    How one hw_dict field is compared:
+
+    exact: values must be equal
+    tolerance: numeric values are bucketed in steps of tolerance
+    relative: numeric values are bucketed in steps of tolerance (a fraction)
+              of their size, so big and small values get the same slack
+    ignore: the field is not compared
+    """
+
+    def __init__(self, field, rule="exact", tolerance=None):
+        if rule not in RULE_TYPES:
+            raise ValueError(f"Unknown rule {rule} for {field}")
+        if rule in ("tolerance", "relative") and not tolerance:
+            raise ValueError(f"Rule {rule} for {field} needs a tolerance")
+        if rule == "relative" and tolerance >= 1:
+            raise ValueError(f"Rule {rule} for {field} needs a tolerance below 1")
+        self.field = str(field)
+        self.rule = rule
+        self.tolerance = tolerance
+        if rule == "relative":
+            self._log_step = math.log1p(tolerance)
+
+    def bucket(self, value):
+        """
+        returns the canonical bucket of value, equal buckets are similar
+        """
+        if value is None or self.rule == "exact":
+            return value
+        # Buckets are centred on multiples of the step
+        if self.rule == "tolerance":
+            return int(math.floor(value / self.tolerance + 0.5))
+        if value <= 0:
+            return 0
+        return int(math.floor(math.log(value) / self._log_step + 0.5))
+
+    def cell(self, value):
+        """
+        returns the grid cell of value for sweep: values in the same cell
+        match, values more than one cell apart don't
+        """
+        if value is None or self.rule == "exact":
+            return 0
+        if self.rule == "tolerance":
+            return int(math.floor(value / self.tolerance))
+        # Relative matches only have the same sign, in cells one tolerance
+        # wide on a log scale, far apart by sign
+        if value == 0:
+            return 0
+        step = -math.log1p(-self.tolerance)
+        cell = int(math.floor(math.log(abs(value)) / step))
+        return cell + 2**62 if value > 0 else cell - 2**62
+
+    def matches(self, a, b):
+        """
+        Pairwise check of two values, used by cluster
+        """
+        if a is None or b is None or self.rule == "exact":
+            return a == b
+        if self.rule == "tolerance":
+            return abs(a - b) <= self.tolerance
+        return abs(a - b) <= max(abs(a), abs(b)) * self.tolerance
+
+
+class similarity_model:
+    """
+    A set of field_rules compiled into a key function. Hosts with the same
+    key are similar, so grouping is a sort/hash of keys instead of comparing
+    every pair of hosts.
+    """
+
+    def __init__(self, rules=DEFAULT_RULES):
+        self.rules = []
+        for field, options in sorted(rules.items()):
+            options = dict(options)
+            if options.get("rule") == "ignore":
+                continue
+            self.rules.append(field_rule(field, **options))
+
+    def key(self, hosts):
+        """
+        returns the tuple of buckets for a host
+        """
+        return tuple(rule.bucket(field_value(hosts, rule.field)) for rule in self.rules)
+
+    def compare(self, hostA, hostB):
+        """
+        returns True if both hosts have the same key
+        """
+        return self.key(hostA) == self.key(hostB)
+
+    def group(self, host_list):
+        """
+        returns a list of host groupings with equal keys, largest first and
+        hosts kept in their original order inside each grouping
+        """
+        groupings = {}
+        for hosts in host_list:
+            groupings.setdefault(self.key(hosts), []).append(hosts)
+        ordered = sorted(groupings.items(), key=lambda item: sort_key(item[0]))
+        return sorted((grouping for key, grouping in ordered), key=len, reverse=True)
+
+    def cluster(self, host_list):
+        """
+        Groups hosts by single linkage: two hosts are neighbours if they match
+        every rule pairwise (field_rule.matches) and groupings are the
+        connected components of neighbours. Unlike group() and the greedy
+        group_hosts, chains of near-equal hosts are never split and the
+        result does not depend on the order of host_list.
+
+        Hosts are first partitioned by their exact fields, then the hosts
+        of each partition are joined by sweep without comparing every pair.
+
+        returns a list of host groupings, largest first, hosts sorted by id
+        """
+        exact = [rule for rule in self.rules if rule.rule == "exact"]
+        ranged = [rule for rule in self.rules if rule.rule != "exact"]
+
+        partitions = {}
+        for hosts in host_list:
+            key = tuple(field_value(hosts, rule.field) for rule in exact)
+            # Unknown values only match unknown values
+            key += tuple(field_value(hosts, rule.field) is None for rule in ranged)
+            partitions.setdefault(key, []).append(hosts)
+
+        groupings = []
+        for members in partitions.values():
+            groupings.extend(sweep(members, ranged))
+
+        groupings = [sorted(grouping, key=lambda h: h.id) for grouping in groupings]
+        return sorted(groupings, key=lambda grouping: (-len(grouping), grouping[0].id))
+
+
+def sweep(members, rules):
+    """
+    Union-find over the hosts in members that match every rule pairwise.
+
+    With one rule, hosts are sorted by its field and only neighbours in that
+    order are compared: a host matching one further away also matches every
+    host in between. With more rules, hosts are put in grid cells one
+    tolerance wide per rule (see field_rule.cell). Hosts sharing a cell all
+    match, so they are joined without comparing them, and hosts can only
+    match hosts of the neighbouring cells, which are compared until the first
+    match joins the two cells.
+
+    returns a list of host groupings
+    """
+    if len(rules) == 0 or len(members) < 2:
+        return [members]
+
+    values = [[field_value(hosts, rule.field) for rule in rules] for hosts in members]
+    parent = list(range(len(members)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        parent[find(j)] = find(i)
+
+    if len(rules) == 1:
+        order = sorted(
+            range(len(members)),
+            key=lambda i: values[i][0] if values[i][0] is not None else 0,
+        )
+        for i, j in zip(order, order[1:]):
+            if rules[0].matches(values[i][0], values[j][0]):
+                union(i, j)
+    else:
+        cells = {}
+        for i in range(len(members)):
+            cell = tuple(rule.cell(value) for rule, value in zip(rules, values[i]))
+            cells.setdefault(cell, []).append(i)
+        for indexes in cells.values():
+            for j in indexes[1:]:
+                union(indexes[0], j)
+
+        offsets = [
+            offset
+            for offset in itertools.product((-1, 0, 1), repeat=len(rules))
+            if offset > (0,) * len(rules)
+        ]
+        for cell, indexes in cells.items():
+            for offset in offsets:
+                others = cells.get(tuple(c + o for c, o in zip(cell, offset)))
+                if others is None or find(indexes[0]) == find(others[0]):
+                    continue
+                for i, j in itertools.product(indexes, others):
+                    if all(
+                        rule.matches(values[i][n], values[j][n])
+                        for n, rule in enumerate(rules)
+                    ):
+                        union(i, j)
+                        break
+
+    components = {}
+    for i in range(len(members)):
+        components.setdefault(find(i), []).append(members[i])
+    return list(components.values())
+
+
+def sort_key(key):
+    """
+    Makes keys with None values sortable
+    """
+    return tuple((value is None, value if value is not None else 0) for value in key)
+
+
+class similarity_config:
+    """
+    Default rules plus per channel overrides
+    """
+
+    def __init__(self, default=DEFAULT_RULES, channels=None):
+        self.default = dict(default)
+        self.channels = dict(channels or {})
+        self._models = {}
+
+    def model_for(self, channel_name):
+        """
+        returns the similarity_model for a channel, the default rules with
+        the channel's rules replacing them field by field
+        """
+        if channel_name not in self._models:
+            rules = dict(self.default)
+            rules.update(self.channels.get(channel_name, {}))
+            self._models[channel_name] = similarity_model(rules)
+        return self._models[channel_name]
+
+
+def load_similarity(path):
+    """
+    Loads a similarity_config from YAML, see similarity.yml
+    """
+    import yaml
+
+    with open(path) as fp:
+        config = yaml.safe_load(fp) or {}
+    return similarity_config(
+        config.get("default", DEFAULT_RULES), config.get("channels", {})
+    )
@@ -0,0 +1,238 @@
+import argparse
+import json
+import sys
+
+# hw_dict fields compared between snapshots, and their snapshot names
+HW_FIELDS = {
+    "arches": "arches",
+    "CPU(s)": "cpus",
+    "Ram": "ram",
+    "Disk": "disk",
+    "Kernel": "kernel",
+    "Operating System": "operating_system",
+}
+
+
+class snapshot:
+    """
+    The validation results of one run keyed by host id. Every host record
+    holds its name, hardware fields and {channel id: config group index}.
+    """
+
+    def __init__(self, hosts=None):
+        self.hosts = dict(hosts or {})
+
+    @classmethod
+    def from_channels(cls, channels):
+        """
+        Takes a snapshot of channel objects with their host_list (and
+        config_groups, if config_check was run)
+        """
+        hosts = {}
+        for brew_channel in channels:
+            group_index = {}
+            for index, grouping in enumerate(brew_channel.config_groups):
+                for grouped in grouping:
+                    group_index[grouped.id] = index
+            for brew_host in brew_channel.host_list:
+                record = hosts.get(brew_host.id)
+                if record is None:
+                    record = {"host_id": brew_host.id, "name": brew_host.name}
+                    for field, name in HW_FIELDS.items():
+                        value = brew_host.hw_dict.get(field)
+                        if field == "arches" and value is not None:
+                            value = " ".join(sorted(value))
+                        record[name] = value
+                    record["channels"] = {}
+                    hosts[brew_host.id] = record
+                record["channels"][brew_channel.id] = group_index.get(brew_host.id)
+        return cls(hosts)
+
+    def save(self, path):
+        """
+        Writes the snapshot as JSON lines, one host per line
+        """
+        with open(path, "w") as fp:
+            for host_id in sorted(self.hosts):
+                fp.write(json.dumps(self.hosts[host_id], sort_keys=True))
+                fp.write("\n")
+
+    @classmethod
+    def load(cls, path):
+        hosts = {}
+        with open(path) as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                # json object keys are strings
+                record["channels"] = {
+                    int(channel_id): group
+                    for channel_id, group in record["channels"].items()
+                }
+                hosts[record["host_id"]] = record
+        return cls(hosts)
+
+
+class snapshot_diff:
+    """
+    Differences between two snapshots
+    """
+
+    def __init__(self):
+        self.added_hosts = []
+        self.removed_hosts = []
+        # (host id, channel id)
+        self.joined = []
+        self.left = []
+        self.moved = []
+        # (host id, field, old value, new value)
+        self.hw_changed = []
+
+    def is_empty(self):
+        return not any(self.to_dict().values())
+
+    def to_dict(self):
+        return {
+            "added_hosts": self.added_hosts,
+            "removed_hosts": self.removed_hosts,
+            "joined": self.joined,
+            "left": self.left,
+            "moved": self.moved,
+            "hw_changed": self.hw_changed,
+        }
+
+    def __str__(self):
+        lines = []
+        lines.extend(f"+ host {host_id}" for host_id in self.added_hosts)
+        lines.extend(f"- host {host_id}" for host_id in self.removed_hosts)
+        lines.extend(
+            f"host {host_id} joined channel {channel_id}"
+            for host_id, channel_id in self.joined
+        )
+        lines.extend(
+            f"host {host_id} left channel {channel_id}"
+            for host_id, channel_id in self.left
+        )
+        lines.extend(
+            f"host {host_id} moved config group in channel {channel_id}"
+            for host_id, channel_id in self.moved
+        )
+        lines.extend(
+            f"host {host_id} {field}: {old} -> {new}"
+            for host_id, field, old, new in self.hw_changed
+        )
+        return "\n".join(lines)
+
+
+def moved_hosts(old, new):
+    """
+    Finds the hosts whose config group changed in one channel. Group
+    indexes are not stable between runs, so every old group is matched to
+    the new group that kept most of its hosts, one to one, and hosts that
+    ended up outside the match of their old group moved. A host does not
+    count as moved because another host joined or left its group: the
+    hosts that left, or were added to an existing group, are the ones that
+    moved.
+
+    old and new are {host id: group index} for the same hosts of the channel
+
+    returns a sorted list of host ids
+    """
+    # {(old group, new group): [host ids]}
+    overlaps = {}
+    for host_id in sorted(old):
+        overlaps.setdefault((old[host_id], new[host_id]), []).append(host_id)
+
+    # Largest overlaps first, ties broken by the lowest host id
+    match = {}
+    matched = set()
+    for pair, host_ids in sorted(
+        overlaps.items(), key=lambda item: (-len(item[1]), item[1][0])
+    ):
+        if pair[0] not in match and pair[1] not in matched:
+            match[pair[0]] = pair[1]
+            matched.add(pair[1])
+
+    return sorted(host_id for host_id in old if match.get(old[host_id]) != new[host_id])
+
+
+def diff_snapshots(old, new):
+    """
+    Compares two snapshots with hash joins on host id and channel id
+
+    returns a snapshot_diff
+    """
+    diff = snapshot_diff()
+    old_ids = set(old.hosts)
+    new_ids = set(new.hosts)
+    diff.added_hosts = sorted(new_ids - old_ids)
+    diff.removed_hosts = sorted(old_ids - new_ids)
+
+    # {channel id: ({host id: old group}, {host id: new group})} for hosts
+    # that are in the channel in both snapshots
+    channel_groups = {}
+    for host_id in sorted(old_ids & new_ids):
+        old_record = old.hosts[host_id]
+        new_record = new.hosts[host_id]
+
+        for channel_id in sorted(
+            set(new_record["channels"]) - set(old_record["channels"])
+        ):
+            diff.joined.append((host_id, channel_id))
+        for channel_id in sorted(
+            set(old_record["channels"]) - set(new_record["channels"])
+        ):
+            diff.left.append((host_id, channel_id))
+        for channel_id in set(old_record["channels"]) & set(new_record["channels"]):
+            old_groups, new_groups = channel_groups.setdefault(channel_id, ({}, {}))
+            old_groups[host_id] = old_record["channels"][channel_id]
+            new_groups[host_id] = new_record["channels"][channel_id]
+
+        for name in HW_FIELDS.values():
+            if old_record.get(name) != new_record.get(name):
+                diff.hw_changed.append(
+                    (host_id, name, old_record.get(name), new_record.get(name))
+                )
+
+    for channel_id in sorted(channel_groups):
+        old_groups, new_groups = channel_groups[channel_id]
+        for host_id in moved_hosts(old_groups, new_groups):
+            diff.moved.append((host_id, channel_id))
+
+    return diff
+
+
+def diff_channels(old_channels, new_channels):
+    """
+    Compares two lists of channel objects, see diff_snapshots
+    """
+    return diff_snapshots(
+        snapshot.from_channels(old_channels), snapshot.from_channels(new_channels)
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare two channel validation snapshots"
+    )
+    parser.add_argument("old", help="older snapshot (JSON lines)")
+    parser.add_argument("new", help="newer snapshot (JSON lines)")
+    parser.add_argument("-f", "--format", choices=["text", "json"], default="text")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    diff = diff_snapshots(snapshot.load(args.old), snapshot.load(args.new))
+    if args.format == "json":
+        json.dump(diff.to_dict(), sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    elif not diff.is_empty():
+        print(diff)
+    # exit status 1 when the snapshots differ, like diff(1)
+    return 1 if not diff.is_empty() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
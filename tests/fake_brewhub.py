@@ -0,0 +1,382 @@
+import argparse
+import random
+import threading
+import time
+import xmlrpc.client
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import koji
+
+ARCHES = ["x86_64", "ppc64le", "aarch64", "s390x"]
+# (CPU(s), Ram in KiB, Disk) of the hardware configurations hosts get
+CONFIGS = [
+    (4, 16252928, "100G"),
+    (8, 24050560, "198G"),
+    (16, 65536000, "500G"),
+    (32, 131072000, "1.0T"),
+]
+# First completion_ts of the synthetic task history
+EPOCH = 1600000000.0
+# faultCode of koji.GenericError
+GENERIC_FAULT = 1000
+
+
+def hw_log(cpus, ram, disk):
+    """
+    returns a hw_info.log body for a hardware configuration
+    """
+    return (
+        "CPU info:\n"
+        f"CPU(s):              {cpus}\n"
+        "\n"
+        "Memory:\n"
+        "              total        used        free\n"
+        f"Mem:       {ram}      994276    17234720\n"
+        "\n"
+        "Storage:\n"
+        "Filesystem             Size  Used Avail Use% Mounted on\n"
+        f"/dev/mapper/rhel-root  {disk}  6.3G  192G   4% /\n"
+    ).encode()
+
+
+def description(cpus, ram, updated="2021-06-24"):
+    return (
+        f"Updated: {updated}\n"
+        "Infrastructure Type: NA\n"
+        "Operating System: RedHat 8.2\n"
+        "Kernel: 4.18.0-193.28.1.el8_2\n"
+        f"vCPU Count: {cpus}\n"
+        f"Total Memory: {ram / 1000 / 1024:.3f} gb\n"
+    )
+
+
+class fleet:
+    """
+    Synthetic brew fleet: channels, hosts with a hardware configuration
+    each, and the closed buildArch tasks, builds and hw_info.log files of
+    their history. Some hosts have no description or a stale one, some
+    tasks are scratch builds and some are noarch or i686 builds, whose
+    logs are not under the task arch, like the real fleet. The same seed gives the
+    same fleet.
+    """
+
+    def __init__(
+        self,
+        hosts=100,
+        channels=10,
+        tasks_per_host=5,
+        scratch_rate=0.2,
+        seed=0,
+    ):
+        rng = random.Random(seed)
+        self.channels = [
+            {"id": channel_id, "name": f"channel-{channel_id}"}
+            for channel_id in range(1, channels + 1)
+        ]
+        self.hosts = {}
+        self.configs = {}
+        self.channel_hosts = {c["id"]: [] for c in self.channels}
+        self.tasks = []
+        self.builds = {}
+        self.logs = {}
+
+        task_id = 1000
+        for host_id in range(1, hosts + 1):
+            arch = rng.choice(ARCHES)
+            config = rng.choice(CONFIGS)
+            self.configs[host_id] = config
+            kind = rng.random()
+            if kind < 0.1:
+                host_description = None
+            elif kind < 0.2:
+                host_description = description(*config[:2], updated="2019-01-01")
+            else:
+                host_description = description(*config[:2])
+            self.hosts[host_id] = {
+                "id": host_id,
+                "name": f"{arch}-{host_id:04d}.build.example.com",
+                "arches": f"{arch} i386" if arch == "x86_64" else arch,
+                "enabled": rng.random() > 0.05,
+                "ready": True,
+                "capacity": 3.0,
+                "task_load": 0.0,
+                "user_id": host_id,
+                "comment": None,
+                "description": host_description,
+            }
+            for channel in rng.sample(self.channels, rng.randint(1, 3)):
+                self.channel_hosts[channel["id"]].append(host_id)
+
+            for n in range(tasks_per_host):
+                task_id += 2
+                completion_ts = EPOCH + rng.uniform(0, 365 * 24 * 60 * 60)
+                # Logs are stored under the task label, which is not the
+                # task arch for noarch and i686 builds
+                task_arch = label = arch
+                kind = rng.random()
+                if kind < 0.2:
+                    label = "noarch"
+                elif kind < 0.3 and arch == "x86_64":
+                    task_arch, label = "i386", "i686"
+                self.tasks.append(
+                    {
+                        "id": task_id,
+                        "parent": task_id - 1,
+                        "host_id": host_id,
+                        "method": "buildArch",
+                        "state": koji.TASK_STATES["CLOSED"],
+                        "arch": task_arch,
+                        "label": label,
+                        "completion_ts": completion_ts,
+                        "completion_time": time.strftime(
+                            "%Y-%m-%d %H:%M:%S", time.gmtime(completion_ts)
+                        ),
+                    }
+                )
+                if rng.random() < scratch_rate:
+                    continue
+                build = {
+                    "build_id": task_id - 1,
+                    "id": task_id - 1,
+                    "task_id": task_id - 1,
+                    "name": f"pkg{task_id % 97}",
+                    "version": "1.0",
+                    "release": str(task_id - 1),
+                    "nvr": f"pkg{task_id % 97}-1.0-{task_id - 1}",
+                    "volume_name": "DEFAULT",
+                    "state": koji.BUILD_STATES["COMPLETE"],
+                }
+                self.builds[task_id - 1] = build
+                path = koji.PathInfo(topdir="").build_logs(build).lstrip("/")
+                self.logs[f"{path}/{label}/hw_info.log"] = hw_log(*config)
+
+    def listChannels(self, **kwargs):
+        return list(self.channels)
+
+    def listHosts(self, channelID=None, enabled=None, **kwargs):
+        if channelID is None:
+            host_ids = sorted(self.hosts)
+        else:
+            host_ids = self.channel_hosts.get(channelID, [])
+        return [
+            self.hosts[host_id]
+            for host_id in host_ids
+            if enabled is None or self.hosts[host_id]["enabled"] == enabled
+        ]
+
+    def listTasks(self, opts=None, queryOpts=None):
+        opts = opts or {}
+        queryOpts = queryOpts or {}
+        tasks = self.tasks
+        if "host_id" in opts:
+            tasks = [t for t in tasks if t["host_id"] == opts["host_id"]]
+        if "method" in opts:
+            tasks = [t for t in tasks if t["method"] == opts["method"]]
+        if "state" in opts:
+            tasks = [t for t in tasks if t["state"] in opts["state"]]
+        if "parent" in opts:
+            tasks = [t for t in tasks if t["parent"] == opts["parent"]]
+        if "completeAfter" in opts:
+            tasks = [t for t in tasks if t["completion_ts"] > opts["completeAfter"]]
+        order = queryOpts.get("order", "id")
+        field = order.lstrip("-")
+        if field == "completion_time":
+            field = "completion_ts"
+        tasks = sorted(tasks, key=lambda t: t[field], reverse=order.startswith("-"))
+        offset = queryOpts.get("offset", 0)
+        limit = queryOpts.get("limit")
+        return tasks[offset:] if limit is None else tasks[offset : offset + limit]
+
+    def listBuilds(self, taskID=None, **kwargs):
+        if taskID is None:
+            return list(self.builds.values())
+        build = self.builds.get(taskID)
+        return [] if build is None else [build]
+
+    def getBuildLogs(self, build_id):
+        build = self.builds.get(build_id)
+        if build is None:
+            raise koji.GenericError(f"No such build: {build_id}")
+        path = koji.PathInfo(topdir="").build_logs(build).lstrip("/")
+        return [
+            {"dir": log_path.split("/")[-2], "name": "hw_info.log", "path": log_path}
+            for log_path in self.logs
+            if log_path.startswith(path + "/")
+        ]
+
+    def getKojiVersion(self):
+        return "1.34.0"
+
+
+class threading_server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class hub_handler(BaseHTTPRequestHandler):
+    """
+    XML-RPC hub on POST, static files of topurl on GET
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def _injected_failure(self):
+        hub = self.server.hub
+        if hub.latency:
+            time.sleep(hub.latency)
+        with hub.lock:
+            failed = hub.rng.random() < hub.error_rate
+        if failed:
+            hub.count("errors")
+            self.send_error(503)
+        return failed
+
+    def do_GET(self):
+        hub = self.server.hub
+        hub.count("GET")
+        if self._injected_failure():
+            return
+        path = self.path.split("?")[0]
+        body = hub.fleet.logs.get(path[len("/brewroot/") :])
+        if not path.startswith("/brewroot/") or body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        hub = self.server.hub
+        request = self.rfile.read(int(self.headers["Content-Length"]))
+        if self._injected_failure():
+            return
+        params, method = xmlrpc.client.loads(request, use_builtin_types=True)
+        try:
+            if method == "multiCall":
+                result = [hub.multicall_entry(call) for call in params[0]]
+            else:
+                result = hub.call(method, params)
+            response = xmlrpc.client.dumps(
+                (result,), methodresponse=True, allow_none=True
+            )
+        except koji.GenericError as e:
+            response = xmlrpc.client.dumps(
+                xmlrpc.client.Fault(GENERIC_FAULT, str(e)), allow_none=True
+            )
+        body = response.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class fake_brewhub:
+    """
+    Local stand-in for the brew hub and its topurl, serving a fleet over
+    XML-RPC (koji.ClientSession(hub.url) works against it, multicalls
+    included) and its hw_info.log files over HTTP. Every request waits
+    latency seconds and fails with a 503 at error_rate. calls counts the
+    calls per method, multicall entries included, as well as GET requests
+    and injected errors.
+    """
+
+    def __init__(self, fleet, latency=0.0, error_rate=0.0, seed=0, port=0):
+        self.fleet = fleet
+        self.latency = float(latency)
+        self.error_rate = float(error_rate)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self._server = threading_server(("127.0.0.1", port), hub_handler)
+        self._server.hub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/brewhub"
+
+    @property
+    def topurl(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/brewroot"
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def call(self, method, params):
+        """
+        returns the result of a hub method of the fleet
+        """
+        if method.startswith("_") or not hasattr(self.fleet, method):
+            raise koji.GenericError(f"Invalid method: {method}")
+        self.count(method)
+        args, kwargs = koji.decode_args(*params)
+        return getattr(self.fleet, method)(*args, **kwargs)
+
+    def multicall_entry(self, call):
+        """
+        returns a multiCall result: [result] or a fault dict
+        """
+        try:
+            return [self.call(call["methodName"], call["params"])]
+        except koji.GenericError as e:
+            return {"faultCode": GENERIC_FAULT, "faultString": str(e)}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve a synthetic brew fleet for load testing the validator"
+    )
+    parser.add_argument("--hosts", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--tasks-per-host", type=int, default=5)
+    parser.add_argument("--scratch-rate", type=float, default=0.2)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of requests failing"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8080)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    hub = fake_brewhub(
+        fleet(
+            args.hosts, args.channels, args.tasks_per_host, args.scratch_rate, args.seed
+        ),
+        args.latency,
+        args.error_rate,
+        args.seed,
+        args.port,
+    )
+    print("koji profile for ~/.koji/config.d/fake.conf:")
+    print(f"[fake]\nserver = {hub.url}\ntopurl = {hub.topurl}\n")
+    try:
+        hub._server.serve_forever()
+    except KeyboardInterrupt:
+        print(hub.calls)
+
+
+if __name__ == "__main__":
+    main()
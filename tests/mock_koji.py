@@ -0,0 +1,41 @@
+class MockVirtualCall:
+    """
+    Stand-in for koji's VirtualCall holding an already computed result
+    """
+
+    def __init__(self, result=None, error=None):
+        self._result = result
+        self._error = error
+
+    @property
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class MockMultiCall:
+    """
+    Stand-in for koji's MultiCallSession that runs calls on session
+    immediately
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __getattr__(self, name):
+        method = getattr(self.session, name)
+
+        def call(*args, **kwargs):
+            try:
+                return MockVirtualCall(method(*args, **kwargs))
+            except Exception as e:
+                return MockVirtualCall(error=e)
+
+        return call
@@ -0,0 +1,145 @@
+import json
+import koji
+from brew_context import brew_context
+
+
+def test_profile_resolved_once(monkeypatch):
+    calls = []
+    real_get_profile_module = koji.get_profile_module
+
+    def counting_get_profile_module(name):
+        calls.append(name)
+        return real_get_profile_module(name)
+
+    monkeypatch.setattr(koji, "get_profile_module", counting_get_profile_module)
+    context = brew_context()
+    assert calls == []
+
+    context.topurl
+    context.topurl
+    session = context.session
+
+    assert calls == ["brew"]
+    assert context.session is session
+    assert context.new_session() is not session
+
+
+def test_sessions_share_connection_pool():
+    context = brew_context()
+    first, second = context.new_session(), context.new_session()
+    assert first.rsession is not second.rsession
+    url = context.profile.config.server
+    assert first.rsession.get_adapter(url) is second.rsession.get_adapter(url)
+
+
+class FakeHub:
+    def __init__(self):
+        self.logins = 0
+        self.sessions = 0
+        self.expired = set()
+
+
+class FakeProfile:
+    """
+    koji profile module whose sessions log in to hub
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.config = type("config", (), {"server": "https://hub", "authtype": None})
+
+        class ClientSession:
+            def __init__(session, server, opts, sinfo=None):
+                session.setSession(sinfo)
+
+            def setSession(session, sinfo):
+                session.sinfo = sinfo
+                session.callnum = None if sinfo is None else 0
+
+            def _check(session):
+                if session.sinfo is None or session.sinfo["session-id"] in hub.expired:
+                    raise koji.AuthExpired("session expired")
+                session.callnum += 1
+
+            def gssapi_login(session, principal=None, keytab=None):
+                hub.logins += 1
+                hub.sessions += 1
+                session.setSession({"session-id": hub.sessions})
+
+            def getLoggedInUser(session):
+                session._check()
+                return {"name": "validator"}
+
+            def callMethod(session, name):
+                assert name == "subsession"
+                session._check()
+                hub.sessions += 1
+                return {"session-id": hub.sessions}
+
+            def listChannels(session):
+                session._check()
+                return [{"id": 21, "name": "rhel8"}]
+
+        self.ClientSession = ClientSession
+
+
+def login_context(hub, tmp_path):
+    context = brew_context(login=True, session_cache=str(tmp_path / "session.json"))
+    context._profile = FakeProfile(hub)
+    return context
+
+
+def test_login_reused(tmp_path):
+    hub = FakeHub()
+    context = login_context(hub, tmp_path)
+
+    sessions = [context.new_session() for i in range(3)]
+    assert hub.logins == 1
+    assert len({session.sinfo["session-id"] for session in sessions}) == 3
+
+    # A later run restores the login instead of logging in again
+    context = login_context(hub, tmp_path)
+    session = context.new_session()
+    assert hub.logins == 1
+    assert session.listChannels()[0]["id"] == 21
+
+    # Expired logins are renewed and the call retried
+    hub.expired.update(range(1, hub.sessions + 1))
+    assert session.listChannels()[0]["id"] == 21
+    assert hub.logins == 2
+
+
+def test_login_saved_once(tmp_path, monkeypatch):
+    hub = FakeHub()
+    context = login_context(hub, tmp_path)
+    saved = []
+    real_save_login = context._save_login
+    monkeypatch.setattr(
+        context, "_save_login", lambda session: saved.append(real_save_login(session))
+    )
+
+    # Parallel workers only take subsessions, the login is saved when made
+    for i in range(4):
+        context.new_session()
+    assert len(saved) == 1
+    assert json.loads((tmp_path / "session.json").read_text())["sinfo"] == {
+        "session-id": 1
+    }
+
+    hub.expired.add(1)
+    context.new_session()
+    assert len(saved) == 2
+
+
+def test_expired_login_renewed_once(tmp_path):
+    hub = FakeHub()
+    context = login_context(hub, tmp_path)
+    sessions = [context.new_session() for i in range(8)]
+    assert hub.logins == 1
+
+    # Every worker finds the login expired, only the first one logs in again
+    hub.expired.update(range(1, hub.sessions + 1))
+    for session in sessions:
+        assert session.listChannels()[0]["id"] == 21
+    assert hub.logins == 2
+    assert len({session.sinfo["session-id"] for session in sessions}) == 8
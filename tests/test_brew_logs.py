@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import brew_logs
+from downloads import download_file
+from tests.mock_koji import MockMultiCall
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(TESTS_DIR, "fixtures")
+
+LOG_BODY = b"CPU info:\nCPU(s):              8\n" * 100
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves LOG_BODY for every path and honours "Range: bytes=N-" headers
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(LOG_BODY)))
+        self.end_headers()
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.get("Range"))
+        body = LOG_BODY
+        range_header = self.headers.get("Range")
+        if range_header:
+            start = int(range_header[len("bytes=") : -1])
+            if start >= len(LOG_BODY):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(LOG_BODY)}")
+                self.end_headers()
+                return
+            body = LOG_BODY[start:]
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def log_server():
+    server = HTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def server_url(server, path="hw_info.log"):
+    return f"http://127.0.0.1:{server.server_address[1]}/{path}"
+
+
+def test_download_file(log_server, tmp_path):
+    dest = str(tmp_path / "hw_info.log")
+
+    assert download_file(server_url(log_server), dest) == "downloaded"
+    assert open(dest, "rb").read() == LOG_BODY
+    assert not os.path.exists(dest + ".part")
+
+
+def test_download_file_skips_matching_size(log_server, tmp_path):
+    dest = tmp_path / "hw_info.log"
+    dest.write_bytes(LOG_BODY)
+
+    assert download_file(server_url(log_server), str(dest)) == "skipped"
+    assert log_server.requests == []
+
+
+def test_download_file_resumes_partial(log_server, tmp_path):
+    dest = str(tmp_path / "hw_info.log")
+    with open(dest + ".part", "wb") as f:
+        f.write(LOG_BODY[:100])
+
+    assert download_file(server_url(log_server), dest) == "resumed"
+    assert log_server.requests == ["bytes=100-"]
+    assert open(dest, "rb").read() == LOG_BODY
+
+
+def test_download_file_complete_partial(log_server, tmp_path):
+    dest = str(tmp_path / "hw_info.log")
+    with open(dest + ".part", "wb") as f:
+        f.write(LOG_BODY)
+
+    assert download_file(server_url(log_server), dest) == "resumed"
+    assert log_server.requests == [f"bytes={len(LOG_BODY)}-"]
+    assert open(dest, "rb").read() == LOG_BODY
+
+
+def test_download_file_restarts_stale_partial(log_server, tmp_path):
+    dest = str(tmp_path / "hw_info.log")
+    with open(dest + ".part", "wb") as f:
+        f.write(LOG_BODY + b"stale")
+
+    assert download_file(server_url(log_server), dest) == "downloaded"
+    assert log_server.requests == [f"bytes={len(LOG_BODY) + 5}-", None]
+    assert open(dest, "rb").read() == LOG_BODY
+    assert not os.path.exists(dest + ".part")
+
+
+class MockSession:
+    def multicall(self, strict=False, batch=None):
+        return MockMultiCall(self)
+
+    def getBuild(self, build):
+        if build in (1757570, "e2e-module-test-1.0.4127-1.module+e2e+12941+acfc830c"):
+            return {
+                "id": 1757570,
+                "nvr": "e2e-module-test-1.0.4127-1.module+e2e+12941+acfc830c",
+            }
+        return None
+
+    def getBuildLogs(self, build_id):
+        fixture = os.path.join(
+            FIXTURES_DIR, "calls", "getBuildLogs", str(build_id) + ".json"
+        )
+        with open(fixture) as fp:
+            return json.load(fp)
+
+
+def test_resolve_builds():
+    builds = brew_logs.resolve_builds(
+        MockSession(),
+        ["1757570", "e2e-module-test-1.0.4127-1.module+e2e+12941+acfc830c"],
+    )
+    assert [build["id"] for build in builds] == [1757570, 1757570]
+
+    with pytest.raises(SystemExit):
+        brew_logs.resolve_builds(MockSession(), ["no-such-build-1-1"])
+
+
+def test_find_logs():
+    session = MockSession()
+    builds = brew_logs.resolve_builds(session, ["1757570"])
+
+    matches = brew_logs.find_logs(session, builds, ["hw_info.log"])
+    assert sorted(log["dir"] for build, log in matches) == [
+        "aarch64",
+        "i686",
+        "ppc64le",
+        "s390x",
+        "x86_64",
+    ]
+
+    matches = brew_logs.find_logs(session, builds, ["hw_info.log"], ["s390x"])
+    assert [log["dir"] for build, log in matches] == ["s390x"]
+
+
+def test_fetch_log_resumes_partial_with_store(log_server, tmp_path):
+    from logstore import log_store
+
+    store = log_store(tmp_path / "store")
+    build_info = {"id": 1757570, "nvr": "pkg-1.0-1"}
+    log = {"dir": "x86_64", "name": "hw_info.log", "path": "hw_info.log"}
+    local_path = brew_logs.local_log_path(str(tmp_path), build_info, log)
+    os.makedirs(os.path.dirname(local_path))
+    with open(local_path + ".part", "wb") as f:
+        f.write(LOG_BODY[:100])
+
+    topurl = server_url(log_server, "")
+    assert brew_logs.fetch_log(topurl, str(tmp_path), build_info, log, store) == (
+        local_path,
+        "resumed",
+    )
+    assert log_server.requests == ["bytes=100-"]
+    assert store.get(1757570, "x86_64", "hw_info.log") == LOG_BODY
+    assert store.counters == {"resumed": 1}
+
+    # Stored logs are not downloaded again
+    os.remove(local_path)
+    assert brew_logs.fetch_log(topurl, str(tmp_path), build_info, log, store) == (
+        local_path,
+        "cached",
+    )
+    assert log_server.requests == ["bytes=100-"]
+    assert open(local_path, "rb").read() == LOG_BODY
+
+
+def test_fetch_log_counts_skipped_with_store(log_server, tmp_path):
+    from logstore import log_store
+
+    store = log_store(tmp_path / "store")
+    build_info = {"id": 1757570, "nvr": "pkg-1.0-1"}
+    log = {"dir": "x86_64", "name": "hw_info.log", "path": "hw_info.log"}
+    local_path = brew_logs.local_log_path(str(tmp_path), build_info, log)
+    os.makedirs(os.path.dirname(local_path))
+    with open(local_path, "wb") as f:
+        f.write(LOG_BODY)
+
+    topurl = server_url(log_server, "")
+    assert brew_logs.fetch_log(topurl, str(tmp_path), build_info, log, store) == (
+        local_path,
+        "skipped",
+    )
+    assert log_server.requests == []
+    assert store.get(1757570, "x86_64", "hw_info.log") == LOG_BODY
+    assert store.counters == {"skipped": 1}
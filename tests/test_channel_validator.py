@@ -1,23 +1,25 @@
 import json
 import os
+import subprocess
+import sys
 import pytest
-import koji
 import requests
 import yaml
+from datetime import date
 import channel_validator as cv
+import logstore
+from brew_context import get_context
 
-# Session object for use in monkeypatching
-mykoji = koji.get_profile_module("brew")
-opts = vars(mykoji.config)
-session = mykoji.ClientSession(mykoji.config.server, opts)
 
-
-@pytest.fixture(autouse=True)
-def del_session_requests(monkeypatch):
+@pytest.fixture
+def session(monkeypatch):
     """
-    Delete rsession attr from session to avoid brew API calls
+    Shared session object for use in monkeypatching. Delete rsession attr
+    from session to avoid brew API calls
     """
-    monkeypatch.delattr(session, "rsession")
+    brew_session = get_context().session
+    monkeypatch.delattr(brew_session, "rsession")
+    return brew_session
 
 
 TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -147,8 +149,34 @@ class MockSession:
         return "CPU info:\nArchitecture:        ppc64le\nByte Order:          Little Endian\nCPU(s):              8\nOn-line CPU(s) list: 0-7\nThread(s) per core:  1\nCore(s) per socket:  8\nSocket(s):           1\nNUMA node(s):        1\nModel:               2.1 (pvr 004b 0201)\nModel name:          POWER8 (architected), altivec supported\nHypervisor vendor:   KVM\nVirtualization type: para\nL1d cache:           64K\nL1i cache:           32K\nNUMA node0 CPU(s):   0-7\n\n\nMemory:\n              total        used        free      shared  buff/cache   available\nMem:       24050560     1062144    16829376      158912     6159040    22675264\nSwap:      15744960       64000    15680960\n\n\nStorage:\nFilesystem             Size  Used Avail Use% Mounted on\n/dev/mapper/rhel-root  198G  6.3G  192G   4% /\n"
 
 
+class MockContext:
+    topurl = "http://download.example.com/brewroot"
+
+
+def hw_log_text(cpus):
+    return (
+        f"CPU(s):              {cpus}\n"
+        "Mem:       24050560      994276    17234720\n"
+        "/dev/mapper/rhel-root  198G  6.3G  192G   4% /\n"
+    ).encode()
+
+
+class MockResponse:
+    """
+    Minimal requests.Response for log downloads
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+
 @pytest.fixture
-def mock_session_response(monkeypatch):
+def mock_session_response(monkeypatch, session):
     """
     Mocked responses for brew session for testing
     """
@@ -174,13 +202,12 @@ def mock_session_response(monkeypatch):
         mockSession = MockSession()
         return mockSession.get_build_logs(build_id)
 
-    def mock_request_get(url):
+    def mock_request_get(url, **kwargs):
         """
         Covers request.get("url")
         """
-        # mockSession = MockSession()
-        # return mockSession.requests_get(url)
-        return MockSession()
+        mockSession = MockSession()
+        return MockResponse(mockSession.requests_get(url).encode())
 
     monkeypatch.setattr(session, "listChannels", mock_list_channels)
     monkeypatch.setattr(session, "getBuild", mock_get_build)
@@ -202,7 +229,7 @@ def test_get_hw_info(mock_session_response, test_host_with_build):
     Tests for functioning of collect_hw_info function
     """
     test_94_hw_dict = {
-        "arches": "ppc64le",
+        "arches": ["ppc", "ppc64le"],
         "CPU(s)": 8,
         "Ram": 24050560,
         "Disk": "198G",
@@ -216,6 +243,314 @@ def test_get_hw_info(mock_session_response, test_host_with_build):
     assert my_host.hw_dict == test_94_hw_dict
 
 
+def test_get_hw_info_with_store(
+    mock_session_response, test_host_with_build, monkeypatch, tmp_path
+):
+    """
+    The second lookup of a log is served from the log store
+    """
+    store = logstore.log_store(tmp_path)
+    my_host = test_host_with_build
+
+    my_host.get_hw_info(MockSession(), store=store)
+    assert store.keys() == [(1757570, "ppc64le", "hw_info.log")]
+
+    def fail_request_get(url, **kwargs):
+        raise AssertionError("log should come from the store")
+
+    monkeypatch.setattr(requests, "get", fail_request_get)
+    my_host.hw_dict["Ram"] = None
+    my_host.get_hw_info(MockSession(), store=store)
+    assert my_host.hw_dict["Ram"] == 24050560
+
+
+def test_find_builds_for_host_scratch():
+    """
+    Task requests are not decoded and the scratch build task is not
+    fetched twice
+    """
+    queries = []
+
+    class TaskSession:
+        def listTasks(self, opts, queryOpts):
+            queries.append((opts, queryOpts))
+            if "offset" in queryOpts:
+                return [{"id": 2, "parent": 20, "arch": "ppc64le"}]
+            return [{"id": 1, "parent": 10, "arch": "ppc64le"}]
+
+        def listBuilds(self, taskID):
+            return [{"build_id": 1757570}] if taskID == 20 else []
+
+    my_host = cv.host("ppc-094", 94, True, "ppc ppc64le", None)
+    my_host.find_builds_for_host(TaskSession())
+
+    assert [brew_task.task_id for brew_task in my_host.task_list] == [2]
+    assert my_host.task_list[0].arch == "ppc64le"
+    assert all("decode" not in opts for opts, queryOpts in queries)
+    assert queries[1][1] == {"limit": 9, "offset": 1, "order": "-completion_time"}
+
+
+def test_task_log_path():
+    """
+    The derived log path is the one getBuildLogs reports
+    """
+    build_info = MockSession().get_build("1757570")
+    build_logs = MockSession().getBuildLogs(1757570)
+
+    for log in build_logs:
+        assert cv.task_log_path(build_info, log["dir"], log["name"]) == log["path"]
+
+
+def test_get_hw_info_task_label(
+    mock_session_response, test_host_with_build, monkeypatch, session
+):
+    """
+    With the task's label known the log of that label is read without
+    listing the build's logs
+    """
+
+    def fail_get_build_logs(build_id):
+        raise AssertionError("getBuildLogs should not be called")
+
+    monkeypatch.setattr(session, "getBuildLogs", fail_get_build_logs)
+    my_host = test_host_with_build
+    my_host.task_list[0].label = "ppc64le"
+
+    assert my_host.find_hw_log(session)["dir"] == "ppc64le"
+    assert my_host.get_hw_info(session)
+    assert my_host.hw_dict["CPU(s)"] == 8
+    assert my_host.hw_dict["Ram"] == 24050560
+
+
+def test_get_hw_info_noarch_build(monkeypatch):
+    """
+    Logs are stored under the task label, not the task arch: a noarch task
+    run on an x86_64 host wrote noarch/hw_info.log, and a log missing under
+    the label is looked up in the build's logs
+    """
+    build_info = {
+        "build_id": 1,
+        "name": "python-six",
+        "version": "1.16.0",
+        "release": "1.el9",
+        "volume_name": "DEFAULT",
+    }
+    logs = {
+        cv.task_log_path(build_info, "noarch"): hw_log_text(4),
+        cv.task_log_path(build_info, "x86_64"): hw_log_text(8),
+    }
+    listed = []
+
+    class LogSession:
+        def getBuildLogs(self, build_id):
+            listed.append(build_id)
+            return [
+                {"dir": path.split("/")[-2], "name": "hw_info.log", "path": path}
+                for path in logs
+            ]
+
+    def mock_request_get(url, **kwargs):
+        path = url[len(MockContext.topurl) + 1 :]
+        if path not in logs:
+            response = MockResponse(b"")
+            response.status_code = 404
+            response.raise_for_status = lambda: raise_http_error(response)
+            return response
+        return MockResponse(logs[path])
+
+    def raise_http_error(response):
+        raise requests.HTTPError("404 Not Found", response=response)
+
+    monkeypatch.setattr(cv, "get_context", MockContext)
+    monkeypatch.setattr(requests, "get", mock_request_get)
+
+    my_host = cv.host("x86-001", 1, True, "x86_64 i386", None)
+    my_host.task_list.append(cv.task(11, 10, build_info, "x86_64", "noarch"))
+    assert my_host.get_hw_info(LogSession())
+    assert my_host.hw_dict["CPU(s)"] == 4
+    assert listed == []
+
+    # i686 tasks have the arch i386, there is no i686 log for this build
+    my_host = cv.host("x86-001", 1, True, "x86_64 i386", None)
+    my_host.task_list.append(cv.task(11, 10, build_info, "i386", "i686"))
+    assert my_host.get_hw_info(LogSession())
+    assert my_host.hw_dict["CPU(s)"] == 8
+    assert listed == [1]
+
+
+def test_import_time(record_property):
+    """
+    Benchmarks importing channel_validator with python -X importtime. The
+    cumulative import time is recorded in the test report (pytest
+    --junitxml) rather than asserted, wall time depends on the machine.
+    koji and requests must not be imported, they are imported on first use.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import channel_validator"],
+        cwd=os.path.dirname(TESTS_DIR),
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    # import time: self [us] | cumulative | imported package
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        fields = line[len("import time:") :].split("|")
+        cumulative[fields[2].strip()] = int(fields[1])
+
+    assert "channel_validator" in cumulative
+    record_property("channel_validator_import_us", cumulative["channel_validator"])
+    assert "koji" not in cumulative
+    assert "requests" not in cumulative
+
+
+def test_parse_description(host_94_list_host):
+    """
+    Tests that every description field is parsed into a typed value
+    """
+    desc_dict = cv.parse_description(host_94_list_host["description"])
+
+    assert desc_dict == {
+        "Updated": date(2021, 6, 24),
+        "Infrastructure Type": None,
+        "Operating System": "RedHat 8.2",
+        "Kernel": "4.18.0-193.28.1.el8_2.ppc64le",
+        "CPU(s)": 8,
+        "Ram": 24060928,
+    }
+    # close to the 24050560 KiB hw_info.log reports for the host
+    assert abs(desc_dict["Ram"] - 24050560) < 24050560 * 0.001
+
+
+def test_parse_description_variants():
+    """
+    Older hosts say "CPU Count", unparsable values become None
+    """
+    desc_dict = cv.parse_description(
+        "Updated: someday\nInfrastructure Type: PowerEdge R630\n"
+        "CPU Count: 4\nTotal Memory: 1.5 tb\nRack: 12"
+    )
+
+    assert desc_dict == {
+        "Updated": None,
+        "Infrastructure Type": "PowerEdge R630",
+        "CPU(s)": 4,
+        "Ram": 1536000000,
+        "Rack": "12",
+    }
+
+
+def test_host_from_description(host_94_list_host):
+    """
+    Tests that host hw_dict is filled from the description
+    """
+    my_host = cv.host(
+        host_94_list_host["name"],
+        host_94_list_host["id"],
+        host_94_list_host["enabled"],
+        host_94_list_host["arches"],
+        host_94_list_host["description"],
+    )
+
+    assert my_host.hw_dict["CPU(s)"] == 8
+    assert my_host.hw_dict["Ram"] == 24060928
+    assert my_host.hw_dict["Disk"] is None
+    assert my_host.hw_dict["Kernel"] == "4.18.0-193.28.1.el8_2.ppc64le"
+    assert my_host.description_age(date(2021, 7, 4)) == 10
+
+
+def test_hosts_needing_logs():
+    """
+    Only hosts with stale, missing or minority descriptions need log lookups
+    """
+    channel = cv.channel(name="rhel8", id=21)
+    channel.collect_hosts(MockSession())
+    channel.host_list.append(cv.host("no-desc", 1, True, "x86_64", None))
+
+    needing_logs = channel.hosts_needing_logs(max_age=30, today=date(2021, 7, 1))
+
+    # 326 and 328 were last updated in 2020, 1 has no description and the
+    # rest are not 4 CPU hosts like the majority of the channel
+    assert sorted(h.id for h in needing_logs) == [
+        1,
+        94,
+        143,
+        175,
+        176,
+        181,
+        228,
+        229,
+        326,
+        328,
+    ]
+
+
+def test_collect_hw_info(monkeypatch):
+    """
+    collect_hw_info only runs the build/log chain for hosts that need it
+    """
+    looked_up = []
+
+    def mock_find_builds_for_host(self, session):
+        looked_up.append(self.id)
+
+    def mock_get_hw_info(self, session, store=None):
+        self.hw_source = "log"
+        return True
+
+    monkeypatch.setattr(cv.host, "find_builds_for_host", mock_find_builds_for_host)
+    monkeypatch.setattr(cv.host, "get_hw_info", mock_get_hw_info)
+    channel = cv.channel(name="rhel8", id=21)
+    channel.collect_hosts(MockSession())
+
+    needing_logs = channel.collect_hw_info(MockSession(), max_age=100000)
+
+    assert looked_up == [h.id for h in needing_logs]
+    assert len(looked_up) == 7
+    assert sum(h.hw_source == "description" for h in channel.host_list) == 8
+
+
+def test_defer_hw_info(monkeypatch):
+    """
+    Hardware information is looked up for the whole channel on the first
+    hw_dict access, and only then
+    """
+    import hwhistory
+
+    batches = []
+    looked_up = []
+
+    def mock_recent_builds(session, hosts, depth=1):
+        batches.append([h.id for h in hosts])
+        return {h.id: [] for h in hosts}
+
+    def mock_get_hw_info(self, session, store=None):
+        looked_up.append(self.id)
+        self.hw_source = "log"
+        return True
+
+    monkeypatch.setattr(hwhistory, "recent_builds", mock_recent_builds)
+    monkeypatch.setattr(cv.host, "get_hw_info", mock_get_hw_info)
+    channel = cv.channel(name="rhel8", id=21)
+    channel.collect_hosts(MockSession())
+    channel.defer_hw_info(MockSession(), max_age=100000)
+
+    enabled = [(h.name, h.enabled, h.arches) for h in channel.host_list]
+    assert len(enabled) == 15
+    assert batches == []
+
+    assert channel.host_list[3].hw_dict["arches"] == channel.host_list[3].arches
+    assert len(batches) == 1
+    assert looked_up == batches[0]
+    assert len(looked_up) == 7
+
+    # Every host was resolved by the first lookup
+    [h.hw_dict for h in channel.host_list]
+    assert len(batches) == 1
+
+
 def test_config_checker(test_channel_with_hosts):
     """
     Tests that channel.config_check and compare_hosts is working
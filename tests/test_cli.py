@@ -0,0 +1,288 @@
+import json
+import os
+import sys
+import time
+import koji
+import pytest
+import channel_validator as cv
+import cli
+import collect
+from checkpoint import checkpoint
+from multicall import rate_limiter, throttled_session
+from snapshot import snapshot
+from tests.mock_koji import MockMultiCall
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(TESTS_DIR, "fixtures")
+
+
+class MockSession:
+    """
+    Channel 21 has hosts 94, 143 and 175, channel 32 shares host 94
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def multicall(self, strict=False, batch=None):
+        return MockMultiCall(self)
+
+    def listChannels(self):
+        return [
+            {"id": 21, "name": "rhel8"},
+            {"id": 32, "name": "rhel8-beefy"},
+            {"id": 27, "name": "s390x"},
+        ]
+
+    # Closed buildArch tasks of the fleet, for poller.poll
+    fleet_tasks = []
+
+    def listTasks(self, opts, queryOpts):
+        tasks = [
+            t for t in self.fleet_tasks if t["completion_ts"] > opts["completeAfter"]
+        ]
+        return tasks[queryOpts["offset"] :][: queryOpts["limit"]]
+
+    def listHosts(self, channelID):
+        self.calls.append(("listHosts", channelID))
+        with open(os.path.join(FIXTURES_DIR, "calls", "listHosts.json")) as fp:
+            brew_hosts = {brew_host["id"]: brew_host for brew_host in json.load(fp)}
+        if channelID == 21:
+            return [brew_hosts[94], brew_hosts[143], brew_hosts[175]]
+        return [brew_hosts[94]]
+
+
+class MockContext:
+    def __init__(self):
+        self.sessions = []
+
+    def new_session(self, **opts):
+        self.sessions.append(MockSession())
+        return self.sessions[-1]
+
+
+def make_channels(ckpt=None):
+    channels = cv.collect_channels(MockSession())
+    collect.collect_hosts(MockSession(), channels, ckpt=ckpt)
+    return channels
+
+
+def test_hosts_to_probe():
+    channels = make_channels()
+    assert [len(c.host_list) for c in channels] == [3, 1, 1]
+
+    assert cli.hosts_to_probe(channels, "description") == {}
+    probe = cli.hosts_to_probe(channels, "logs")
+    assert sorted(probe) == [94, 143, 175]
+    # host 94 is in every channel but only probed once
+    assert len(probe[94]) == 3
+
+    previous = snapshot(
+        {94: {"host_id": 94, "cpus": 8, "ram": 24050560, "disk": "198G"}}
+    )
+    probe = cli.hosts_to_probe(channels, "logs", previous=previous)
+    assert sorted(probe) == [143, 175]
+    host_94 = channels[1].host_list[0]
+    assert host_94.hw_source == "snapshot"
+    assert host_94.hw_dict["Disk"] == "198G"
+
+    # hosts with new tasks are looked up again
+    probe = cli.hosts_to_probe(make_channels(), "logs", previous=previous, stale={94})
+    assert sorted(probe) == [94, 143, 175]
+
+
+def test_probe_hosts_partial(monkeypatch, tmp_path):
+    calls = []
+    broken = {("find_builds_for_host", 175), ("read_hw_log", 143)}
+
+    def record(name, hosts):
+        calls.append((name, hosts.id))
+        if (name, hosts.id) in broken:
+            raise koji.GenericError("hub fault")
+
+    def find_builds_for_host(self, session):
+        record("find_builds_for_host", self)
+        self.task_list.append(cv.task(self.id * 10, 1, {"build_id": self.id}))
+
+    def find_hw_log(self, session):
+        record("find_hw_log", self)
+        return {"dir": "x86_64", "name": "hw_info.log", "path": "hw_info.log"}
+
+    def read_hw_log(self, hw_log, store=None, retry=None):
+        record("read_hw_log", self)
+        self.hw_dict["CPU(s)"] = 8
+        self.hw_source = "log"
+
+    monkeypatch.setattr(cv.host, "find_builds_for_host", find_builds_for_host)
+    monkeypatch.setattr(cv.host, "find_hw_log", find_hw_log)
+    monkeypatch.setattr(cv.host, "read_hw_log", read_hw_log)
+    ckpt = checkpoint(tmp_path / "run.ckpt")
+
+    channels = make_channels(ckpt)
+    failed = collect.probe_hosts(
+        MockSession, cli.hosts_to_probe(channels, "logs"), ckpt=ckpt
+    )
+    assert sorted(failed) == [143, 175]
+    assert ("find_hw_log", 175) not in calls
+    # host 94 of the other channels got the same hardware information
+    assert channels[2].host_list[0].hw_dict["CPU(s)"] == 8
+    assert [ckpt.stage(host_id) for host_id in (94, 143, 175)] == [
+        "hw_parsed",
+        "logs_listed",
+        "hosts_listed",
+    ]
+
+    # a rerun with the checkpoint resumes each host after its last stage
+    calls.clear()
+    broken.clear()
+    channels = make_channels(ckpt)
+    failed = collect.probe_hosts(
+        MockSession, cli.hosts_to_probe(channels, "logs"), ckpt=ckpt
+    )
+    assert failed == {}
+    assert sorted(calls) == [
+        ("find_builds_for_host", 175),
+        ("find_hw_log", 175),
+        ("read_hw_log", 143),
+        ("read_hw_log", 175),
+    ]
+    assert channels[0].host_list[1].task_list[0].task_id == 1430
+
+
+def test_stream_results():
+    channels = make_channels()
+    probe = cli.hosts_to_probe(channels, "logs")
+    del probe[143]
+    error = koji.GenericError("hub fault")
+    results = iter([(probe[175], None), (probe[94], error)])
+    failed = {}
+
+    events = [
+        (kind, brew_channel.id, hosts and hosts.id)
+        for kind, brew_channel, hosts in cli.stream_results(
+            channels, probe, results, failed
+        )
+    ]
+
+    assert events == [
+        ("host", 21, 143),
+        ("host", 21, 175),
+        ("host", 21, 94),
+        ("channel", 21, None),
+        ("host", 32, 94),
+        ("channel", 32, None),
+        ("host", 27, 94),
+        ("channel", 27, None),
+    ]
+    assert failed == {94: error}
+
+
+def test_main_jsonl(monkeypatch, capsys):
+    context = MockContext()
+    monkeypatch.setattr(cli, "get_context", lambda: context)
+
+    cli.main(["-c", "rhel8", "--hw-source", "description", "-f", "jsonl"])
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(r["type"], r.get("host_id")) for r in records] == [
+        ("host", 94),
+        ("host", 143),
+        ("host", 175),
+        ("channel", None),
+    ]
+    assert sum(len(grouping) for grouping in records[-1]["config_groups"]) == 3
+
+
+def test_main_without_pyarrow(monkeypatch):
+    context = MockContext()
+    monkeypatch.setattr(cli, "get_context", lambda: context)
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+
+    with pytest.raises(SystemExit, match="pyarrow is required"):
+        cli.main(["-c", "rhel8", "-f", "parquet"])
+    assert context.sessions == []
+
+
+def test_main(monkeypatch, tmp_path, capsys):
+    context = MockContext()
+    monkeypatch.setattr(cli, "get_context", lambda: context)
+    snapshot_path = tmp_path / "run.jsonl"
+
+    cli.main(
+        [
+            "-r",
+            "^rhel8",
+            "--hw-source",
+            "description",
+            "--rate",
+            "1000",
+            "--snapshot",
+            str(snapshot_path),
+            "-f",
+            "json",
+            "--metrics",
+        ]
+    )
+
+    captured = capsys.readouterr()
+    out = json.loads(captured.out)
+    assert [c["id"] for c in out] == [21, 32]
+    assert sorted(h["host_id"] for h in out[0]["hosts"]) == [94, 143, 175]
+    assert sum(len(grouping) for grouping in out[0]["config_groups"]) == 3
+    # channels and hosts were listed with one multicall
+    assert context.sessions[0].calls == [("listHosts", 21), ("listHosts", 32)]
+    assert sorted(snapshot.load(snapshot_path).hosts) == [94, 143, 175]
+    assert "listHosts: 2 calls" in captured.err
+
+
+def test_main_incremental(monkeypatch, tmp_path, capsys):
+    """
+    --incremental looks up the hosts that finished a task since the last
+    run again and reuses the snapshot for the others
+    """
+    probed = []
+
+    def find_builds_for_host(self, session):
+        probed.append(self.id)
+        self.task_list.append(cv.task(self.id * 10, 1, {"build_id": self.id}))
+
+    def find_hw_log(self, session):
+        return {"dir": "x86_64", "name": "hw_info.log", "path": "hw_info.log"}
+
+    def read_hw_log(self, hw_log, store=None, retry=None):
+        self.hw_dict["CPU(s)"] = 8
+        # The hosts with new tasks got more memory
+        self.hw_dict["Ram"] = 32000000 if MockSession.fleet_tasks else 24050560
+        self.hw_source = "log"
+
+    monkeypatch.setattr(cv.host, "find_builds_for_host", find_builds_for_host)
+    monkeypatch.setattr(cv.host, "find_hw_log", find_hw_log)
+    monkeypatch.setattr(cv.host, "read_hw_log", read_hw_log)
+    monkeypatch.setattr(MockSession, "fleet_tasks", [])
+    context = MockContext()
+    monkeypatch.setattr(cli, "get_context", lambda: context)
+    snapshot_path = str(tmp_path / "run.jsonl")
+    argv = ["-c", "rhel8", "--hw-source", "logs", "--snapshot", snapshot_path]
+    argv += ["--incremental", "-f", "json"]
+
+    assert cli.main(argv) == 0
+    assert sorted(probed) == [94, 143, 175]
+    assert os.path.exists(snapshot_path + ".poll")
+
+    probed.clear()
+    assert cli.main(argv) == 0
+    assert probed == []
+
+    MockSession.fleet_tasks.append(
+        {"id": 1, "host_id": 143, "completion_ts": time.time()}
+    )
+    capsys.readouterr()
+    assert cli.main(argv) == 0
+    assert probed == [143]
+    assert "host 143 ram: 24050560 -> 32000000" in capsys.readouterr().err
+
+
+def test_throttled_session():
+    session = throttled_session(MockSession(), rate_limiter(1000))
+    assert len(session.listHosts(21)) == 3
+    assert session.calls == [("listHosts", 21)]
@@ -0,0 +1,116 @@
+import threading
+import pytest
+import collect
+from checkpoint import checkpoint
+from multicall import payload_meter, rate_limiter
+from resilience import retry_policy
+
+
+class MockSession:
+    """
+    The first listChannels call fails if flaky
+    """
+
+    def __init__(self, flaky=False, **opts):
+        self.flaky = flaky
+        self.opts = opts
+
+    def listChannels(self):
+        if self.flaky:
+            self.flaky = False
+            raise ConnectionError("connection reset")
+        return [
+            {"id": 21, "name": "rhel8"},
+            {"id": 32, "name": "rhel8-beefy"},
+            {"id": 27, "name": "s390x"},
+        ]
+
+
+class MockContext:
+    def new_session(self, **opts):
+        return MockSession(flaky=True, **opts)
+
+
+def test_select_channels():
+    channels = collect.list_channels(MockSession())
+
+    assert [c.id for c in collect.select_channels(channels)] == [21, 32, 27]
+    assert [c.id for c in collect.select_channels(channels, names=["rhel8"])] == [21]
+    assert [c.id for c in collect.select_channels(channels, patterns=["^rhel8"])] == [
+        21,
+        32,
+    ]
+    assert [
+        c.id for c in collect.select_channels(channels, names=["rhel8"], ids=[27])
+    ] == [21, 27]
+    with pytest.raises(SystemExit):
+        collect.select_channels(channels, names=["rhel9"])
+
+
+def test_session_factory():
+    meter = payload_meter()
+    policy = retry_policy(sleep=lambda seconds: None)
+    new_session = collect.session_factory(
+        MockContext(), 30, policy, rate_limiter(1000), meter
+    )
+
+    session = new_session()
+    # koji does not retry, calls are retried with policy instead
+    assert session.opts == {"timeout": 30, "max_retries": 0}
+    assert [c.name for c in collect.list_channels(session)][0] == "rhel8"
+    assert policy.retries == 1
+    assert "listChannels: 1 calls" in "\n".join(meter.report())
+    assert new_session() is not session
+
+
+def test_resume_from_checkpoint(tmp_path):
+    """
+    A resumed run takes channel and host lists from the checkpoint
+    """
+    ckpt = checkpoint(tmp_path / "run.ckpt")
+    channels = collect.list_channels(MockSession(), ckpt)
+    ckpt.save_hosts(
+        21,
+        [
+            {
+                "id": 94,
+                "name": "x86-019",
+                "enabled": True,
+                "arches": "x86_64",
+                "description": None,
+            }
+        ],
+    )
+    ckpt.close()
+
+    ckpt = checkpoint(tmp_path / "run.ckpt")
+    channels = collect.list_channels(None, ckpt)
+    assert [c.id for c in channels] == [21, 32, 27]
+    collect.collect_hosts(None, channels[:1], ckpt=ckpt)
+    assert [h.id for h in channels[0].host_list] == [94]
+
+
+class LookupHost:
+    """
+    Host whose hw_info.log lookup finds no build
+    """
+
+    def __init__(self, host_id, started):
+        self.id = host_id
+        self.started = started
+
+    def find_builds_for_host(self, session):
+        self.started.set()
+
+    def find_hw_log(self, session):
+        return None
+
+
+def test_lookups_start_before_iterating():
+    started = threading.Event()
+    probe = {94: [LookupHost(94, started)]}
+
+    results = collect.iter_probe_hosts(lambda: None, probe, workers=1)
+    # Nothing has been read from results yet
+    assert started.wait(5)
+    assert [(host_list[0].id, error) for host_list, error in results] == [(94, None)]
@@ -0,0 +1,83 @@
+import io
+import csv
+import json
+import os
+import koji
+import enum_channels
+from tests.mock_koji import MockMultiCall
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(TESTS_DIR, "fixtures")
+
+
+class MockSession:
+    """
+    Channel 21 and 32 share host 94. Host 94 last ran a task for a real
+    build, host 143 a scratch build and listTasks faults for host 175.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def multicall(self, strict=False, batch=None):
+        return MockMultiCall(self)
+
+    def listHosts(self, channelID):
+        self.calls.append(("listHosts", channelID))
+        with open(os.path.join(FIXTURES_DIR, "calls", "listHosts.json")) as fp:
+            brew_hosts = {brew_host["id"]: brew_host for brew_host in json.load(fp)}
+        if channelID == 21:
+            return [brew_hosts[94], brew_hosts[143], brew_hosts[175]]
+        return [brew_hosts[94]]
+
+    def listTasks(self, opts, queryOpts):
+        self.calls.append(("listTasks", opts["host_id"]))
+        tasks = {
+            94: [{"id": 40263182, "parent": 40263155}],
+            143: [{"id": 40263190, "parent": 40263188}],
+        }
+        if opts["host_id"] == 175:
+            raise koji.GenericError("hub fault")
+        return tasks.get(opts["host_id"], [])
+
+    def listBuilds(self, taskID):
+        self.calls.append(("listBuilds", taskID))
+        if taskID == 40263155:
+            return [{"nvr": "e2e-module-test-1.0.4127-1.module+e2e+12941+acfc830c"}]
+        return []
+
+
+def test_collect_hosts_dedups():
+    session = MockSession()
+    channels = [{"id": 21, "name": "rhel8"}, {"id": 32, "name": "rhel8-beefy"}]
+
+    hosts = enum_channels.collect_hosts(session, channels)
+
+    assert sorted(hosts) == [94, 143, 175]
+    assert hosts[94]["channels"] == ["rhel8", "rhel8-beefy"]
+
+
+def test_report():
+    session = MockSession()
+    channels = [{"id": 21, "name": "rhel8"}, {"id": 32, "name": "rhel8-beefy"}]
+    hosts = enum_channels.collect_hosts(session, channels)
+
+    probed = enum_channels.probe_hosts(lambda: session, sorted(hosts), workers=2)
+    rows = enum_channels.build_report(hosts, probed)
+
+    # every host is probed exactly once even though 94 is in two channels
+    assert sorted(c[1] for c in session.calls if c[0] == "listTasks") == [
+        94,
+        143,
+        175,
+    ]
+    by_id = {row["host_id"]: row for row in rows}
+    assert by_id[94]["scratch"] is False
+    assert by_id[94]["channels"] == "rhel8 rhel8-beefy"
+    assert by_id[143]["scratch"] is True
+    assert by_id[175]["task_id"] is None
+
+    stream = io.StringIO()
+    enum_channels.write_report(rows, stream, "csv")
+    stream.seek(0)
+    assert [row["host_id"] for row in csv.DictReader(stream)] == ["94", "143", "175"]
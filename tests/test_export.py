@@ -0,0 +1,63 @@
+import csv
+import sys
+import pytest
+import channel_validator as cv
+import export
+
+
+@pytest.fixture
+def validated_channel():
+    """
+    Channel with two grouped hosts, one of them with a task
+    """
+    test_channel = cv.channel(name="rhel8", id=21)
+    for host_id, cpus in [(94, 8), (143, 8), (181, 16)]:
+        tmp_host = cv.host(f"host-{host_id}", host_id, True, "ppc ppc64le", None)
+        tmp_host.hw_dict["CPU(s)"] = cpus
+        tmp_host.hw_dict["Ram"] = 24050560
+        tmp_host.hw_dict["Disk"] = "198G"
+        test_channel.host_list.append(tmp_host)
+    test_channel.host_list[0].task_list.append(
+        cv.task(40263182, 40263155, {"build_id": 1757570, "nvr": "e2e-1-1"})
+    )
+    test_channel.config_check()
+    return test_channel
+
+
+def test_export_csv(validated_channel, tmp_path):
+    counts = export.export_channels([validated_channel], str(tmp_path), "csv")
+
+    assert counts == {"channels": 1, "hosts": 3, "tasks": 1, "config_groups": 3}
+    with open(tmp_path / "hosts.csv") as fp:
+        rows = list(csv.DictReader(fp))
+    assert [row["host_id"] for row in rows] == ["94", "143", "181"]
+    assert rows[0]["arches"] == "ppc ppc64le"
+    with open(tmp_path / "config_groups.csv") as fp:
+        groups = [(row["group_index"], row["host_id"]) for row in csv.DictReader(fp)]
+    assert groups == [("0", "94"), ("0", "143"), ("1", "181")]
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_export_arrow(validated_channel, tmp_path, monkeypatch, output_format):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    # force several record batches
+    monkeypatch.setattr(export, "BATCH_ROWS", 2)
+    export.export_channels([validated_channel], str(tmp_path), output_format)
+
+    path = str(tmp_path / ("hosts" + export.FILE_EXTENSIONS[output_format]))
+    if output_format == "parquet":
+        table = pq.read_table(path)
+    else:
+        table = pa.ipc.open_file(path).read_all()
+    assert table.column_names == [column for column, t in export.SCHEMAS["hosts"]]
+    assert table.column("host_id").to_pylist() == [94, 143, 181]
+    assert table.column("cpus").to_pylist() == [8, 8, 16]
+
+
+def test_export_without_pyarrow(validated_channel, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+
+    with pytest.raises(ImportError, match="pyarrow is required"):
+        export.export_channels([validated_channel], str(tmp_path), "parquet")
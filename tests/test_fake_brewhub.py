@@ -0,0 +1,89 @@
+import json
+import koji
+import pytest
+import channel_validator as cv
+import cli
+from multicall import call_batched
+from resilience import is_retryable
+from tests.fake_brewhub import fake_brewhub, fleet
+
+
+@pytest.fixture
+def hub():
+    with fake_brewhub(fleet(hosts=30, channels=4, seed=3)) as hub:
+        yield hub
+
+
+class HubContext:
+    def __init__(self, hub):
+        self.hub = hub
+        self.topurl = hub.topurl
+
+    def new_session(self, **opts):
+        return koji.ClientSession(self.hub.url, {"max_retries": 0})
+
+
+def test_calls(hub):
+    session = koji.ClientSession(hub.url, {"max_retries": 0})
+
+    channels = session.listChannels()
+    assert [c["id"] for c in channels] == [1, 2, 3, 4]
+    listings = call_batched(
+        session, "listHosts", [{"channelID": c["id"]} for c in channels]
+    )
+    assert {h["id"] for hosts in listings for h in hosts} == set(range(1, 31))
+
+    tasks = session.listTasks(
+        {"host_id": 7, "method": "buildArch"}, {"order": "-completion_time"}
+    )
+    assert len(tasks) == 5
+    assert tasks[0]["completion_ts"] > tasks[-1]["completion_ts"]
+    with pytest.raises(koji.GenericError):
+        session.getBuildLogs(1)
+    assert hub.calls["listHosts"] == 4
+
+
+def test_cli_against_fake_hub(hub, monkeypatch, capsys):
+    context = HubContext(hub)
+    monkeypatch.setattr(cli, "get_context", lambda: context)
+    monkeypatch.setattr(cv, "get_context", lambda: context)
+
+    assert cli.main(["--hw-source", "logs", "-j", "4", "-f", "json"]) == 0
+
+    out = json.loads(capsys.readouterr().out)
+    hosts = {h["host_id"]: h for c in out for h in c["hosts"]}
+    assert len(hosts) == 30
+    from_logs = [h for h in hosts.values() if h["hw_source"] == "log"]
+    assert len(from_logs) > 20
+    for row in from_logs:
+        assert (row["cpus"], row["ram"], row["disk"]) == hub.fleet.configs[
+            row["host_id"]
+        ]
+    assert hub.calls["GET"] == len(from_logs)
+
+    # Hosts whose latest build is noarch read the log under noarch/
+    latest = {}
+    for brew_task in hub.fleet.tasks:
+        if brew_task["parent"] in hub.fleet.builds:
+            previous = latest.get(brew_task["host_id"])
+            if previous is None or (
+                previous["completion_ts"] < brew_task["completion_ts"]
+            ):
+                latest[brew_task["host_id"]] = brew_task
+    noarch = [
+        row
+        for row in from_logs
+        if latest[row["host_id"]]["label"] == "noarch"
+        and latest[row["host_id"]]["arch"] != "noarch"
+    ]
+    assert len(noarch) > 0
+
+
+def test_injected_errors():
+    with fake_brewhub(fleet(hosts=5), error_rate=1.0) as hub:
+        session = koji.ClientSession(hub.url, {"max_retries": 0})
+        with pytest.raises(Exception) as error:
+            session.listChannels()
+
+    assert is_retryable(error.value)
+    assert hub.calls == {"errors": 1}
@@ -0,0 +1,45 @@
+import channel_validator as cv
+from fleet_index import fleet_index
+
+
+def make_host(host_id, cpus, ram, disk="198G", arches="x86_64"):
+    tmp_host = cv.host(f"host-{host_id}", host_id, True, arches, None)
+    tmp_host.hw_dict["CPU(s)"] = cpus
+    tmp_host.hw_dict["Ram"] = ram
+    tmp_host.hw_dict["Disk"] = disk
+    tmp_host.hw_dict["Operating System"] = "RedHat 8.2"
+    return tmp_host
+
+
+def make_channel(channel_id, host_list):
+    tmp_channel = cv.channel(name=f"channel-{channel_id}", id=channel_id)
+    tmp_channel.host_list = host_list
+    return tmp_channel
+
+
+def test_fleet_index():
+    small = [make_host(1, 8, 24050560), make_host(2, 8, 24060928)]
+    big = [make_host(3, 24, 32624292, "581G"), make_host(4, 24, 32627392, "581G")]
+    s390x = make_host(5, 4, 16284748, "118G", arches="s390x")
+
+    index = fleet_index(
+        [
+            make_channel(21, small + big),
+            make_channel(32, big),
+            make_channel(27, [s390x]),
+            make_channel(33, [small[0]]),
+        ]
+    )
+
+    small_sig = index.signature(small[0])
+    big_sig = index.signature(big[0])
+    assert index.signature(small[1]) == small_sig
+    assert index.channels_with_signature(small_sig) == {21, 33}
+    assert index.hosts_with_signature(big_sig) == {3, 4}
+    assert index.host_channels[1] == {21, 33}
+
+    assert index.movable_hosts(33) == {2}
+    assert index.movable_hosts(32) == set()
+    assert index.movable_hosts(27) == set()
+
+    assert index.subset_channels() == [(32, 21), (33, 21)]
@@ -0,0 +1,86 @@
+import channel_validator as cv
+import hwhistory
+import logstore
+from tests.mock_koji import MockMultiCall
+
+TOPURL = "http://download.example.com/brewroot"
+
+
+def hw_log(cpus, ram, disk):
+    return (
+        f"CPU(s):              {cpus}\n"
+        f"Mem:       {ram}      994276    17234720\n"
+        f"/dev/mapper/rhel-root  {disk}  6.3G  192G   4% /\n"
+    ).encode()
+
+
+class MockSession:
+    """
+    Host 94 ran tasks for builds 3 (newest), 2 and 1; task 20 was a scratch
+    build.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def multicall(self, strict=False, batch=None):
+        return MockMultiCall(self)
+
+    def listTasks(self, opts, queryOpts):
+        return [
+            {"id": 31, "parent": 30, "arch": "ppc64le", "completion_ts": 300.0},
+            {"id": 21, "parent": 20, "arch": "ppc64le", "completion_ts": 250.0},
+            {"id": 11, "parent": 10, "arch": "ppc64le", "completion_ts": 200.0},
+            {"id": 1, "parent": 0, "arch": "noarch", "completion_ts": 100.0},
+        ]
+
+    def listBuilds(self, taskID):
+        if taskID == 20:
+            return []
+        return [{"build_id": taskID // 10}]
+
+    def getBuildLogs(self, build_id):
+        self.calls.append(("getBuildLogs", build_id))
+        return [
+            {"dir": "ppc", "name": "hw_info.log", "path": f"{build_id}/ppc"},
+            {"dir": "ppc64le", "name": "hw_info.log", "path": f"{build_id}/ppc64le"},
+        ]
+
+
+def host_94():
+    return cv.host("ppc-016", 94, True, "ppc ppc64le", None)
+
+
+def test_recent_builds_skips_scratch():
+    builds = hwhistory.recent_builds(MockSession(), [host_94()], depth=2)
+
+    assert [build["build_id"] for task, build in builds[94]] == [3, 1]
+
+
+def test_collect_history(tmp_path):
+    store = logstore.log_store(tmp_path)
+    history = hwhistory.hw_history(str(tmp_path / "hw_history.sqlite"))
+    # All logs are already in the store, so nothing is downloaded
+    store.put(1, "ppc64le", "hw_info.log", hw_log(8, 24050560, "198G"))
+    store.put(3, "ppc64le", "hw_info.log", hw_log(8, 12025280, "198G"))
+    store.put(0, "ppc", "hw_info.log", hw_log(8, 24050560, "100G"))
+
+    session = MockSession()
+    added = hwhistory.collect_history(
+        session, [host_94()], history, store, TOPURL, depth=3
+    )
+
+    assert added == 3
+    assert [s["build_id"] for s in history.timeline(94)] == [0, 1, 3]
+    assert [(c["field"], c["old"], c["new"]) for c in history.changes(94)] == [
+        ("Disk", "100G", "198G"),
+        ("Ram", 24050560, 12025280),
+    ]
+
+    # A second run only looks at builds without a sample
+    session.calls = []
+    added = hwhistory.collect_history(
+        session, [host_94()], history, store, TOPURL, depth=3
+    )
+    assert added == 0
+    assert session.calls == []
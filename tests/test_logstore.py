@@ -0,0 +1,124 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+import logstore
+import channel_validator as cv
+
+HW_LOG_A = (
+    b"CPU info:\n"
+    b"Architecture:        x86_64\n"
+    b"CPU(s):              24\n"
+    b"CPU MHz:             3646.839\n"
+    b"BogoMIPS:            6799.47\n"
+    b"\n"
+    b"Memory:\n"
+    b"              total        used        free      shared  buff/cache   available\n"
+    b"Mem:       32624292      994276    17234720      886796    14395296    30267136\n"
+    b"Swap:      16482300      835572    15646728\n"
+    b"\n"
+    b"Storage:\n"
+    b"Filesystem                      Size  Used Avail Use% Mounted on\n"
+    b"/dev/mapper/rhel_x86--039-root  581G   15G  567G   3% /\n"
+)
+# Same hardware, only the volatile lines differ
+HW_LOG_B = (
+    HW_LOG_A.replace(b"3646.839", b"2261.106")
+    .replace(b"994276    17234720", b"974832    10973492")
+    .replace(b"15G  567G", b"13G  569G")
+)
+
+
+def test_put_get_round_trip(tmp_path):
+    store = logstore.log_store(tmp_path)
+
+    store.put(1757570, "x86_64", "hw_info.log", HW_LOG_A)
+
+    assert store.get(1757570, "x86_64", "hw_info.log") == HW_LOG_A
+    assert store.get(1757570, "s390x", "hw_info.log") is None
+    assert (1757570, "x86_64", "hw_info.log") in store
+
+
+def test_dedup_identical_hardware(tmp_path):
+    store = logstore.log_store(tmp_path)
+
+    store.put(1757570, "x86_64", "hw_info.log", HW_LOG_A)
+    store.put(1753791, "x86_64", "hw_info.log", HW_LOG_B)
+    store.put(1753792, "x86_64", "hw_info.log", HW_LOG_B)
+
+    assert store.stats() == {
+        "logs": 3,
+        "bodies": 2,
+        "bases": 1,
+        "size": len(HW_LOG_A) + 2 * len(HW_LOG_B),
+    }
+    assert store.get(1753791, "x86_64", "hw_info.log") == HW_LOG_B
+
+
+def test_reparse_from_store(tmp_path):
+    store = logstore.log_store(tmp_path)
+    store.put(1757570, "x86_64", "hw_info.log", HW_LOG_A)
+    store.put(1757570, "x86_64", "build.log", b"building\n")
+
+    # a reopened store needs nothing but the local files
+    store.close()
+    store = logstore.log_store(tmp_path)
+
+    assert cv.reparse_hw_logs(store) == {
+        (1757570, "x86_64"): {"CPU(s)": 24, "Ram": 32624292, "Disk": "581G"}
+    }
+
+
+class ETagHandler(BaseHTTPRequestHandler):
+    """
+    Serves HW_LOG_A with an ETag, answering 304 when it is sent back
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.server.etag)
+        self.send_header("Last-Modified", "Tue, 06 Oct 2026 12:00:00 GMT")
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+
+@pytest.fixture
+def etag_server():
+    server = HTTPServer(("127.0.0.1", 0), ETagHandler)
+    server.requests = []
+    server.etag = '"a1"'
+    server.body = HW_LOG_A
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_revalidate(etag_server, tmp_path):
+    url = f"http://127.0.0.1:{etag_server.server_address[1]}/hw_info.log"
+    key = (1757570, "x86_64", "hw_info.log")
+
+    store = logstore.log_store(tmp_path)
+    assert store.fetch_status(*key, url) == (HW_LOG_A, "downloaded")
+    assert store.fetch_status(*key, url) == (HW_LOG_A, "cached")
+    assert etag_server.requests == [None]
+
+    store = logstore.log_store(tmp_path, revalidate=True)
+    assert store.fetch_status(*key, url) == (HW_LOG_A, "not_modified")
+    assert etag_server.requests == [None, '"a1"']
+
+    # The log changed on the server
+    etag_server.etag = '"b2"'
+    etag_server.body = HW_LOG_B
+    assert store.fetch_status(*key, url) == (HW_LOG_B, "downloaded")
+    assert store.fetch_status(*key, url) == (HW_LOG_B, "not_modified")
+    assert store.counters == {"not_modified": 2, "downloaded": 1}
@@ -0,0 +1,213 @@
+import json
+import os
+import channel_validator as cv
+import logstore
+import mirror
+from tests.mock_koji import MockMultiCall
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(TESTS_DIR, "fixtures")
+
+
+def hw_log(cpus):
+    return (
+        f"CPU(s):              {cpus}\n"
+        "Mem:       24050560      994276    17234720\n"
+        "/dev/mapper/rhel-root  198G  6.3G  192G   4% /\n"
+    ).encode()
+
+
+class MockSession:
+    """
+    Channel 21 has hosts 94 and 143, channel 32 shares host 94. Every host
+    ran task <host id>1 for build <host id>0 at time 100, fleet_tasks are
+    the tasks that closed since.
+    """
+
+    def __init__(self, fleet_tasks=()):
+        self.calls = []
+        self.fleet_tasks = list(fleet_tasks)
+
+    def multicall(self, strict=False, batch=None):
+        return MockMultiCall(self)
+
+    def listChannels(self):
+        return [{"id": 21, "name": "rhel8"}, {"id": 32, "name": "rhel8-beefy"}]
+
+    def listHosts(self, channelID):
+        with open(os.path.join(FIXTURES_DIR, "calls", "listHosts.json")) as fp:
+            brew_hosts = {brew_host["id"]: brew_host for brew_host in json.load(fp)}
+        if channelID == 21:
+            return [brew_hosts[94], brew_hosts[143]]
+        return [brew_hosts[94]]
+
+    def listTasks(self, opts, queryOpts):
+        if "completeAfter" in opts:
+            self.calls.append(("listTasks", None))
+            return self.fleet_tasks[queryOpts["offset"] :][: queryOpts["limit"]]
+        host_id = opts["host_id"]
+        self.calls.append(("listTasks", host_id))
+        return [
+            {
+                "id": host_id * 10 + 1,
+                "parent": host_id * 10,
+                "host_id": host_id,
+                "arch": "ppc64le",
+                "label": "ppc64le",
+                "completion_ts": 100.0,
+            }
+        ]
+
+    def listBuilds(self, taskID):
+        # Task 9999 is a scratch build
+        if taskID == 9999:
+            return []
+        return [
+            {
+                "build_id": taskID,
+                "name": "ceph",
+                "version": "14.2.21",
+                "release": str(taskID),
+                "volume_name": "DEFAULT",
+            }
+        ]
+
+
+class MockContext:
+    topurl = "http://download.example.com/brewroot"
+
+
+def test_sync(monkeypatch, tmp_path):
+    monkeypatch.setattr(cv, "get_context", MockContext)
+    store = logstore.log_store(tmp_path / "logs")
+    store.put(940, "ppc64le", "hw_info.log", hw_log(8))
+    store.put(1430, "ppc64le", "hw_info.log", hw_log(4))
+    store.put(950, "ppc64le", "hw_info.log", hw_log(16))
+    db = mirror.mirror(str(tmp_path / "mirror.sqlite"))
+
+    session = MockSession()
+    counts = db.sync(session, store)
+
+    assert counts == {
+        "channels": 2,
+        "tasks": 2,
+        "hardware": 2,
+        "failed": 0,
+        "hosts": 2,
+    }
+    channels = db.load_channels()
+    assert [(c.id, [h.id for h in c.host_list]) for c in channels] == [
+        (21, [94, 143]),
+        (32, [94]),
+    ]
+    assert channels[0].host_list[0].hw_dict["CPU(s)"] == 8
+    assert channels[0].host_list[1].hw_source == "log"
+    assert channels[0].host_list[1].task_list[0].task_id == 1431
+    # The watermark is the newest hub completion_ts seen, not the local time
+    assert db.get_state("completion_ts") == 100.0
+
+    # Only tasks closed since the last sync are looked at, scratch builds
+    # don't replace the latest build
+    session = MockSession(
+        [
+            {"id": 951, "parent": 950, "host_id": 94, "completion_ts": 200.0},
+            {"id": 9991, "parent": 9999, "host_id": 143, "completion_ts": 210.0},
+        ]
+    )
+    for brew_task in session.fleet_tasks:
+        brew_task["arch"] = brew_task["label"] = "ppc64le"
+    counts = db.sync(session, store)
+
+    assert session.calls == [("listTasks", None)]
+    assert (counts["tasks"], counts["hardware"]) == (1, 1)
+    assert db.get_state("completion_ts") == 210.0
+    host_94 = db.load_hosts({94})[94]
+    assert host_94.hw_dict["CPU(s)"] == 16
+    assert host_94.task_list[0].build_info["build_id"] == 950
+
+    # Nothing changed
+    counts = db.sync(MockSession(), store)
+    assert (counts["tasks"], counts["hardware"]) == (0, 0)
+
+
+def test_sync_log_missing_under_label(monkeypatch, tmp_path):
+    """
+    A log that is not under the task label is looked up in the build's logs
+    """
+    import requests
+
+    class NotFound:
+        status_code = 404
+
+        def raise_for_status(self):
+            raise requests.HTTPError("404 Not Found", response=self)
+
+    class LabelSession(MockSession):
+        def listTasks(self, opts, queryOpts):
+            tasks = super().listTasks(opts, queryOpts)
+            for brew_task in tasks:
+                brew_task["label"] = "noarch"
+            return tasks
+
+        def getBuildLogs(self, build_id):
+            self.calls.append(("getBuildLogs", build_id))
+            return [{"dir": "ppc64le", "name": "hw_info.log", "path": "ppc64le/log"}]
+
+    monkeypatch.setattr(cv, "get_context", MockContext)
+    monkeypatch.setattr(requests, "get", lambda url, **kwargs: NotFound())
+    store = logstore.log_store(tmp_path / "logs")
+    store.put(940, "ppc64le", "hw_info.log", hw_log(8))
+    store.put(1430, "ppc64le", "hw_info.log", hw_log(4))
+    db = mirror.mirror(str(tmp_path / "mirror.sqlite"))
+
+    session = LabelSession()
+    counts = db.sync(session, store)
+
+    assert (counts["hardware"], counts["failed"]) == (2, 0)
+    assert db.load_hosts({94})[94].task_list[0].label == "noarch"
+    assert db.load_hosts({143})[143].hw_dict["CPU(s)"] == 4
+
+
+def test_cli_mirror(monkeypatch, tmp_path, capsys):
+    """
+    brew-channel-validate --mirror reports the hosts the mirror has no
+    hardware for and rejects options for looking hardware up
+    """
+    import cli
+    import pytest
+    import requests
+
+    class NotFound:
+        status_code = 404
+
+        def raise_for_status(self):
+            raise requests.HTTPError("404 Not Found", response=self)
+
+    class NoLogsSession(MockSession):
+        def getBuildLogs(self, build_id):
+            return []
+
+    monkeypatch.setattr(cv, "get_context", MockContext)
+    monkeypatch.setattr(requests, "get", lambda url, **kwargs: NotFound())
+    store = logstore.log_store(tmp_path / "logs")
+    store.put(940, "ppc64le", "hw_info.log", hw_log(8))
+    path = str(tmp_path / "mirror.sqlite")
+    db = mirror.mirror(path)
+    counts = db.sync(NoLogsSession(), store)
+    db.close()
+    assert (counts["hardware"], counts["failed"]) == (1, 1)
+
+    class HubContext:
+        def new_session(self, **opts):
+            raise AssertionError("the hub should not be contacted")
+
+    monkeypatch.setattr(cli, "get_context", HubContext)
+    capsys.readouterr()
+    assert cli.main(["--mirror", path, "-f", "json"]) == 0
+    captured = capsys.readouterr()
+    assert "1 hosts have no hardware in the mirror" in captured.err
+    hosts = {h["host_id"]: h for c in json.loads(captured.out) for h in c["hosts"]}
+    assert hosts[94]["hw_source"] == "log"
+
+    with pytest.raises(SystemExit):
+        cli.parse_args(["--mirror", path, "--hw-source", "logs"])
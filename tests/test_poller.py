@@ -0,0 +1,63 @@
+import poller
+
+
+class TaskSession:
+    """
+    Serves closed buildArch tasks filtered on completeAfter and paged
+    """
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.queries = []
+
+    def listTasks(self, opts, queryOpts):
+        self.queries.append((opts, queryOpts))
+        assert opts["method"] == "buildArch"
+        assert queryOpts["order"] == "completion_time"
+        found = sorted(
+            (t for t in self.tasks if t["completion_ts"] > opts["completeAfter"]),
+            key=lambda t: t["completion_ts"],
+        )
+        offset = queryOpts["offset"]
+        return found[offset : offset + queryOpts["limit"]]
+
+
+def make_task(task_id, host_id, completion_ts):
+    return {"id": task_id, "host_id": host_id, "completion_ts": completion_ts}
+
+
+def test_poll(tmp_path):
+    session = TaskSession(
+        [
+            make_task(1, 94, 1000.0),
+            make_task(2, 143, 1001.0),
+            make_task(3, 94, 1002.0),
+            make_task(4, 175, 1003.0),
+            make_task(5, 143, 1003.0),
+        ]
+    )
+    state = tmp_path / "poll.json"
+    mark = poller.watermark(state)
+
+    latest = poller.poll(session, mark, page_size=2, now=1500.0)
+    assert {host_id: t["id"] for host_id, t in latest.items()} == {
+        94: 3,
+        143: 5,
+        175: 4,
+    }
+    # first poll looks back INITIAL_LOOKBACK, three pages of two
+    assert session.queries[0][0]["completeAfter"] == 1500.0 - poller.INITIAL_LOOKBACK
+    assert [q["offset"] for opts, q in session.queries] == [0, 2, 4]
+    assert mark.completion_ts == 1003.0
+    assert mark.task_ids == {4, 5}
+    mark.collected([94])
+    mark.save()
+
+    # the next poll only sees tasks after the watermark
+    session.tasks.append(make_task(6, 175, 1004.0))
+    session.queries.clear()
+    mark = poller.watermark(state)
+    latest = poller.poll(session, mark)
+    assert list(latest) == [175]
+    assert len(session.queries) == 1
+    assert mark.stale_hosts == {143: 5, 175: 6}
@@ -0,0 +1,118 @@
+import koji
+import pytest
+import requests
+import channel_validator as cv
+from checkpoint import checkpoint
+from resilience import circuit_breaker, circuit_open, is_retryable, retry_policy
+
+
+class flaky:
+    """
+    Raises the errors in order, then returns "ok"
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_is_retryable():
+    response = requests.Response()
+    response.status_code = 503
+    assert is_retryable(requests.HTTPError(response=response))
+    response.status_code = 404
+    assert not is_retryable(requests.HTTPError(response=response))
+    assert is_retryable(requests.ConnectionError())
+    assert is_retryable(requests.Timeout())
+    assert is_retryable(koji.ServerOffline())
+    assert not is_retryable(koji.GenericError("No such build"))
+    assert not is_retryable(ValueError())
+
+
+def test_retry_policy():
+    delays = []
+    policy = retry_policy(attempts=3, base=1, cap=3, sleep=delays.append)
+
+    fn = flaky(requests.ConnectionError(), requests.Timeout())
+    assert policy.call(fn) == "ok"
+    assert fn.calls == 3
+    assert policy.retries == 2
+    assert 0 <= delays[0] <= 1 and 0 <= delays[1] <= 2
+
+    fn = flaky(koji.GenericError("No such build"))
+    with pytest.raises(koji.GenericError):
+        policy.call(fn)
+    assert fn.calls == 1
+
+    fn = flaky(*[requests.ConnectionError()] * 3)
+    with pytest.raises(requests.ConnectionError):
+        policy.call(fn)
+    assert fn.calls == 3
+
+
+def test_circuit_breaker():
+    breaker = circuit_breaker(threshold=2, reset=60)
+    policy = retry_policy(attempts=2, breaker=breaker, sleep=lambda delay: None)
+
+    fn = flaky(requests.ConnectionError(), requests.ConnectionError())
+    with pytest.raises(requests.ConnectionError):
+        policy.call(fn)
+    # open now, calls fail fast without reaching the hub
+    fn = flaky()
+    with pytest.raises(circuit_open):
+        policy.call(fn)
+    assert fn.calls == 0
+
+    # after reset a trial call is let through and closes the circuit
+    breaker.opened_at -= 60
+    assert policy.call(fn) == "ok"
+    assert breaker.opened_at is None
+
+
+def test_checkpoint(tmp_path):
+    path = tmp_path / "run.ckpt"
+    ckpt = checkpoint(path)
+    ckpt.save_channels([{"id": 21, "name": "rhel8"}])
+    brew_hosts = [
+        {
+            "id": 94,
+            "name": "x86-019",
+            "enabled": True,
+            "arches": "x86_64 i386",
+            "description": None,
+        }
+    ]
+    ckpt.save_hosts(21, brew_hosts)
+
+    done = cv.host("x86-019", 94, True, "x86_64 i386", None)
+    done.hw_dict["CPU(s)"] = 8
+    done.hw_dict["Ram"] = 24050560
+    done.hw_source = "log"
+    done.task_list.append(cv.task(40263182, 40263155, {"build_id": 1}))
+    ckpt.save_host(done)
+    ckpt.close()
+    # a crash while writing leaves half a line behind
+    with open(path, "a") as fp:
+        fp.write('{"type": "host", "host_')
+
+    ckpt = checkpoint(path)
+    assert ckpt.channels == [{"id": 21, "name": "rhel8"}]
+    assert ckpt.channel_hosts == {21: brew_hosts}
+
+    restored = cv.host("x86-019", 94, True, "x86_64 i386", None)
+    assert ckpt.restore_host(restored) == "hw_parsed"
+    assert restored.hw_dict == done.hw_dict
+    assert restored.hw_source == "log"
+    assert restored.task_list[0].build_info == {"build_id": 1}
+    assert ckpt.restore_host(cv.host("x86-020", 95, True, "x86_64", None)) is None
+
+    # records written after the cut short line are still read back
+    ckpt.save_channels([])
+    ckpt.close()
+    assert checkpoint(path).channels == []
@@ -0,0 +1,105 @@
+import json
+import os
+import random
+import channel_validator as cv
+import sampling
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(TESTS_DIR, "fixtures")
+
+DESCRIPTION = (
+    "Updated: 2021-06-24\n"
+    "Operating System: RedHat 8.2\n"
+    "vCPU Count: 8\n"
+    "Total Memory: 23.497 gb"
+)
+
+
+def make_channel():
+    """
+    20 described x86_64 hosts and 5 ppc64le hosts without a description
+    """
+    brew_channel = cv.channel("rhel8", 21)
+    for host_id in range(1, 21):
+        brew_channel.host_list.append(
+            cv.host(f"x86-{host_id}", host_id, True, "x86_64 i386", DESCRIPTION)
+        )
+    for host_id in range(21, 26):
+        brew_channel.host_list.append(
+            cv.host(f"ppc-{host_id}", host_id, True, "ppc64le", None)
+        )
+    return brew_channel
+
+
+def test_stratify():
+    strata = sampling.stratify(make_channel().host_list)
+
+    assert [(s.key[0], len(s.hosts)) for s in strata] == [
+        (("i386", "x86_64"), 20),
+        (("ppc64le",), 5),
+    ]
+    assert strata[1].key[1] is None
+    assert sampling.sample_size(20) == 2
+    assert sampling.sample_size(200, 0.1) == 20
+    assert sampling.sample_size(1) == 1
+
+
+def test_validate_sample_escalates_disagreement():
+    looked_up = []
+
+    def lookup(host_list):
+        looked_up.append(sorted(h.id for h in host_list))
+        for hosts in host_list:
+            # ppc hosts 24 and 25 have twice the CPUs
+            hosts.hw_dict["CPU(s)"] = 16 if hosts.id >= 24 else 8
+            hosts.hw_dict["Ram"] = 24050560
+
+    brew_channel = make_channel()
+    strata = sampling.validate_sample(
+        brew_channel, lookup, fraction=0.1, minimum=3, rng=random.Random(4)
+    )
+
+    # 3 of each stratum, then the rest of the disagreeing ppc64le stratum
+    assert len(looked_up[0]) == 6
+    assert [s.escalated for s in strata] == [False, True]
+    assert looked_up[1] == sorted(
+        set(range(21, 26)) - set(looked_up[0]) - set(range(1, 21))
+    )
+
+    estimates = sampling.estimate_groups(strata)
+    assert [e.hosts[0].hw_dict["CPU(s)"] for e in estimates] == [8, 16]
+    # 20 x86_64 hosts estimated from 3, ppc64le hosts are exact
+    assert estimates[0].estimate == 23
+    assert estimates[0].low < 23 <= estimates[0].high == 23
+    # None of the 3 sampled x86_64 hosts has 16 CPUs, which doesn't rule
+    # out a few of the other 17
+    assert (estimates[1].estimate, estimates[1].low) == (2, 2)
+    assert 2 < estimates[1].high < 19
+
+
+def test_wilson_interval():
+    low, high = sampling.wilson_interval(3, 3)
+    assert high == 1.0
+    assert 0.4 < low < 0.5
+    assert sampling.wilson_interval(0, 0) == (0.0, 1.0)
+
+
+def test_stratify_listhosts_fixture():
+    """
+    Descriptions that only differ in the Ram tolerance or the OS minor
+    version share a stratum, so fewer hosts are looked up than listed
+    """
+    with open(os.path.join(FIXTURES_DIR, "calls", "listHosts.json")) as fp:
+        brew_channel = cv.channel("fixture", 1)
+        brew_channel.add_hosts(json.load(fp))
+    looked_up = []
+
+    strata = sampling.validate_sample(
+        brew_channel, looked_up.extend, rng=random.Random(0)
+    )
+
+    assert sampling.os_release("RedHat 8.2") == "RedHat 8"
+    # s390x hosts with RedHat 8.2 and 8.3 and 15.904 or 15.945 gb of memory
+    assert [h.id for h in strata[0].hosts] == [324, 325, 326, 327, 328]
+    assert len(strata) == 9
+    assert len(looked_up) == 12 < len(brew_channel.host_list)
@@ -0,0 +1,158 @@
+import os
+import yaml
+import pytest
+import channel_validator as cv
+import similarity
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+
+
+@pytest.fixture
+def fixture_hosts():
+    """
+    Hosts from tests/fixtures/hosts/hosts.yml with their hw_dict filled in
+    """
+    host_list = []
+    with open(os.path.join(TESTS_DIR, "fixtures", "hosts", "hosts.yml")) as fp:
+        host_yml = yaml.safe_load(fp)
+    for hosts in host_yml:
+        cur_yml = host_yml[hosts]
+        tmp_host = cv.host(
+            cur_yml["Name"],
+            cur_yml["id"],
+            cur_yml["enabled"],
+            cur_yml["arches"],
+            cur_yml["description"],
+        )
+        for key in tmp_host.hw_dict:
+            tmp_host.hw_dict[key] = cur_yml[key]
+        host_list.append(tmp_host)
+    return host_list
+
+
+def test_default_model_groups(fixture_hosts):
+    """
+    The default rules reproduce the compare_hosts grouping of the fixtures
+    """
+    channel = cv.channel(name="dummy-rhel8", id=21)
+    channel.host_list = fixture_hosts
+
+    groups = channel.config_check(model=similarity.similarity_model())
+
+    assert sorted(sorted(h.id for h in group) for group in groups) == [
+        [94, 143],
+        [157],
+        [167, 181],
+        [174, 176],
+        [175],
+    ]
+
+
+def test_rules(fixture_hosts):
+    by_id = {h.id: h for h in fixture_hosts}
+    strict = similarity.similarity_model(
+        {
+            "CPU(s)": {"rule": "exact"},
+            "Ram": {"rule": "relative", "tolerance": 0.01},
+            "Disk": {"rule": "exact"},
+        }
+    )
+
+    # 167 and 181 differ by 3% Ram and 1G of Disk
+    assert not strict.compare(by_id[167], by_id[181])
+    assert strict.compare(by_id[94], by_id[143])
+    assert cv.compare_hosts(by_id[94], by_id[143], model=strict)
+
+    with pytest.raises(ValueError):
+        similarity.similarity_model({"Ram": {"rule": "tolerance"}})
+
+
+def test_load_similarity(fixture_hosts):
+    config = similarity.load_similarity(os.path.join(REPO_DIR, "similarity.yml"))
+
+    default = config.model_for("rhel8")
+    vm = config.model_for("vm")
+
+    assert [rule.field for rule in default.rules] == ["CPU(s)", "Ram"]
+    assert [rule.field for rule in vm.rules] == ["Ram"]
+    assert config.model_for("vm") is vm
+    # ignoring CPU(s) puts the 4 and 16 CPU hosts with ~15G Ram together
+    assert len(vm.group(fixture_hosts)) < len(default.group(fixture_hosts))
+
+
+def test_cluster_matches_fixture_groups(fixture_hosts):
+    """
+    The cluster engine gives the groups hosts.yml was written for, whatever
+    order the hosts are in
+    """
+    expected = [[94, 143], [167, 181], [174, 176], [157], [175]]
+    channel = cv.channel(name="dummy-rhel8", id=21)
+
+    channel.host_list = fixture_hosts
+    groups = channel.config_check(engine="cluster")
+    assert [[h.id for h in group] for group in groups] == expected
+
+    channel.host_list = list(reversed(fixture_hosts))
+    groups = channel.config_check(engine="cluster")
+    assert [[h.id for h in group] for group in groups] == expected
+
+    with pytest.raises(ValueError):
+        channel.config_check(engine="kmeans")
+
+
+def test_cluster_keeps_chains_together():
+    """
+    Ram 10G, 13G and 16G with a 4G tolerance: greedy grouping splits the
+    chain depending on host order, clustering keeps it together
+    """
+    host_list = []
+    for host_id, ram in [(1, 16000000), (2, 10000000), (3, 13000000)]:
+        tmp_host = cv.host(f"host-{host_id}", host_id, True, "x86_64", None)
+        tmp_host.hw_dict["CPU(s)"] = 8
+        tmp_host.hw_dict["Ram"] = ram
+        host_list.append(tmp_host)
+    channel = cv.channel(name="chain", id=1)
+    channel.host_list = host_list
+
+    assert len(channel.config_check(engine="greedy")) == 2
+    channel.host_list = [host_list[2], host_list[1], host_list[0]]
+    assert len(channel.config_check(engine="greedy")) == 1
+
+    groups = channel.config_check(engine="cluster")
+    assert [[h.id for h in group] for group in groups] == [[1, 2, 3]]
+
+
+@pytest.mark.parametrize(
+    "rules",
+    [
+        similarity.DEFAULT_RULES,
+        {
+            "Ram": {"rule": "tolerance", "tolerance": 4000000},
+            "Disk": {"rule": "relative", "tolerance": 0.05},
+        },
+    ],
+)
+def test_cluster_identical_hosts_is_linear(rules, monkeypatch):
+    """
+    Hundreds of identical hosts are one cluster without comparing every pair
+    """
+    calls = []
+    matches = similarity.field_rule.matches
+
+    def counting_matches(self, a, b):
+        calls.append((a, b))
+        return matches(self, a, b)
+
+    monkeypatch.setattr(similarity.field_rule, "matches", counting_matches)
+    host_list = []
+    for host_id in range(500):
+        tmp_host = cv.host(f"host-{host_id}", host_id, True, "x86_64", None)
+        tmp_host.hw_dict["CPU(s)"] = 8
+        tmp_host.hw_dict["Ram"] = 16000000
+        tmp_host.hw_dict["Disk"] = "198G"
+        host_list.append(tmp_host)
+
+    groups = similarity.similarity_model(rules).cluster(host_list)
+    assert [len(group) for group in groups] == [500]
+    assert len(calls) < 2 * len(host_list)
@@ -0,0 +1,73 @@
+import channel_validator as cv
+import snapshot
+from snapshot import diff_channels, diff_snapshots, moved_hosts
+
+
+def make_host(host_id, cpus, ram):
+    tmp_host = cv.host(f"host-{host_id}", host_id, True, "x86_64", None)
+    tmp_host.hw_dict["CPU(s)"] = cpus
+    tmp_host.hw_dict["Ram"] = ram
+    return tmp_host
+
+
+def make_channel(channel_id, host_list):
+    tmp_channel = cv.channel(name=f"channel-{channel_id}", id=channel_id)
+    tmp_channel.host_list = host_list
+    tmp_channel.config_check()
+    return tmp_channel
+
+
+def test_moved_hosts():
+    # group indexes are renumbered, hosts 1 and 2 stay together
+    assert moved_hosts({1: 0, 2: 0, 3: 1}, {1: 1, 2: 1, 3: 0}) == []
+    # host 3 joins the group of hosts 1 and 2
+    assert moved_hosts({1: 0, 2: 0, 3: 1}, {1: 0, 2: 0, 3: 0}) == [3]
+    # host 2 is split off
+    assert moved_hosts({1: 0, 2: 0}, {1: 0, 2: 1}) == [2]
+    # host 1 is split off from hosts 2 and 3, host 4 joins them
+    assert moved_hosts({1: 0, 2: 0, 3: 0, 4: 1}, {1: 2, 2: 0, 3: 0, 4: 0}) == [
+        1,
+        4,
+    ]
+
+
+def test_diff_channels():
+    old = [
+        make_channel(1, [make_host(1, 8, 24000000), make_host(2, 8, 24000000)]),
+        make_channel(2, [make_host(3, 16, 32000000)]),
+    ]
+    new = [
+        make_channel(
+            1,
+            [
+                make_host(1, 8, 24000000),
+                make_host(2, 16, 32000000),
+                make_host(4, 8, 24000000),
+            ],
+        ),
+        make_channel(3, [make_host(3, 16, 32000000)]),
+    ]
+
+    diff = diff_channels(old, new)
+    assert diff.added_hosts == [4]
+    assert diff.removed_hosts == []
+    assert diff.joined == [(3, 3)]
+    assert diff.left == [(3, 2)]
+    assert diff.moved == [(2, 1)]
+    assert diff.hw_changed == [
+        (2, "cpus", 8, 16),
+        (2, "ram", 24000000, 32000000),
+    ]
+    assert diff_channels(old, old).is_empty()
+
+
+def test_save_load(tmp_path):
+    channels = [make_channel(1, [make_host(1, 8, 24000000), make_host(2, 8, 24000000)])]
+    taken = snapshot.snapshot.from_channels(channels)
+    path = tmp_path / "run.jsonl"
+    taken.save(path)
+
+    loaded = snapshot.snapshot.load(path)
+    assert loaded.hosts == taken.hosts
+    assert diff_snapshots(taken, loaded).is_empty()
+    assert snapshot.main([str(path), str(path)]) == 0